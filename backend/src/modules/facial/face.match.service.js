@@ -1,7 +1,6 @@
 //face.match.service.js
-const { spawn } = require('child_process');
-const path = require('path');
 const fs = require('fs');
+const {runFaceTask} = require('./face.worker');
 const PunchService = require('../attendance/punch.service');
 const CustomError = require('../../util/error');
 const punchHandler = PunchService({ CustomError, env: process.env });
@@ -21,79 +20,20 @@ const faceMatchService = () => {
         }
 
         const imagePath = file.path;
-        const pythonScriptPath = path.join(__dirname, '../../python/match_face.py');
 
         try {
-            const pythonProcess = spawn('python', [pythonScriptPath, imagePath, userId]);
-
-            let output = '';
-            let errorOutput = '';
-
-            console.log("face-match-service/before output chunk", new Date().toLocaleTimeString());
-            // Capture stdout (JSON response)
-            for await (const chunk of pythonProcess.stdout) {
-                const text = chunk.toString();
-                output += text;
-            }
-            console.log("face-match-service/after output chunk", new Date().toLocaleTimeString());
-
-            // Capture stderr
-            for await (const chunk of pythonProcess.stderr) {
-                const errorText = chunk.toString();
-                errorOutput += errorText;
-            }
-
-            // If there were timing logs, print them
-            if (errorOutput) {
-                console.log('\n=== Python Execution Timeline ===');
-                console.log(errorOutput);
-                console.log('=== End Python Timeline ===\n');
-            }
-
-            const exitCode = await new Promise(resolve => pythonProcess.on('close', resolve));
-
-            let parsed;
-            try {
-                const jsonLine = output
-                    .trim()
-                    .split('\n')
-                    .find(line => {
-                        try {
-                            JSON.parse(line);
-                            return true;
-                        } catch {
-                            return false;
-                        }
-                    });
-
-                if (!jsonLine) {
-                    throw new Error('No valid JSON found in Python output');
-                }
-
-                parsed = JSON.parse(jsonLine);
-            } catch (err) {
-                console.error("JSON parsing error:", err.message);
-                console.error("Raw Python output:", output);
-                console.error("Python error output:", errorOutput);
-                return {
-                    statusCode: 500,
-                    body: {
-                        success: false,
-                        message: 'Invalid response from face matching script',
-                        error: err.message,
-                    }
-                };
-            }
+            console.log("face-match-service/before face worker", new Date().toLocaleTimeString());
+            const {result: parsed, exitCode} = await runFaceTask('match', imagePath, userId);
+            console.log("face-match-service/after face worker", new Date().toLocaleTimeString(), JSON.stringify(parsed?.timings));
 
             if (exitCode !== 0) {
                 console.error("Python script failed with exit code:", exitCode);
-                console.error("Error output:", errorOutput);
                 return {
                     statusCode: 500,
                     body: {
                         success: false,
                         message: parsed?.error || 'Face matching script failed',
-                        error: errorOutput
+                        error: parsed?.error
                     }
                 };
             }
@@ -4,9 +4,8 @@
 // const __dirname = dirname(__filename);
 
 const db = require('../../config/dbConfig');
-const {spawn} = require('child_process');
-const path = require('path');
 const fs = require('fs');
+const {runFaceTask} = require('./face.worker');
 
 const faceRegistrationService = () => {
     return async function faceRegistrationHandler(httpRequest) {
@@ -29,22 +28,8 @@ const faceRegistrationService = () => {
 
         const imagePath = file.path;
         try {
-            // Run Python script
-            const pythonScriptPath = path.join(__dirname, '../../python/register_face.py');
-            const pythonProcess = spawn('python', [pythonScriptPath, imagePath, userId]);
-
-            let encoding = '';
-            const errorOutput = [];
-
-            for await (const chunk of pythonProcess.stdout) {
-                encoding += chunk.toString();
-            }
-
-            for await (const chunk of pythonProcess.stderr) {
-                errorOutput.push(chunk.toString());
-            }
-
-            const exitCode = await new Promise(resolve => pythonProcess.on('close', resolve));
+            // Run on the warm face worker
+            const {result, exitCode} = await runFaceTask('register', imagePath, userId);
 
             if (exitCode !== 0) {
                 return {
@@ -52,7 +37,7 @@ const faceRegistrationService = () => {
                     body: {
                         success: false,
                         message: 'Face processing failed',
-                        error: errorOutput.join('')
+                        error: result?.error
                     }
                 };
             }
@@ -0,0 +1,171 @@
+//face.worker.js
+// Keeps one warm python/face_worker.py process and talks to it over JSON lines,
+// so a punch no longer pays for interpreter start-up and model loading.
+const {spawn} = require('child_process');
+const http = require('http');
+const path = require('path');
+const readline = require('readline');
+
+const workerScriptPath = path.join(__dirname, '../../python/face_worker.py');
+
+let worker = null;
+let ready = null;
+let nextRequestId = 1;
+const pending = new Map();
+// A request the worker (or face service) never answers is failed after this long
+const taskTimeoutMs = Number(process.env.FACE_TASK_TIMEOUT_MS || 30000);
+
+function failPending(error) {
+    for (const {reject} of pending.values()) {
+        reject(error);
+    }
+    pending.clear();
+}
+
+function startFaceWorker() {
+    if (usesFaceService) {
+        // face_service.py holds the models; a local worker would load a second copy
+        return Promise.resolve();
+    }
+    if (worker) {
+        return ready;
+    }
+
+    const pythonProcess = spawn('python', [workerScriptPath]);
+    worker = pythonProcess;
+
+    ready = new Promise((resolve, reject) => {
+        const lines = readline.createInterface({input: pythonProcess.stdout});
+
+        lines.on('line', (line) => {
+            let message;
+            try {
+                message = JSON.parse(line);
+            } catch {
+                console.log('face-worker/unexpected output:', line);
+                return;
+            }
+
+            if (message.event === 'ready') {
+                console.log('face-worker/ready', new Date().toLocaleTimeString());
+                resolve();
+                return;
+            }
+
+            const request = pending.get(message.id);
+            if (request) {
+                pending.delete(message.id);
+                request.resolve({result: message.result, exitCode: message.exit_code});
+            }
+        });
+
+        pythonProcess.on('error', reject);
+        pythonProcess.on('close', (code) => {
+            console.error('face-worker/exited with code', code);
+            const error = new Error(`Face worker exited with code ${code}`);
+            if (worker === pythonProcess) {
+                worker = null;
+            }
+            reject(error);
+            failPending(error);
+        });
+    });
+
+    // Python timing logs
+    pythonProcess.stderr.on('data', (chunk) => process.stdout.write(chunk));
+
+    return ready;
+}
+
+// With FACE_SERVICE_SOCKET or FACE_SERVICE_URL set, requests go to a running
+// python/face_service.py instead, which queues them with bounded concurrency.
+const serviceSocket = process.env.FACE_SERVICE_SOCKET;
+const serviceUrl = process.env.FACE_SERVICE_URL;
+const usesFaceService = Boolean(serviceSocket || serviceUrl);
+const serviceMaxRetries = Number(process.env.FACE_SERVICE_MAX_RETRIES || 2);
+const serviceGetOps = {ping: '/health', stats: '/stats', metrics: '/metrics'};
+
+function requestFaceService(path, payload) {
+    return new Promise((resolve, reject) => {
+        const body = payload === undefined ? '' : JSON.stringify(payload);
+        const options = {
+            method: payload === undefined ? 'GET' : 'POST',
+            path,
+            headers: {'Content-Type': 'application/json', 'Content-Length': Buffer.byteLength(body)}
+        };
+        if (serviceSocket) {
+            options.socketPath = serviceSocket;
+        } else {
+            const url = new URL(serviceUrl);
+            options.hostname = url.hostname;
+            options.port = url.port;
+        }
+
+        const request = http.request(options, (response) => {
+            const chunks = [];
+            response.on('data', (chunk) => chunks.push(chunk));
+            response.on('end', () => resolve({
+                status: response.statusCode,
+                retryAfter: Number(response.headers['retry-after'] || 1),
+                body: Buffer.concat(chunks).toString()
+            }));
+        });
+        request.setTimeout(taskTimeoutMs, () => {
+            request.destroy(new Error(`Face service did not answer ${path} within ${taskTimeoutMs} ms`));
+        });
+        request.on('error', reject);
+        request.end(body);
+    });
+}
+
+async function runServiceTask(op, imagePath, employeeId) {
+    const path = serviceGetOps[op] || `/${op}`;
+    const payload = serviceGetOps[op] ? undefined : {image_path: imagePath, employee_id: employeeId};
+
+    for (let attempt = 0; ; attempt++) {
+        const response = await requestFaceService(path, payload);
+        if (response.status === 503 && attempt < serviceMaxRetries) {
+            // Queue is full; come back when the service expects it to have drained
+            await new Promise((resolve) => setTimeout(resolve, response.retryAfter * 1000));
+            continue;
+        }
+        if (op === 'metrics') {
+            return {result: {prometheus: response.body}, exitCode: 0};
+        }
+        const parsed = JSON.parse(response.body);
+        if (response.status !== 200) {
+            return {result: parsed, exitCode: 1};
+        }
+        return {result: parsed.result, exitCode: parsed.exit_code};
+    }
+}
+
+async function runFaceTask(op, imagePath, employeeId) {
+    if (usesFaceService) {
+        return runServiceTask(op, imagePath, employeeId);
+    }
+    await startFaceWorker();
+
+    const id = String(nextRequestId++);
+    const response = new Promise((resolve, reject) => {
+        const timer = setTimeout(() => {
+            // A late answer finds no pending entry and is dropped
+            pending.delete(id);
+            reject(new Error(`Face worker did not answer ${op} within ${taskTimeoutMs} ms`));
+        }, taskTimeoutMs);
+        pending.set(id, {
+            resolve: (value) => {
+                clearTimeout(timer);
+                resolve(value);
+            },
+            reject: (error) => {
+                clearTimeout(timer);
+                reject(error);
+            }
+        });
+    });
+    worker.stdin.write(JSON.stringify({id, op, image_path: imagePath, employee_id: employeeId}) + '\n');
+    return response;
+}
+
+module.exports = {startFaceWorker, runFaceTask, usesFaceService};
@@ -2,9 +2,16 @@ const FaceMatchService = require('./face.match.service');
 const FaceRegistrationService = require('./face.registration.service');
 const FaceIsAvailableService = require('./face.isAvailable.service');
 const CustomError = require('../../util/error');
+const {startFaceWorker, usesFaceService} = require('./face.worker');
 
 const faceMatchHandler = FaceMatchService({CustomError, env: process.env});
 const faceRegistrationHandler = FaceRegistrationService({CustomError, env: process.env});
 const faceIsAvailable = FaceIsAvailableService({CustomError, env: process.env});
 
+// Load the face models at boot instead of on the first punch, unless a
+// face_service.py already has them loaded
+if (!usesFaceService) {
+    startFaceWorker().catch(err => console.error('Face worker failed to start:', err.message));
+}
+
 module.exports = {faceMatchHandler, faceRegistrationHandler, faceIsAvailable};
\ No newline at end of file
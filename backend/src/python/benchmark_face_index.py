@@ -0,0 +1,108 @@
+# BENCHMARK: IVF FACE INDEX VS BRUTE FORCE
+# Synthetic gallery of employees x templates (clustered unit vectors like real
+# Facenet embeddings), probes are fresh noisy samples of random employees.
+# Reports build time, query latency and recall@1 / top-1 employee agreement
+# against an exact matrix scan for several nprobe values, as JSON. The
+# default list always includes the index's own default (FACE_INDEX_NPROBE, 64).
+#
+# Usage: python benchmark_face_index.py [--employees 20000] [--templates 10]
+#                                       [--queries 500] [--nprobe 4 8 16 32 64]
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from face_common import EMBEDDING_DIMENSION
+from face_index import FaceIndex, IDENTIFY_CANDIDATES, INDEX_NPROBE
+
+def synthetic_gallery(employees, templates, noise, rng):
+    identities = rng.normal(size=(employees, EMBEDDING_DIMENSION)).astype(np.float32)
+    identities /= np.linalg.norm(identities, axis=1, keepdims=True)
+    labels = np.repeat(np.arange(employees), templates)
+    matrix = identities[labels] + rng.normal(scale=noise, size=(len(labels), EMBEDDING_DIMENSION)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return identities, matrix, labels
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+def run(employees, templates, queries, nprobes, noise=0.08, seed=0):
+    rng = np.random.default_rng(seed)
+    identities, matrix, labels = synthetic_gallery(employees, templates, noise, rng)
+    row_ids = np.arange(len(labels))
+
+    started = time.perf_counter()
+    index = FaceIndex.train(matrix)
+    trained = time.perf_counter()
+    index.add(matrix, labels, row_ids)
+    built = time.perf_counter()
+
+    probe_labels = rng.integers(0, employees, queries)
+    probes = identities[probe_labels] + rng.normal(scale=noise, size=(queries, EMBEDDING_DIMENSION)).astype(np.float32)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+
+    # Exact reference
+    brute_times = []
+    exact_rows = []
+    for probe in probes:
+        t = time.perf_counter()
+        exact_rows.append(int(np.argmin(1.0 - matrix @ probe)))
+        brute_times.append(time.perf_counter() - t)
+
+    report = {
+        "rows": len(labels),
+        "employees": employees,
+        "templates_per_employee": templates,
+        "nlist": index.nlist,
+        "train_seconds": trained - started,
+        "add_seconds": built - trained,
+        "brute_force": {
+            "p50_ms": percentile_ms(brute_times, 50),
+            "p95_ms": percentile_ms(brute_times, 95),
+            "employee_accuracy": float(np.mean(labels[exact_rows] == probe_labels))
+        },
+        "ivf": []
+    }
+
+    for nprobe in nprobes:
+        times = []
+        identify_times = []
+        row_hits = 0
+        employee_hits = 0
+        reranked_hits = 0
+        for probe, exact_row in zip(probes, exact_rows):
+            t = time.perf_counter()
+            result = index.search(probe, k=1, nprobe=nprobe)
+            times.append(time.perf_counter() - t)
+            if result:
+                row_hits += result[0][2] == exact_row
+                employee_hits += result[0][0] == labels[exact_row]
+            # What match_face.identify_face does: candidates, then exact per-employee re-rank
+            t = time.perf_counter()
+            ranked = index.identify(probe, k=IDENTIFY_CANDIDATES, nprobe=nprobe)
+            identify_times.append(time.perf_counter() - t)
+            if ranked:
+                reranked_hits += ranked[0][0] == labels[exact_row]
+        report["ivf"].append({
+            "nprobe": nprobe,
+            "p50_ms": percentile_ms(times, 50),
+            "p95_ms": percentile_ms(times, 95),
+            "p99_ms": percentile_ms(times, 99),
+            "recall_at_1": row_hits / queries,
+            "employee_agreement": employee_hits / queries,
+            "identify_p95_ms": percentile_ms(identify_times, 95),
+            "employee_agreement_reranked": reranked_hits / queries
+        })
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall and latency of the IVF face index against brute force")
+    parser.add_argument("--employees", type=int, default=20000)
+    parser.add_argument("--templates", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=sorted({4, 8, 16, 32, INDEX_NPROBE}))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.employees, args.templates, args.queries, args.nprobe, seed=args.seed), indent=2))
+    sys.exit(0)
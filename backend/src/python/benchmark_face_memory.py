@@ -0,0 +1,130 @@
+# BENCHMARK: PEAK RSS PER STAGE, DEFAULT VS LOW-MEMORY MODE
+# For each mode, a fresh interpreter (FACE_TRACK_MEMORY=1, SQLite stand-in
+# unless FACE_DB_ENGINE is set) loads the models the way the face worker
+# does, registers every sample image as its own employee and matches each one
+# back, with the result cache off. Every span resets and reads the kernel's
+# RSS high-water mark, so the report has, per mode:
+#
+#   rss_mb        after imports, after model load + warm-up, after the requests
+#   stages        highest peak RSS seen in each stage over all requests
+#   peak_rss_mb   overall peak, i.e. what one worker needs
+#   workers_per_node  how many such workers fit in FACE_MEMORY_NODE_FRACTION
+#                 of this machine's memory (or --node-memory-mb)
+#
+# Usage: python benchmark_face_memory.py <image dir> [--modes default,low]
+#                                        [--node-memory-mb 32768] [--output report.json]
+import os
+os.environ.setdefault("FACE_DB_ENGINE", "sqlite")
+
+import sys
+import json
+import math
+import argparse
+import subprocess
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+MODES = {"default": "0", "low": "1"}
+NODE_FRACTION = float(os.getenv("FACE_MEMORY_NODE_FRACTION", 0.9))  # leave room for the OS and Node
+
+def node_memory_mb():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+def list_images(directory):
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+
+def seed_employee(employee_id, conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id FROM employee WHERE id = %s", (employee_id,))
+        if not cursor.fetchall():
+            cursor.execute("INSERT INTO employee (id, name) VALUES (%s, %s)", (employee_id, f"benchmark {employee_id}"))
+        conn.commit()
+    finally:
+        cursor.close()
+
+def mode_child(images):
+    """Runs in a fresh interpreter with the mode's environment"""
+    from face_common import current_rss_mb
+    from face_memory import configure_low_memory, peak_rss_mb, release_memory, LOW_MEMORY
+    from face_db import get_db_connection
+    from face_metrics import STAGE_PEAK_RSS
+    from match_face import run_match
+    from register_face import run_register
+    from face_worker import configure_inference_threads, preload_models, warm_up
+
+    rss = {"imported": current_rss_mb()}
+    configure_low_memory()
+    configure_inference_threads()
+    preload_models()
+    # Spans reset the high-water mark, so read the model-load peak before any runs
+    load_peak = peak_rss_mb()
+    warm_up()
+    rss["models_loaded"] = current_rss_mb()
+
+    conn = get_db_connection()
+    stages = {}
+    outcomes = {}
+    for employee_id, image_path in enumerate(images, start=1):
+        seed_employee(employee_id, conn)
+        for op, run in (("register", run_register), ("match", run_match)):
+            response, exit_code = run(image_path, str(employee_id), conn)
+            outcome = "ok" if exit_code == 0 and not response.get("error") else "error"
+            outcomes[f"{op}_{outcome}"] = outcomes.get(f"{op}_{outcome}", 0) + 1
+            for stage, peak in response.get("memory", {}).get("peak_rss_mb", {}).items():
+                key = f"{op}.{stage}"
+                stages[key] = max(peak, stages.get(key, 0.0))
+    conn.close()
+
+    if LOW_MEMORY:
+        release_memory()
+    rss["after_requests"] = current_rss_mb()
+    warm_up_peaks = list(STAGE_PEAK_RSS.snapshot().values())
+    peak = max([load_peak, peak_rss_mb(), *rss.values(), *stages.values(), *warm_up_peaks])
+    return {"rss_mb": rss, "stages": stages, "peak_rss_mb": peak, "outcomes": outcomes}
+
+def run_mode(mode, image_dir):
+    env = dict(os.environ, FACE_LOW_MEMORY=MODES[mode], FACE_TRACK_MEMORY="1", FACE_RESULT_CACHE_SIZE="0")
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), image_dir, "--mode-child"],
+        check=True, stdout=subprocess.PIPE, env=env
+    ).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak RSS per face pipeline stage, default vs low-memory mode")
+    parser.add_argument("images", help="Directory of sample face images (one face each)")
+    parser.add_argument("--modes", default="default,low", help="Comma-separated modes: default, low")
+    parser.add_argument("--node-memory-mb", type=float, help="Memory of the target node (default: this machine)")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--mode-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Libraries print progress to stdout; keep it for the report only
+    report_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    images = list_images(args.images)
+    if not images:
+        sys.exit(f"No images found in {args.images}")
+    if args.mode_child:
+        report_out.write(json.dumps(mode_child(images)) + "\n")
+        sys.exit(0)
+
+    node_mb = args.node_memory_mb or node_memory_mb()
+    report = {"images": len(images), "node_memory_mb": node_mb, "modes": {}}
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        if mode not in MODES:
+            sys.exit(f"Unknown mode: {mode}")
+        result = run_mode(mode, args.images)
+        result["workers_per_node"] = math.floor(node_mb * NODE_FRACTION / result["peak_rss_mb"]) if node_mb else None
+        report["modes"][mode] = result
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    report_out.write(json.dumps(report, indent=2) + "\n")
+    sys.exit(0)
@@ -0,0 +1,354 @@
+# BENCHMARK: PER-STAGE LATENCY OF THE REGISTER AND MATCH PIPELINES
+# Runs the register_face.py / match_face.py stages on a corpus of sample images
+# against the SQLite stand-in from face_db.py (unless FACE_DB_ENGINE is set),
+# timing every stage separately:
+#
+#   register: decode, cascade, detect, liveness, embed, store
+#   match:    decode, cascade, detect, liveness, embed, db_fetch, compare, insert
+#
+# "cascade" is the cheap first-stage detector (plus the quality gate) and
+# "detect" is MTCNN on its region of interest. "quick_reject" times a
+# faceless frame turned away by the cascade before any deep model runs.
+#
+# Each person is enrolled with one image and matched with a different one, so
+# the probe is a new sample and the template insert really stores a row
+# (template_actions in the report counts what it did). The image directory
+# either holds one subdirectory per person (first image enrolls, second
+# probes) or one image per person, probed with its mirror image.
+#
+# "cold" runs each of --cold-runs fresh interpreters through a rejected match
+# (unregistered employee, which must not load TensorFlow), one register and
+# one match; model loading lands in the first stage that needs it. "warm"
+# reuses one process after the face worker's warm-up. Output is p50/p95/p99
+# per stage plus throughput and an import-time profile of the entry points,
+# as JSON that can be diffed between releases.
+#
+# Usage: python benchmark_face_pipeline.py <image dir> [--iterations 50]
+#                                          [--cold-runs 3] [--gallery-size 10] [--output report.json]
+import os
+os.environ.setdefault("FACE_DB_ENGINE", "sqlite")
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+from contextlib import contextmanager
+import numpy as np
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+class StageTimer:
+    """Collects wall-clock samples per named stage"""
+
+    def __init__(self):
+        self.samples = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.setdefault(name, []).append(time.perf_counter() - started)
+
+    def merge(self, stages):
+        for name, seconds in stages.items():
+            self.samples.setdefault(name, []).extend(seconds if isinstance(seconds, list) else [seconds])
+
+    def summary(self):
+        return {name: summarize(seconds) for name, seconds in self.samples.items()}
+
+def summarize(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {
+        "n": len(ms),
+        "mean_ms": float(np.mean(ms)),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99))
+    }
+
+def list_images(directory):
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+
+def list_people(directory):
+    """[(enrollment image, probe image or None for its mirror)], one per person"""
+    people = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            images = list_images(path)
+            if images:
+                people.append((images[0], images[1] if len(images) > 1 else None))
+    return people or [(image, None) for image in list_images(directory)]
+
+def detect_single_face(img, timer):
+    from face_metrics import traced_request
+    from face_pipeline import detect_faces, check_liveness
+
+    with traced_request("benchmark") as trace:
+        started = time.perf_counter()
+        faces = detect_faces(img)
+        elapsed = time.perf_counter() - started
+    # Split the pipeline's own cascade / quality spans out of the MTCNN time
+    cascade = sum(seconds for name, seconds in trace.spans if name in ("cascade", "quality"))
+    timer.merge({"cascade": cascade, "detect": elapsed - cascade})
+    with timer.stage("liveness"):
+        check_liveness(img, faces[0]["facial_area"])
+    return faces[0]
+
+def register_once(image_path, employee_id, conn, timer):
+    """One register_face.py pass; returns the normalized embedding"""
+    from face_pipeline import load_bgr_image, embed_faces
+    from face_gallery import normalize_embedding
+    from face_encoding import encode_face_encoding
+    from register_face import store_face_data_binary
+
+    with timer.stage("decode"):
+        with open(image_path, "rb") as f:
+            img = load_bgr_image(f.read())
+    face = detect_single_face(img, timer)
+    with timer.stage("embed"):
+        embedding = normalize_embedding(embed_faces([face["face"]])[0])
+    with timer.stage("store"):
+        store_face_data_binary(employee_id, encode_face_encoding(embedding, normalized=True), conn)
+    return embedding
+
+def match_once(person, employee_id, conn, timer, actions):
+    """One match_face.py pass with the gallery cache bypassed, probing with a different image than enrolled"""
+    from face_pipeline import load_bgr_image, embed_faces
+    from face_common import MATCH_THRESHOLD
+    from face_gallery import FaceGallery, normalize_embedding
+    from match_face import get_recent_face_encodings, store_matched_template
+
+    enrollment, probe_path = person
+    with timer.stage("decode"):
+        with open(probe_path or enrollment, "rb") as f:
+            img = load_bgr_image(f.read())
+    if probe_path is None:
+        img = np.ascontiguousarray(img[:, ::-1])
+    face = detect_single_face(img, timer)
+    with timer.stage("embed"):
+        probe = normalize_embedding(embed_faces([face["face"]])[0])
+    with timer.stage("db_fetch"):
+        gallery = FaceGallery.from_records(get_recent_face_encodings(employee_id, conn))
+    with timer.stage("compare"):
+        matches, _ = gallery.compare(probe, MATCH_THRESHOLD)
+    with timer.stage("insert"):
+        template = store_matched_template(employee_id, probe, gallery, conn)
+    action = template["action"] if template else "failed"
+    actions[action] = actions.get(action, 0) + 1
+    return bool(matches)
+
+def quick_reject_once(img, timer, reasons):
+    """A frame without a face: the cascade (or the quality gate) should turn it away"""
+    from face_pipeline import detect_faces, FaceRejected
+
+    with timer.stage("quick_reject"):
+        try:
+            detect_faces(img)
+            reason = "not_rejected"
+        except FaceRejected as rejected:
+            reason = rejected.reason
+    reasons[reason] = reasons.get(reason, 0) + 1
+
+def seed_employee(employee_id, conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id FROM employee WHERE id = %s", (employee_id,))
+        if not cursor.fetchall():
+            cursor.execute("INSERT INTO employee (id, name) VALUES (%s, %s)", (employee_id, f"benchmark {employee_id}"))
+        conn.commit()
+    finally:
+        cursor.close()
+
+def pad_gallery(employee_id, embedding, size, conn, rng):
+    """Add noisy copies of the enrollment so matching sees a realistic template count.
+
+    The noise puts them about 0.09 apart in cosine distance: distinct templates
+    (past DUPLICATE_DISTANCE) of the same person (well inside MATCH_THRESHOLD).
+    """
+    from face_db import insert_face_encoding
+    from face_encoding import encode_face_encoding
+    from face_gallery import normalize_embedding
+
+    for _ in range(size - 1):
+        sample = normalize_embedding(embedding + rng.normal(scale=0.04, size=embedding.shape))
+        insert_face_encoding(conn, employee_id, encode_face_encoding(sample, normalized=True))
+    conn.commit()
+
+def cold_child(image_path, probe_path, gallery_size):
+    """Runs in a fresh interpreter: time imports and a fast-fail, then one register and one match"""
+    timer = StageTimer()
+    with timer.stage("import"):
+        from match_face import run_match
+        from face_db import get_db_connection
+
+    conn = get_db_connection()
+    seed_employee(1, conn)
+    with timer.stage("fast_fail"):
+        _, exit_code = run_match(image_path, 1, conn)
+    fast_fail_loaded_tensorflow = "tensorflow" in sys.modules
+
+    register_timer = StageTimer()
+    embedding = register_once(image_path, 1, conn, register_timer)
+    pad_gallery(1, embedding, gallery_size, conn, np.random.default_rng(0))
+    match_timer = StageTimer()
+    actions = {}
+    match_once((image_path, probe_path), 1, conn, match_timer, actions)
+    conn.close()
+    return {
+        "import": timer.samples["import"][0],
+        "fast_fail": timer.samples["fast_fail"][0],
+        "fast_fail_exit_code": exit_code,
+        "fast_fail_loaded_tensorflow": fast_fail_loaded_tensorflow,
+        "register": register_timer.samples,
+        "match": match_timer.samples,
+        "template_actions": actions
+    }
+
+def import_profile(module, top=10):
+    """Import cost of one module in a fresh interpreter, from python -X importtime"""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True, stderr=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__))
+    ).stderr.decode()
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(cumulative) / 1000, depth))
+    total = next((ms for name, ms, _ in entries if name == module), None)
+    # Direct dependencies of the module, most expensive first
+    children = sorted((e for e in entries if e[2] == 1), key=lambda e: -e[1])[:top]
+    return {"total_ms": total, "top": [{"module": name, "cumulative_ms": ms} for name, ms, _ in children]}
+
+def run_cold(people, runs, gallery_size):
+    process_seconds = []
+    fast_fail = {"loaded_tensorflow": False, "exit_codes": []}
+    imports = StageTimer()
+    register = StageTimer()
+    match = StageTimer()
+    actions = {}
+    for run in range(runs):
+        image_path, probe_path = people[run % len(people)]
+        command = [sys.executable, os.path.abspath(__file__), "--cold-child", image_path, "--gallery-size", str(gallery_size)]
+        if probe_path:
+            command += ["--probe", probe_path]
+        started = time.perf_counter()
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, env=dict(os.environ)).stdout
+        process_seconds.append(time.perf_counter() - started)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        imports.merge({"import": result["import"], "fast_fail": result["fast_fail"]})
+        fast_fail["loaded_tensorflow"] |= result["fast_fail_loaded_tensorflow"]
+        fast_fail["exit_codes"].append(result["fast_fail_exit_code"])
+        register.merge(result["register"])
+        match.merge(result["match"])
+        for action, count in result["template_actions"].items():
+            actions[action] = actions.get(action, 0) + count
+    return {
+        "runs": runs,
+        "process": summarize(process_seconds),
+        "import": imports.summary()["import"],
+        "fast_fail": {**imports.summary()["fast_fail"], **fast_fail},
+        "register": register.summary(),
+        "match": match.summary(),
+        "template_actions": actions
+    }
+
+def run_warm(people, iterations, gallery_size):
+    from face_db import get_db_connection
+    from face_worker import preload_models, warm_up
+
+    preload_models()
+    warm_up()
+    conn = get_db_connection()
+    rng = np.random.default_rng(0)
+
+    # Each person is its own employee
+    register = StageTimer()
+    embeddings = {}
+    started = time.perf_counter()
+    for i in range(iterations):
+        employee_id = i % len(people) + 1
+        seed_employee(employee_id, conn)
+        embeddings[employee_id] = register_once(people[employee_id - 1][0], employee_id, conn, register)
+    register_seconds = time.perf_counter() - started
+
+    for employee_id, embedding in embeddings.items():
+        pad_gallery(employee_id, embedding, gallery_size, conn, rng)
+
+    match = StageTimer()
+    matched = 0
+    actions = {}
+    started = time.perf_counter()
+    for i in range(iterations):
+        employee_id = i % len(people) + 1
+        matched += match_once(people[employee_id - 1], employee_id, conn, match, actions)
+    match_seconds = time.perf_counter() - started
+    conn.close()
+
+    # Uniform noise: bright and contrasty enough for the frame gate, no face for the cascade
+    faceless = rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+    quick_reject = StageTimer()
+    reject_reasons = {}
+    for _ in range(iterations):
+        quick_reject_once(faceless, quick_reject, reject_reasons)
+
+    return {
+        "iterations": iterations,
+        "register": register.summary(),
+        "match": match.summary(),
+        "match_rate": matched / iterations,
+        "template_actions": actions,
+        "quick_reject": {**quick_reject.summary()["quick_reject"], "reasons": reject_reasons},
+        "throughput_per_second": {
+            "register": iterations / register_seconds,
+            "match": iterations / match_seconds
+        }
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage latency of the face register and match pipelines")
+    parser.add_argument("images", help="Directory of sample face images (one face each), or of one subdirectory per person")
+    parser.add_argument("--iterations", type=int, default=50, help="Warm iterations per pipeline")
+    parser.add_argument("--cold-runs", type=int, default=3, help="Fresh processes for the cold measurement")
+    parser.add_argument("--gallery-size", type=int, default=10, help="Templates per employee when matching")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--cold-child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Libraries print progress to stdout; keep it for the report only
+    report_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    if args.cold_child:
+        report_out.write(json.dumps(cold_child(args.images, args.probe, args.gallery_size)) + "\n")
+        sys.exit(0)
+
+    people = list_people(args.images)
+    if not people:
+        sys.exit(f"No images found in {args.images}")
+
+    report = {
+        "config": {
+            "people": len(people),
+            "mirrored_probes": sum(probe is None for _, probe in people),
+            "iterations": args.iterations,
+            "gallery_size": args.gallery_size,
+            "db_engine": os.environ["FACE_DB_ENGINE"]
+        },
+        "import_profile": {module: import_profile(module) for module in ("match_face", "register_face", "deepface")},
+        "cold": run_cold(people, args.cold_runs, args.gallery_size),
+        "warm": run_warm(people, args.iterations, args.gallery_size)
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    report_out.write(json.dumps(report, indent=2) + "\n")
+    sys.exit(0)
@@ -0,0 +1,95 @@
+# BENCHMARK: FULL DECODE + RESIZE VS REDUCED-SCALE JPEG DECODE
+# For every image in a directory, times the old ingest (full cv2.imdecode then
+# an INTER_AREA resize to TARGET_SIZE) against face_image.load_image (header
+# read, DCT-scaled decode, EXIF orientation on the small array, final resize)
+# and measures the peak RSS each one adds. Also reports how far apart the two
+# outputs are, so a quality regression shows up next to the speed-up.
+#
+# Usage: python benchmark_image_decode.py <image dir> [--repeats 5] [--output report.json]
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from face_common import current_rss_mb
+from face_image import load_image, resize_to_fit, jpeg_header, reduction_factor, TARGET_SIZE
+from face_memory import reset_peak_rss, peak_rss_mb, release_memory
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+def full_decode(data):
+    """The ingest before reduced decoding: decode every pixel, then shrink"""
+    import cv2
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return resize_to_fit(img, TARGET_SIZE)
+
+def measure(decode, data, repeats):
+    """(output, median seconds, peak RSS added in MB)"""
+    release_memory()
+    baseline = current_rss_mb()
+    reset_peak_rss()
+    output = decode(data)
+    peak_added = max(0.0, peak_rss_mb() - baseline)
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        decode(data)
+        seconds.append(time.perf_counter() - started)
+    return output, float(np.median(seconds)), peak_added
+
+def benchmark(images, repeats):
+    rows = []
+    for image_path in images:
+        with open(image_path, "rb") as f:
+            data = f.read()
+        header = jpeg_header(data)
+        if header and header[2] >= 5:
+            header = (header[1], header[0], header[2])
+        full, full_seconds, full_peak = measure(full_decode, data, repeats)
+        reduced, reduced_seconds, reduced_peak = measure(load_image, data, repeats)
+
+        row = {
+            "image": os.path.basename(image_path),
+            "source_size": [header[0], header[1]] if header else [int(full.shape[1]), int(full.shape[0])],
+            "exif_orientation": header[2] if header else None,
+            "reduction": reduction_factor(header[0], header[1]) if header else 1,
+            "output_size": [int(reduced.shape[1]), int(reduced.shape[0])],
+            "decode_ms": {"full": full_seconds * 1000, "reduced": reduced_seconds * 1000},
+            "peak_rss_added_mb": {"full": full_peak, "reduced": reduced_peak}
+        }
+        # Only comparable when the old path came out upright too
+        if full.shape == reduced.shape:
+            row["mean_abs_diff"] = float(np.mean(np.abs(full.astype(np.int16) - reduced.astype(np.int16))))
+        rows.append(row)
+
+    def column(path):
+        return [row[path[0]][path[1]] for row in rows]
+
+    return {
+        "images": len(rows),
+        "target_size": list(TARGET_SIZE),
+        "decode_ms_p50": {name: float(np.median(column(("decode_ms", name)))) for name in ("full", "reduced")},
+        "peak_rss_added_mb_max": {name: float(np.max(column(("peak_rss_added_mb", name)))) for name in ("full", "reduced")},
+        "rotated_images": sum(1 for row in rows if (row["exif_orientation"] or 1) != 1),
+        "per_image": rows
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode time and peak memory: full decode vs reduced-scale JPEG decode")
+    parser.add_argument("images", help="Directory of sample photos")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed decodes per image and method")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    # Decode logging goes to stderr; keep stdout for the report only
+    images = [os.path.join(args.images, name) for name in sorted(os.listdir(args.images))
+              if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+    if not images:
+        sys.exit(f"No images found in {args.images}")
+    report = benchmark(images, args.repeats)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    sys.exit(0)
@@ -0,0 +1,117 @@
+# BENCHMARK: MEMORY OF THE PRE-FORK POOL VS INDEPENDENT WORKERS
+# Starts face_service.py with FACE_SERVICE_WORKERS=N, waits until all N
+# workers have warmed up and answer /health, and sums the memory of the parent
+# and its workers. Then starts N independent face_worker.py processes (each
+# loading its own models) and does the same.
+#
+# RSS counts shared pages once per process, so summed RSS overstates both
+# setups; PSS splits each shared page between the processes mapping it and
+# USS counts only private pages, which is what copy-on-write sharing saves.
+# Pool workers build their models after the fork, so the saving is the
+# imported code and libraries, not the model weights.
+#
+# Usage: python benchmark_worker_pool.py [--workers 4] [--port 18765]
+#                                        [--timeout 600] [--output report.json]
+import os
+os.environ.setdefault("FACE_DB_ENGINE", "sqlite")
+
+import sys
+import json
+import time
+import signal
+import argparse
+import subprocess
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def process_memory_mb(pid):
+    """{"rss", "pss", "uss"} of one process in MB, from /proc/<pid>/smaps_rollup"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss": fields.get("Rss", 0.0),
+        "pss": fields.get("Pss", 0.0),
+        "uss": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0)
+    }
+
+def total_memory(pids):
+    per_process = [process_memory_mb(pid) for pid in pids]
+    totals = {f"{key}_total_mb": sum(p[key] for p in per_process) for key in ("rss", "pss", "uss")}
+    return {"processes": len(pids), **totals, "per_process": per_process}
+
+def child_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+def wait_for_pool(port, workers, deadline):
+    """Poll /health until every forked worker has answered at least once"""
+    seen = set()
+    while len(seen) < workers:
+        if time.time() > deadline:
+            raise TimeoutError(f"Only {len(seen)} of {workers} pool workers answered")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=5) as response:
+                seen.add(json.loads(response.read())["result"]["pid"])
+        except OSError:
+            time.sleep(0.5)
+
+def measure_pool(workers, port, timeout):
+    env = dict(os.environ, FACE_SERVICE_WORKERS=str(workers), FACE_SERVICE_PORT=str(port), FACE_SERVICE_SOCKET="")
+    parent = subprocess.Popen([sys.executable, os.path.join(HERE, "face_service.py")], env=env)
+    try:
+        started = time.time()
+        wait_for_pool(port, workers, started + timeout)
+        ready_seconds = time.time() - started
+        return {"ready_seconds": ready_seconds, **total_memory([parent.pid] + child_pids(parent.pid))}
+    finally:
+        parent.send_signal(signal.SIGTERM)
+        parent.wait(timeout=60)
+
+def measure_independent(workers, timeout):
+    processes = [
+        subprocess.Popen([sys.executable, os.path.join(HERE, "face_worker.py")],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=dict(os.environ))
+        for _ in range(workers)
+    ]
+    try:
+        started = time.time()
+        for process in processes:
+            # face_worker.py prints {"event": "ready"} once its models are loaded and warm
+            while json.loads(process.stdout.readline() or b'{"event": "exited"}').get("event") != "ready":
+                if process.poll() is not None or time.time() > started + timeout:
+                    raise TimeoutError("Independent face worker did not become ready")
+        ready_seconds = time.time() - started
+        return {"ready_seconds": ready_seconds, **total_memory([process.pid for process in processes])}
+    finally:
+        for process in processes:
+            process.stdin.close()
+            process.wait(timeout=60)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory of the pre-fork face service pool vs independent workers")
+    parser.add_argument("--workers", type=int, default=4, help="Pool workers / independent processes")
+    parser.add_argument("--port", type=int, default=18765, help="Port for the pool under test")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for models to load")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    pool = measure_pool(args.workers, args.port, args.timeout)
+    independent = measure_independent(args.workers, args.timeout)
+    report = {
+        "workers": args.workers,
+        "pool": pool,
+        "independent": independent,
+        "saved_mb": {
+            key: independent[f"{key}_total_mb"] - pool[f"{key}_total_mb"] for key in ("rss", "pss", "uss")
+        }
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    sys.exit(0)
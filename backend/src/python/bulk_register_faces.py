@@ -0,0 +1,202 @@
+# BULK FACE ENROLLMENT
+# Registers a whole office in one run instead of one register_face.py process
+# per image. Decoding, detection and liveness run in a process pool, aligned
+# crops are embedded in Facenet batches in the parent, and face_data rows are
+# written with executemany, one transaction per chunk of employees.
+#
+# Input is either a directory of images named <employee_id>[_anything].<ext>
+# or a CSV with employee_id,image_path columns. Several images for the same
+# employee become that employee's template set.
+#
+# Usage: python bulk_register_faces.py <directory | file.csv> [--workers 4]
+#                                      [--batch-size 32] [--chunk-size 100] [--dry-run]
+from dotenv import load_dotenv
+import os
+import sys
+import csv
+import json
+import argparse
+import multiprocessing
+import numpy as np
+from face_common import log_with_time, EMBEDDING_DIMENSION
+from face_db import get_db_connection, statement_sql
+from face_encoding import encode_face_encoding
+from face_gallery import normalize_embedding
+from face_templates import MAX_TEMPLATES_PER_EMPLOYEE, select_diverse_templates, archive_face_rows
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+def list_enrollment_jobs(source):
+    """Returns [(employee_id, image_path), ...] from a directory or a CSV file"""
+    if os.path.isdir(source):
+        jobs = []
+        for name in sorted(os.listdir(source)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() in IMAGE_EXTENSIONS:
+                jobs.append((stem.split("_")[0], os.path.join(source, name)))
+        return jobs
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as f:
+        reader = csv.DictReader(f)
+        # Relative image paths are relative to the CSV
+        return [(row["employee_id"].strip(), os.path.join(base, row["image_path"].strip()))
+                for row in reader if row.get("employee_id") and row.get("image_path")]
+
+def prepare_face(job):
+    """Pool task: decode, detect and liveness-check one image.
+
+    Returns (employee_id, image_path, aligned crop or None, failure dict or None).
+    """
+    # Imported here so only pool processes load the detector and Fasnet
+    from face_pipeline import load_bgr_image, detect_faces, check_liveness, FaceRejected
+
+    employee_id, image_path = job
+    try:
+        img = load_bgr_image(image_path)
+        faces = detect_faces(img)
+        if not faces:
+            raise FaceRejected("no_face", "No face detected in the image")
+        if len(faces) > 1:
+            raise FaceRejected("multiple_faces", "Multiple faces detected. Please ensure only one face is visible.")
+        is_real, _ = check_liveness(img, faces[0]["facial_area"])
+        if not is_real:
+            raise FaceRejected("spoof", "Please use a real face, not a photo or video")
+        return employee_id, image_path, faces[0]["face"].astype(np.float32), None
+    except FaceRejected as rejected:
+        return employee_id, image_path, None, {"reason": rejected.reason, "error": str(rejected)}
+    except Exception as e:
+        return employee_id, image_path, None, {"reason": "error", "error": str(e)}
+
+def embed_crops(crops, batch_size):
+    """Normalized Facenet embeddings for aligned crops, batch_size crops per forward pass"""
+    from face_pipeline import embed_faces
+
+    embeddings = []
+    for start in range(0, len(crops), batch_size):
+        embeddings.append(embed_faces(crops[start:start + batch_size]))
+        log_with_time(f"Embedded {min(start + batch_size, len(crops))}/{len(crops)} faces")
+    if not embeddings:
+        return np.empty((0, EMBEDDING_DIMENSION), dtype=np.float32)
+    return np.concatenate(embeddings).astype(np.float32)
+
+def store_enrollments(enrollments, cursor):
+    """Replace the template sets of a chunk of employees with set-based statements.
+
+    enrollments maps employee id -> (n, d) normalized embeddings. Returns the
+    ids that are not in the employee table (nothing is written for them).
+    """
+    employee_ids = list(enrollments)
+    placeholders = ", ".join(["%s"] * len(employee_ids))
+    cursor.execute(f"SELECT id FROM employee WHERE id IN ({placeholders})", tuple(employee_ids))
+    known = {row[0] for row in cursor.fetchall()}
+    missing = [employee_id for employee_id in employee_ids if employee_id not in known]
+    employee_ids = [employee_id for employee_id in employee_ids if employee_id in known]
+    if not employee_ids:
+        return missing
+
+    # Re-registration starts a fresh template set, as in register_face.py
+    placeholders = ", ".join(["%s"] * len(employee_ids))
+    cursor.execute(f"SELECT id FROM face_data WHERE employeeID IN ({placeholders})", tuple(employee_ids))
+    archive_face_rows([row[0] for row in cursor.fetchall()], cursor)
+
+    face_rows = []
+    centroid_rows = []
+    for employee_id in employee_ids:
+        matrix = enrollments[employee_id]
+        for i in select_diverse_templates(matrix, MAX_TEMPLATES_PER_EMPLOYEE):
+            face_rows.append((employee_id, encode_face_encoding(matrix[i], normalized=True)))
+        centroid_rows.append((employee_id, encode_face_encoding(np.mean(matrix, axis=0)), len(matrix)))
+
+    cursor.executemany(statement_sql("insert_encoding"), face_rows)
+    cursor.executemany(statement_sql("upsert_centroid"), centroid_rows)
+    return missing
+
+def bulk_register(jobs, conn, workers=4, batch_size=32, chunk_size=100, dry_run=False):
+    stats = {"images": len(jobs), "enrolled_images": 0, "enrolled_employees": 0, "failed": 0}
+    failures = []
+
+    def fail(employee_id, image_path, reason, error):
+        stats["failed"] += 1
+        failures.append({"employee_id": employee_id, "image": image_path, "reason": reason, "error": error})
+
+    valid_jobs = []
+    for employee_id, image_path in jobs:
+        if employee_id.isdigit():
+            valid_jobs.append((employee_id, image_path))
+        else:
+            fail(employee_id, image_path, "invalid_employee_id", "employee_id must be a valid integer")
+
+    # TensorFlow is not fork-safe once initialized, so pool processes are spawned
+    log_with_time(f"Detecting faces in {len(valid_jobs)} images with {workers} processes")
+    prepared = []
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        for done, (employee_id, image_path, crop, failure) in enumerate(
+                pool.imap_unordered(prepare_face, valid_jobs, chunksize=4), 1):
+            if failure:
+                fail(employee_id, image_path, failure["reason"], failure["error"])
+            else:
+                prepared.append((int(employee_id), image_path, crop))
+            if done % 50 == 0:
+                log_with_time(f"Detected {done}/{len(valid_jobs)} images")
+
+    embeddings = embed_crops([crop for _, _, crop in prepared], batch_size)
+
+    enrollments = {}
+    images = {}
+    for (employee_id, image_path, _), embedding in zip(prepared, embeddings):
+        try:
+            embedding = normalize_embedding(embedding)
+        except ValueError as e:
+            fail(employee_id, image_path, "error", str(e))
+            continue
+        enrollments.setdefault(employee_id, []).append(embedding)
+        images.setdefault(employee_id, []).append(image_path)
+
+    employee_ids = sorted(enrollments)
+    if dry_run:
+        stats["enrolled_employees"] = len(employee_ids)
+        stats["enrolled_images"] = sum(len(v) for v in enrollments.values())
+        return stats, failures
+
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(employee_ids), chunk_size):
+            chunk = {employee_id: np.stack(enrollments[employee_id])
+                     for employee_id in employee_ids[start:start + chunk_size]}
+            missing = store_enrollments(chunk, cursor)
+            conn.commit()
+            for employee_id in missing:
+                for image_path in images[employee_id]:
+                    fail(employee_id, image_path, "unknown_employee",
+                         f"Employee with ID {employee_id} not found in employee table")
+            stats["enrolled_employees"] += len(chunk) - len(missing)
+            stats["enrolled_images"] += sum(len(chunk[e]) for e in chunk if e not in missing)
+            log_with_time(f"Stored {stats['enrolled_employees']} employees")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return stats, failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enroll many employees' faces in one run")
+    parser.add_argument("source", help="Directory of <employee_id>[_n].jpg images or CSV with employee_id,image_path")
+    parser.add_argument("--workers", type=int, default=max(1, min(4, os.cpu_count() or 1)),
+                        help="Processes for decoding, detection and liveness")
+    parser.add_argument("--batch-size", type=int, default=32, help="Face crops per Facenet forward pass")
+    parser.add_argument("--chunk-size", type=int, default=100, help="Employees per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="Process images but write nothing")
+    args = parser.parse_args()
+
+    load_dotenv()
+    jobs = list_enrollment_jobs(args.source)
+    conn = None if args.dry_run else get_db_connection()
+    try:
+        stats, failures = bulk_register(jobs, conn, args.workers, args.batch_size, args.chunk_size, args.dry_run)
+    finally:
+        if conn:
+            conn.close()
+    print(json.dumps({**stats, "failures": failures}))
+    sys.exit(1 if failures else 0)
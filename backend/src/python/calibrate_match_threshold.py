@@ -0,0 +1,267 @@
+# OFFLINE MATCH THRESHOLD CALIBRATION
+# Loads labeled embeddings (every face_data row with its employeeID, a
+# directory / CSV of <employee_id>[_n].jpg images embedded like
+# bulk_register_faces.py, or an .npz saved by an earlier run) and measures
+# the cosine distance of every pair: same employee = genuine, different
+# employees = impostor.
+#
+# All n(n-1)/2 pairs are computed, a chunk of rows at a time: each chunk is one
+# float32 matrix product against the rows after it, turned straight into
+# histogram bin counts, so memory stays around --chunk-mb whatever n is. Rows
+# are sorted by employee, so a chunk's genuine pairs all sit in a narrow band
+# of columns next to it; only that band is split by label, everything past it
+# is impostor pairs. The products dominate and run on BLAS threads: about
+# 12 ns per pair on a single core, so 300k embeddings (4.5e10 pairs) take
+# under ten minutes on one core and a few on a multi-core box.
+#
+# From the two histograms (bins of --bin-width) the report gives, for a match
+# rule of distance < threshold:
+#
+#   far / frr curves   impostor pairs accepted / genuine pairs rejected
+#   eer                threshold where the two rates cross
+#   recommended        largest threshold with FAR <= --target-far
+#   current            rates at the deployed FACE_MATCH_THRESHOLD
+#
+# These are per-template rates. match_face.py accepts if any of an employee's
+# templates is close enough, so its FAR is up to MAX_TEMPLATES times higher;
+# pick --target-far with that in mind.
+#
+# Usage: python calibrate_match_threshold.py [--db | <image dir | file.csv | embeddings.npz>]
+#                                            [--target-far 0.0001] [--bin-width 0.001] [--chunk-mb 256]
+#                                            [--include-archive] [--save-embeddings out.npz]
+#                                            [--curves-csv curves.csv] [--output report.json]
+from dotenv import load_dotenv
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from face_common import log_with_time, MATCH_THRESHOLD, EMBEDDING_DIMENSION
+from face_gallery import FaceGallery
+
+MAX_DISTANCE = 2.0  # cosine distance of opposite unit vectors
+DB_PAGE_SIZE = 10000
+
+def load_from_db(include_archive=False):
+    """(normalized embeddings, employee ids) of every face_data row (and archived row)"""
+    from face_db import get_db_connection
+    tables = ["face_data"] + (["face_data_archive"] if include_archive else [])
+    matrices = []
+    labels = []
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for table in tables:
+            last_id = 0
+            while True:
+                # Keyset pagination keeps every page an index range scan
+                cursor.execute(f"""
+                               SELECT id, employeeID, face_encoding, createdAt
+                               FROM {table}
+                               WHERE id > %s
+                               ORDER BY id
+                                   LIMIT %s
+                               """, (last_id, DB_PAGE_SIZE))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                gallery = FaceGallery.from_records(rows)
+                matrices.append(gallery.matrix)
+                labels.extend(str(employee_id) for employee_id in gallery.employee_ids)
+                log_with_time(f"Loaded {len(labels)} embeddings (up to {table}.id {last_id})")
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    if not matrices:
+        return np.empty((0, EMBEDDING_DIMENSION), dtype=np.float32), np.array([], dtype=str)
+    return np.concatenate(matrices), np.array(labels)
+
+def load_from_images(source, workers, batch_size):
+    """Detect and embed a directory or CSV of labeled images the way bulk registration does"""
+    from bulk_register_faces import list_enrollment_jobs, prepare_face, embed_crops
+    from face_gallery import normalize_embedding
+
+    jobs = list_enrollment_jobs(source)
+    log_with_time(f"Detecting faces in {len(jobs)} images with {workers} processes")
+    prepared = []
+    # TensorFlow is not fork-safe once initialized, so pool processes are spawned
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        for employee_id, image_path, crop, failure in pool.imap_unordered(prepare_face, jobs, chunksize=4):
+            if failure:
+                log_with_time(f"Skipping {image_path}: {failure['error']}")
+            else:
+                prepared.append((employee_id, crop))
+    embeddings = embed_crops([crop for _, crop in prepared], batch_size)
+    matrix = np.stack([normalize_embedding(e) for e in embeddings]) if len(embeddings) else embeddings
+    return matrix.astype(np.float32), np.array([employee_id for employee_id, _ in prepared])
+
+def load_from_npz(path):
+    data = np.load(path)
+    matrix = data["embeddings"].astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix, data["labels"].astype(str)
+
+def bin_counts(similarities, bins, bin_width):
+    """Histogram of 1 - similarities in bins of bin_width; overwrites similarities"""
+    similarities *= -1.0 / bin_width
+    similarities += 1.0 / bin_width
+    np.clip(similarities, 0, bins - 1, out=similarities)
+    return np.bincount(similarities.astype(np.int32).ravel(), minlength=bins)
+
+def pair_histograms(matrix, codes, bins, bin_width, chunk_bytes):
+    """(genuine, impostor) distance histograms over every unordered pair of rows.
+
+    codes are integer labels with rows sorted by them, so a chunk's genuine
+    pairs all sit in a narrow band of columns next to it.
+    """
+    genuine = np.zeros(bins, dtype=np.int64)
+    impostor = np.zeros(bins, dtype=np.int64)
+    n = len(matrix)
+    # One past the last row of each row's label
+    block_end = np.searchsorted(codes, codes, side="right")
+    # The product and its int32 bin indices both live for a moment
+    chunk_rows = int(max(1, min(n, chunk_bytes // max(1, n * 8))))
+    started = time.perf_counter()
+    for chunk, start in enumerate(range(0, n, chunk_rows), 1):
+        stop = min(n, start + chunk_rows)
+        block = matrix[start:stop]
+        band = max(stop, int(block_end[stop - 1]))
+        near = block @ matrix[start:band].T
+        later = np.arange(start, band)[np.newaxis, :] > np.arange(start, stop)[:, np.newaxis]
+        same = codes[start:band][np.newaxis, :] == codes[start:stop][:, np.newaxis]
+        genuine += bin_counts(near[later & same], bins, bin_width)
+        impostor += bin_counts(near[later & ~same], bins, bin_width)
+        if band < n:
+            # Sorted labels: nothing past the band shares one with this chunk
+            impostor += bin_counts(block @ matrix[band:].T, bins, bin_width)
+        if chunk % 50 == 0:
+            # Row i pairs with the n - i - 1 rows after it
+            done = 1.0 - ((n - stop) / n) ** 2
+            elapsed = time.perf_counter() - started
+            log_with_time(f"Pairs {done:.0%} done, {elapsed:.0f}s elapsed, ~{elapsed / done - elapsed:.0f}s left")
+    return genuine, impostor
+
+def rates(genuine, impostor):
+    """(far, frr) at each threshold k * bin_width, which accepts bins < k"""
+    accepted_genuine = np.concatenate([[0], np.cumsum(genuine)])
+    accepted_impostor = np.concatenate([[0], np.cumsum(impostor)])
+    far = accepted_impostor / max(1, impostor.sum())
+    frr = 1.0 - accepted_genuine / max(1, genuine.sum())
+    return far, frr
+
+def distance_percentiles(counts, bin_width, percentiles):
+    """Distance (bin centre) at each percentile of a histogram"""
+    cumulative = np.cumsum(counts)
+    total = cumulative[-1]
+    if not total:
+        return {}
+    return {
+        f"p{p:g}": round((int(np.searchsorted(cumulative, total * p / 100.0)) + 0.5) * bin_width, 4)
+        for p in percentiles
+    }
+
+def calibrate(matrix, labels, target_far, bin_width, chunk_bytes, curve_step):
+    employees, codes = np.unique(labels, return_inverse=True)
+    order = np.argsort(codes, kind="stable")
+    matrix, codes = np.ascontiguousarray(matrix[order]), codes[order]
+    bins = int(np.ceil(MAX_DISTANCE / bin_width))
+
+    started = time.perf_counter()
+    log_with_time(f"Histogramming {len(matrix) * (len(matrix) - 1) // 2} pairs of {len(matrix)} embeddings")
+    genuine, impostor = pair_histograms(matrix, codes, bins, bin_width, chunk_bytes)
+    seconds = time.perf_counter() - started
+    if not genuine.sum():
+        raise ValueError("No genuine pairs: every employee needs at least two embeddings")
+    if not impostor.sum():
+        raise ValueError("No impostor pairs: at least two employees are needed")
+
+    far, frr = rates(genuine, impostor)
+    thresholds = np.arange(len(far)) * bin_width
+    eer_index = int(np.argmin(np.abs(far - frr)))
+    # FAR only grows with the threshold: take the last one still under target
+    recommended_index = int(np.searchsorted(far, target_far, side="right")) - 1
+    current_index = min(len(far) - 1, int(round(MATCH_THRESHOLD / bin_width)))
+    step = max(1, int(round(curve_step / bin_width)))
+
+    def point(index):
+        return {"threshold": round(float(thresholds[index]), 6), "far": float(far[index]), "frr": float(frr[index])}
+
+    report = {
+        "embeddings": len(matrix),
+        "employees": len(employees),
+        "genuine_pairs": int(genuine.sum()),
+        "impostor_pairs": int(impostor.sum()),
+        "pair_seconds": round(seconds, 1),
+        "bin_width": bin_width,
+        "genuine_distance": distance_percentiles(genuine, bin_width, (50, 95, 99, 99.9)),
+        "impostor_distance": distance_percentiles(impostor, bin_width, (0.01, 0.1, 1, 50)),
+        "eer": {"threshold": round(float(thresholds[eer_index]), 6),
+                "rate": float((far[eer_index] + frr[eer_index]) / 2)},
+        "recommended": {**point(max(0, recommended_index)), "target_far": target_far},
+        "current": point(current_index),
+        "curve": [point(i) for i in range(0, len(far), step) if thresholds[i] <= 1.0]
+    }
+    return report, (thresholds, far, frr, genuine, impostor)
+
+def write_curves(path, curves):
+    thresholds, far, frr, genuine, impostor = curves
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["threshold", "far", "frr", "genuine_pairs_in_bin", "impostor_pairs_in_bin"])
+        for i in range(len(genuine)):
+            writer.writerow([f"{thresholds[i]:.6f}", f"{far[i]:.8g}", f"{frr[i]:.8g}", genuine[i], impostor[i]])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FAR/FRR/EER of the match threshold over all pairs of labeled embeddings")
+    parser.add_argument("source", nargs="?", help="Image directory, CSV (employee_id,image_path) or .npz from --save-embeddings")
+    parser.add_argument("--db", action="store_true", help="Use the stored face_data embeddings")
+    parser.add_argument("--include-archive", action="store_true", help="With --db, also use face_data_archive")
+    parser.add_argument("--target-far", type=float, default=1e-4, help="Highest acceptable per-template false accept rate")
+    parser.add_argument("--bin-width", type=float, default=0.001, help="Distance histogram resolution")
+    parser.add_argument("--chunk-mb", type=float, default=256, help="Memory for one chunk of pair products")
+    parser.add_argument("--curve-step", type=float, default=0.01, help="Threshold step of the curve in the report")
+    parser.add_argument("--workers", type=int, default=max(1, min(4, os.cpu_count() or 1)),
+                        help="Processes for detection when embedding images")
+    parser.add_argument("--batch-size", type=int, default=32, help="Face crops per Facenet forward pass")
+    parser.add_argument("--save-embeddings", help="Write the loaded embeddings and labels to this .npz")
+    parser.add_argument("--curves-csv", help="Write the full-resolution FAR/FRR curves to this CSV")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    # Libraries print progress to stdout; keep it for the report only
+    report_out = sys.stdout
+    sys.stdout = sys.stderr
+    load_dotenv()
+
+    if args.db == bool(args.source):
+        sys.exit("Give either --db or a source")
+    if args.db:
+        matrix, labels = load_from_db(args.include_archive)
+        source = "face_data" + (" + face_data_archive" if args.include_archive else "")
+    elif args.source.endswith(".npz"):
+        matrix, labels = load_from_npz(args.source)
+        source = args.source
+    else:
+        matrix, labels = load_from_images(args.source, args.workers, args.batch_size)
+        source = args.source
+    if args.save_embeddings:
+        np.savez(args.save_embeddings, embeddings=matrix, labels=labels)
+
+    try:
+        report, curves = calibrate(matrix, labels, args.target_far, args.bin_width,
+                                   int(args.chunk_mb * 1024 * 1024), args.curve_step)
+    except ValueError as e:
+        sys.exit(str(e))
+    report = {"source": source, **report}
+    if args.curves_csv:
+        write_curves(args.curves_csv, curves)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    report_out.write(json.dumps(report, indent=2) + "\n")
+    sys.exit(0)
@@ -0,0 +1,121 @@
+# ACCURACY CHECK: DETECTOR CASCADE VS FULL-FRAME MTCNN
+# Runs every image in a directory through extract_face_embedding twice, once
+# with the cascade disabled (the full-frame reference) and once through the
+# cascade, and reports how often they agree: same accept/reject outcome, same
+# liveness verdict, box IoU and cosine distance between the embeddings, plus
+# the latency of both paths and the cascade counters.
+#
+# Usage: python check_detector_cascade.py <image dir> [--detector opencv]
+#                                         [--max-distance 0.05] [--output report.json]
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from face_common import MATCH_THRESHOLD
+from face_gallery import normalize_embedding
+from face_metrics import CASCADE_EVENTS
+from face_pipeline import extract_face_embedding, load_bgr_image, FaceRejected, CASCADE_DETECTOR
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+def run_path(img, cascade):
+    """Returns (outcome, result or None, seconds); outcome is "ok" or the rejection reason"""
+    started = time.perf_counter()
+    try:
+        result = extract_face_embedding(img, cascade)
+        outcome = "ok"
+    except FaceRejected as rejected:
+        result, outcome = None, rejected.reason
+    return outcome, result, time.perf_counter() - started
+
+def box_iou(a, b):
+    ax1, ay1 = a["x"] + a["w"], a["y"] + a["h"]
+    bx1, by1 = b["x"] + b["w"], b["y"] + b["h"]
+    inter_w = max(0, min(ax1, bx1) - max(a["x"], b["x"]))
+    inter_h = max(0, min(ay1, by1) - max(a["y"], b["y"]))
+    inter = inter_w * inter_h
+    union = a["w"] * a["h"] + b["w"] * b["h"] - inter
+    return inter / union if union else 0.0
+
+def check(images, detector, max_distance):
+    full_times, cascade_times = [], []
+    agree = 0
+    distances, ious = [], []
+    disagreements = []
+    confusion = {}
+
+    for image_path in images:
+        try:
+            img = load_bgr_image(image_path)
+        except FaceRejected:
+            continue
+        # Warm both paths on the first image so model loading is not timed
+        if not full_times:
+            run_path(img, None)
+            run_path(img, detector)
+
+        full_outcome, full, full_seconds = run_path(img, None)
+        cascade_outcome, cascaded, cascade_seconds = run_path(img, detector)
+        full_times.append(full_seconds)
+        cascade_times.append(cascade_seconds)
+        key = f"{full_outcome}->{cascade_outcome}"
+        confusion[key] = confusion.get(key, 0) + 1
+
+        entry = {"image": os.path.basename(image_path), "full_frame": full_outcome, "cascade": cascade_outcome}
+        if full_outcome != cascade_outcome:
+            disagreements.append(entry)
+            continue
+        if full_outcome == "ok":
+            distance = float(1.0 - normalize_embedding(full["embedding"]) @ normalize_embedding(cascaded["embedding"]))
+            distances.append(distance)
+            ious.append(box_iou(full["facial_area"], cascaded["facial_area"]))
+            if distance > max_distance:
+                disagreements.append({**entry, "embedding_distance": distance})
+                continue
+        agree += 1
+
+    checked = len(full_times)
+    return {
+        "images": checked,
+        "detector": detector,
+        "outcome_agreement": (checked - sum(1 for d in disagreements if d["full_frame"] != d["cascade"])) / checked if checked else None,
+        "agreement": agree / checked if checked else None,
+        "outcomes": confusion,
+        "embedding_distance": {
+            "mean": float(np.mean(distances)) if distances else None,
+            "max": float(np.max(distances)) if distances else None,
+            "max_allowed": max_distance,
+            "match_threshold": MATCH_THRESHOLD
+        },
+        "box_iou_mean": float(np.mean(ious)) if ious else None,
+        "latency_ms": {
+            "full_frame_p50": float(np.percentile(full_times, 50) * 1000) if full_times else None,
+            "cascade_p50": float(np.percentile(cascade_times, 50) * 1000) if cascade_times else None
+        },
+        "cascade_events": {labels[0]: count for labels, count in CASCADE_EVENTS.snapshot().items()},
+        "disagreements": disagreements
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the detector cascade with full-frame MTCNN")
+    parser.add_argument("images", help="Directory of sample images")
+    parser.add_argument("--detector", default=CASCADE_DETECTOR or "opencv", help="First-stage detector backend")
+    parser.add_argument("--max-distance", type=float, default=0.05,
+                        help="Largest cosine distance between the two embeddings that still counts as agreement")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    # Libraries print progress to stdout; keep it for the report only
+    report_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    images = [os.path.join(args.images, name) for name in sorted(os.listdir(args.images))
+              if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+    report = check(images, args.detector, args.max_distance)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    report_out.write(json.dumps(report, indent=2) + "\n")
+    sys.exit(0)
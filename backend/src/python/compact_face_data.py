@@ -0,0 +1,117 @@
+# COMPACT face_data TO A BOUNDED, DIVERSE TEMPLATE SET PER EMPLOYEE
+# One-off (or cron) counterpart of face_templates.add_template for deployments
+# that accumulated one row per punch. For every employee above the limit it
+# keeps the enrollment anchor, the newest sample and the most diverse rest
+# and moves everything else to face_data_archive.
+#
+# face_centroid already folds in every sample an employee enrolled or matched
+# with, including ones that were archived or never stored as near-duplicates,
+# so an existing centroid is left as it is. Employees without one (rows
+# from before face_centroid existed) get it seeded from all their rows in
+# face_data and face_data_archive.
+#
+# Usage: python compact_face_data.py [--max-templates 10] [--max-age-days 180]
+#                                    [--batch-size 50] [--delete] [--dry-run]
+from dotenv import load_dotenv
+import sys
+import json
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+from face_common import log_with_time
+from face_db import get_db_connection
+from face_gallery import FaceGallery
+from face_templates import MAX_TEMPLATES_PER_EMPLOYEE, select_diverse_templates, archive_face_rows, get_centroid, save_centroid
+
+def archived_encodings(employee_id, cursor):
+    """Normalized embeddings of the employee's rows in face_data_archive"""
+    cursor.execute("""
+                   SELECT id, employeeID, face_encoding, createdAt
+                   FROM face_data_archive
+                   WHERE employeeID = %s
+                   """, (employee_id,))
+    return FaceGallery.from_records(cursor.fetchall()).matrix
+
+def compact_employee(employee_id, conn, cursor, max_templates, max_age_days=None, archive=True, dry_run=False):
+    """Returns the number of rows archived for one employee"""
+    cursor.execute("""
+                   SELECT id, employeeID, face_encoding, createdAt
+                   FROM face_data
+                   WHERE employeeID = %s
+                   ORDER BY createdAt DESC, id DESC
+                   """, (employee_id,))
+    gallery = FaceGallery.from_records(cursor.fetchall())
+    if not len(gallery):
+        return 0
+
+    # Stale templates only survive as the enrollment anchor
+    candidates = list(range(len(gallery)))
+    if max_age_days:
+        cutoff = datetime.now() - timedelta(days=max_age_days)
+        anchor = len(gallery) - 1
+        candidates = [i for i in candidates if i == anchor or gallery.created_at[i] >= cutoff]
+
+    keep = [candidates[i] for i in select_diverse_templates(
+        gallery.matrix[candidates], max_templates, pinned=(0, len(candidates) - 1))]
+    kept = set(keep)
+    pruned = [gallery.row_ids[i] for i in range(len(gallery)) if i not in kept]
+
+    if not dry_run:
+        centroid, _ = get_centroid(employee_id, conn)
+        if centroid is None:
+            # Before archiving (or deleting): every sample stored for the employee so far
+            samples = np.concatenate([gallery.matrix, archived_encodings(employee_id, cursor)])
+            save_centroid(employee_id, np.mean(samples, axis=0), len(samples), conn)
+        archive_face_rows(pruned, cursor, archive)
+    return len(pruned)
+
+def compact(conn, max_templates=MAX_TEMPLATES_PER_EMPLOYEE, max_age_days=None, batch_size=50, archive=True, dry_run=False):
+    cursor = conn.cursor()
+    stats = {"employees": 0, "archived" if archive else "deleted": 0}
+    try:
+        if max_age_days:
+            cursor.execute("SELECT DISTINCT employeeID FROM face_data ORDER BY employeeID")
+        else:
+            cursor.execute("""
+                           SELECT employeeID
+                           FROM face_data
+                           GROUP BY employeeID
+                           HAVING COUNT(*) > %s
+                           ORDER BY employeeID
+                           """, (max_templates,))
+        employee_ids = [row[0] for row in cursor.fetchall()]
+        log_with_time(f"Compacting templates for {len(employee_ids)} employees")
+
+        # One transaction per batch of employees
+        for start in range(0, len(employee_ids), batch_size):
+            for employee_id in employee_ids[start:start + batch_size]:
+                removed = compact_employee(employee_id, conn, cursor, max_templates, max_age_days, archive, dry_run)
+                stats["employees"] += 1
+                stats["archived" if archive else "deleted"] += removed
+            if not dry_run:
+                conn.commit()
+            log_with_time(f"Compacted {stats['employees']}/{len(employee_ids)} employees")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bound face_data to a diverse template set per employee")
+    parser.add_argument("--max-templates", type=int, default=MAX_TEMPLATES_PER_EMPLOYEE)
+    parser.add_argument("--max-age-days", type=int, default=None, help="Also drop templates older than this")
+    parser.add_argument("--batch-size", type=int, default=50, help="Employees per transaction")
+    parser.add_argument("--delete", action="store_true", help="Delete pruned rows instead of archiving them")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be pruned")
+    args = parser.parse_args()
+
+    load_dotenv()
+    conn = get_db_connection()
+    try:
+        stats = compact(conn, args.max_templates, args.max_age_days, args.batch_size, not args.delete, args.dry_run)
+    finally:
+        conn.close()
+    print(json.dumps(stats))
+    sys.exit(0)
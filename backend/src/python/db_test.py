@@ -1,16 +1,13 @@
 from dotenv import load_dotenv
-import mysql.connector
-import os
+from face_db import get_db_connection, health_check, employee_exists
 
 load_dotenv()
 
 try:
-    conn = mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASS"),
-        database=os.getenv("DB_DATABASE")
-    )
+    # Same connection settings and prepared statements the face scripts use
+    conn = get_db_connection()
+    health_check(conn)
+    employee_exists(conn, 0)
     print("✅ Connected to MySQL successfully.")
     conn.close()
 except Exception as e:
@@ -0,0 +1,76 @@
+# EXPORT FACENET AND FASNET TO ONNX
+# Writes the graphs face_onnx.py loads when FACE_INFERENCE_BACKEND=onnx:
+#
+#   facenet.onnx      Keras Facenet via tf2onnx, NHWC float32, dynamic batch
+#   fasnet_v2.onnx    MiniFASNetV2 (2.7x crop) via torch.onnx, NCHW 1x3x80x80
+#   fasnet_v1se.onnx  MiniFASNetV1SE (4x crop) via torch.onnx, NCHW 1x3x80x80
+#
+# plus *.int8.onnx copies with dynamic int8 weight quantization unless
+# --no-quantize is given. Weights come from the same DeepFace model builds the
+# TensorFlow backend uses, so run verify_onnx_backend.py after exporting.
+#
+# Needs tf2onnx, torch and onnxruntime on the machine that exports; the
+# serving machines only need onnxruntime.
+#
+# Usage: python export_onnx_models.py [--output-dir onnx_models] [--no-quantize] [--opset 13]
+import os
+import sys
+import argparse
+from face_common import log_with_time, MODEL_NAME
+from face_onnx import ONNX_DIR, FACENET_FILE, FASNET_FILES, FASNET_INPUT_SIZE, model_path
+
+def export_facenet(out_dir, opset):
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    model = DeepFace.build_model(MODEL_NAME)
+    width, height = model.input_shape
+    signature = (tf.TensorSpec((None, height, width, 3), tf.float32, name="input"),)
+    path = model_path(FACENET_FILE, quantized=False, directory=out_dir)
+    tf2onnx.convert.from_keras(model.model, input_signature=signature, opset=opset, output_path=path)
+    log_with_time(f"Exported {MODEL_NAME} to {path}")
+    return path
+
+def export_fasnet(out_dir, opset):
+    import torch
+    from deepface import DeepFace
+
+    client = DeepFace.build_model("Fasnet", task="spoofing")
+    paths = []
+    for name, model in zip(FASNET_FILES, (client.first_model, client.second_model)):
+        model = model.to("cpu").eval()
+        path = model_path(name, quantized=False, directory=out_dir)
+        dummy = torch.zeros(1, 3, FASNET_INPUT_SIZE, FASNET_INPUT_SIZE)
+        torch.onnx.export(
+            model, dummy, path,
+            input_names=["input"], output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=opset
+        )
+        log_with_time(f"Exported {name} to {path}")
+        paths.append(path)
+    return paths
+
+def quantize(path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    name = os.path.basename(path)[:-len(".onnx")]
+    quantized_path = model_path(name, quantized=True, directory=os.path.dirname(path))
+    quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+    log_with_time(f"Quantized {name}: {os.path.getsize(path) / 1e6:.1f} MB -> {os.path.getsize(quantized_path) / 1e6:.1f} MB")
+    return quantized_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export Facenet and Fasnet to ONNX for the onnx inference backend")
+    parser.add_argument("--output-dir", default=ONNX_DIR, help="Where to write the .onnx files (FACE_ONNX_DIR)")
+    parser.add_argument("--no-quantize", action="store_true", help="Skip the int8 copies")
+    parser.add_argument("--opset", type=int, default=13, help="ONNX opset version")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    exported = [export_facenet(args.output_dir, args.opset)] + export_fasnet(args.output_dir, args.opset)
+    if not args.no_quantize:
+        for path in exported:
+            quantize(path)
+    sys.exit(0)
@@ -0,0 +1,74 @@
+# MICRO-BATCHING FOR CONCURRENT REQUESTS
+# Request threads in the face worker submit single items (an aligned crop to
+# embed, a frame + box to check for liveness) and block on a future. One
+# scheduler thread per stage collects items until either max_batch_size are
+# waiting or the oldest has waited max_wait seconds, runs one batched forward
+# pass and hands each request its own row of the result.
+#
+# With a single request in flight a batch closes after max_wait, so keep it
+# a few milliseconds: it is the latency a lone punch pays for batching.
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from face_common import log_with_time
+from face_metrics import span, BATCH_QUEUE_DEPTH, BATCH_SIZE, BATCH_WAIT
+
+BATCH_MAX_SIZE = int(os.getenv("FACE_BATCH_MAX_SIZE", 16))  # 1 disables batching
+BATCH_MAX_WAIT = float(os.getenv("FACE_BATCH_MAX_WAIT_MS", 5)) / 1000
+
+class MicroBatcher:
+    """Runs run_batch(items) -> results (same order) over items from concurrent submitters"""
+
+    def __init__(self, stage, run_batch, max_batch_size=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT):
+        self.stage = stage
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.loop, name=f"{stage}-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """Queue one item; the returned future resolves to its result"""
+        future = Future()
+        self.queue.put((item, future, time.perf_counter()))
+        BATCH_QUEUE_DEPTH.set(self.queue.qsize(), self.stage)
+        return future
+
+    def next_batch(self):
+        """Block for the first item, then collect more until the batch is full or the deadline passes"""
+        batch = [self.queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def loop(self):
+        while True:
+            batch = self.next_batch()
+            started = time.perf_counter()
+            BATCH_QUEUE_DEPTH.set(self.queue.qsize(), self.stage)
+            BATCH_SIZE.observe(len(batch), self.stage)
+            for _, _, queued in batch:
+                BATCH_WAIT.observe(started - queued, self.stage)
+            try:
+                with span(f"{self.stage}_batch"):
+                    results = self.run_batch([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.stage} batch returned {len(results)} results for {len(batch)} items")
+            except BaseException as e:
+                # Whatever it is, this thread must survive it: every later submitter waits on it
+                log_with_time(f"{self.stage} batch of {len(batch)} failed: {e!r}")
+                # Don't hand SystemExit / KeyboardInterrupt to the request threads
+                error = e if isinstance(e, Exception) else RuntimeError(f"{self.stage} batch aborted: {e!r}")
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
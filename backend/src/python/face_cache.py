@@ -0,0 +1,196 @@
+# IN-PROCESS CACHES FOR THE LONG-LIVED FACE WORKER
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from face_common import log_with_time
+from face_memory import LOW_MEMORY
+
+GALLERY_CACHE_BYTES = int(os.getenv("FACE_GALLERY_CACHE_BYTES", (8 if LOW_MEMORY else 64) * 1024 * 1024))
+GALLERY_CACHE_TTL_SECONDS = float(os.getenv("FACE_GALLERY_CACHE_TTL", 300))
+ROW_OVERHEAD_BYTES = 64  # employee id + createdAt kept per gallery row
+RESULT_CACHE_SIZE = int(os.getenv("FACE_RESULT_CACHE_SIZE", 128 if LOW_MEMORY else 1024))  # entries; 0 disables
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("FACE_RESULT_CACHE_TTL", 30))
+HASH_CHUNK_BYTES = 1024 * 1024
+
+class GalleryCache:
+    """Decoded, normalized FaceGallery per employee.
+
+    LRU-evicted once the galleries exceed max_bytes, and entries expire after
+    ttl_seconds so rows written by other processes are picked up eventually.
+    """
+
+    def __init__(self, max_bytes=GALLERY_CACHE_BYTES, ttl_seconds=GALLERY_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # employee id -> (gallery, size, expires_at)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(employee_id):
+        return str(employee_id)
+
+    @staticmethod
+    def _size(gallery):
+        return gallery.nbytes + ROW_OVERHEAD_BYTES * len(gallery)
+
+    def _remove(self, key):
+        gallery, size, expires_at = self.entries.pop(key)
+        self.current_bytes -= size
+
+    def get(self, employee_id):
+        key = self._key(employee_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, employee_id, gallery):
+        key = self._key(employee_id)
+        size = self._size(gallery)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (gallery, size, time.monotonic() + self.ttl_seconds)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                evicted_key = next(iter(self.entries))
+                self._remove(evicted_key)
+                self.evictions += 1
+
+    def update(self, employee_id, update_gallery):
+        """Write-through: replace a cached gallery with update_gallery(gallery), keeping its TTL"""
+        key = self._key(employee_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            gallery = update_gallery(entry[0])
+            size = self._size(gallery)
+            self.current_bytes += size - entry[1]
+            self.entries[key] = (gallery, size, entry[2])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def invalidate(self, employee_id):
+        key = self._key(employee_id)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+                log_with_time(f"Gallery cache invalidated for employee {key}")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions
+            }
+
+def content_key(image, employee_id):
+    """(sha256 of the encoded image bytes, employee id), or None for sources that aren't one upload"""
+    digest = hashlib.sha256()
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        digest.update(image)
+    elif isinstance(image, str) and os.path.isfile(image):
+        with open(image, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+    else:
+        return None
+    return digest.hexdigest(), str(employee_id)
+
+class ResultCache:
+    """Outcome of recently processed uploads, keyed by content_key.
+
+    A resubmitted photo (same bytes, same employee) gets the earlier result
+    back without detection, liveness, embedding or a second template insert.
+    Entries are few and short-lived: they only have to outlast a client retry.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, ttl_seconds=RESULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # content key -> (result, expires_at)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        if key is None or not self.max_entries:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        if key is None or not self.max_entries:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (result, time.monotonic() + self.ttl_seconds)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def invalidate(self, employee_id):
+        """Drop cached results for this employee and identifications, e.g. after a new registration"""
+        stale = {str(employee_id), str(None)}
+        with self.lock:
+            for key in [key for key in self.entries if key[1] in stale]:
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+gallery_cache = GalleryCache()
+result_cache = ResultCache()
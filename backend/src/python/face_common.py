@@ -0,0 +1,35 @@
+# SHARED HELPERS FOR THE FACE SCRIPTS AND THE FACE WORKER
+import os
+import sys
+from datetime import datetime
+
+def log_with_time(message):
+    timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
+    print(f"[{timestamp}] {message}", file=sys.stderr, flush=True)
+
+def current_rss_mb():
+    """Resident set size of this process in MB (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# Configuration
+MATCH_THRESHOLD = float(os.getenv("FACE_MATCH_THRESHOLD", 0.25))  # calibrate_match_threshold.py measures it
+MAX_FACE_RECORDS_PER_USER = 20  # Limit face records per user for performance
+DETECTOR_BACKEND = 'mtcnn'  # Better speed/accuracy balance than retinaface
+MODEL_NAME = 'Facenet'  # 128D embeddings
+EMBEDDING_DIMENSION = 128
+
+class FaceProcessingError(Exception):
+    """Rejected request; payload is the JSON the caller reports with exit code 1"""
+    def __init__(self, payload, reason=None):
+        super().__init__(payload.get("error", ""))
+        self.payload = payload
+        self.reason = reason
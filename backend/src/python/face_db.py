@@ -0,0 +1,286 @@
+# SHARED DATABASE ACCESS FOR THE FACE SCRIPTS AND THE FACE WORKER
+# Long-lived processes (face_worker.py, face_service.py and its pool workers)
+# call use_connection_pool() at start-up and check connections out of a
+# mysql.connector pool instead of paying a TCP + auth handshake per request.
+# The pool opens all FACE_DB_POOL_SIZE connections when it is created, so
+# one-shot scripts keep a single plain connection. Either way the statements
+# on the match/register hot path run as server-side prepared statements,
+# prepared once per physical connection.
+#
+# FACE_DB_ENGINE=sqlite swaps in a SQLite database (FACE_DB_SQLITE_PATH, default
+# in-memory) with the same tables, so the face scripts can be exercised without
+# a MySQL server.
+import os
+import time
+import sqlite3
+import threading
+from face_common import log_with_time
+
+DB_ENGINE = os.getenv("FACE_DB_ENGINE", "mysql")
+POOL_NAME = "face"
+POOL_SIZE = int(os.getenv("FACE_DB_POOL_SIZE", 4))
+# Connections idle longer than this are pinged (and reconnected) before use
+HEALTH_CHECK_INTERVAL = float(os.getenv("FACE_DB_HEALTH_CHECK_INTERVAL", 30))
+# Lock wait timeout, deadlock, can't connect, server gone away, lost connection (x2)
+TRANSIENT_MYSQL_ERRORS = {1205, 1213, 2003, 2006, 2013, 2055}
+SQLITE_PATH = os.getenv("FACE_DB_SQLITE_PATH", ":memory:")
+
+STATEMENTS = {
+    "employee_exists": "SELECT id FROM employee WHERE id = %s",
+    # Newest first; id breaks ties between rows of one write-behind flush (same NOW())
+    "recent_encodings": """
+                        SELECT id, employeeID, face_encoding, createdAt
+                        FROM face_data
+                        WHERE employeeID = %s
+                        ORDER BY createdAt DESC, id DESC
+                            LIMIT %s
+                        """,
+    "employee_face_ids": "SELECT id FROM face_data WHERE employeeID = %s",
+    "insert_encoding": """
+                       INSERT INTO face_data (employeeID, face_encoding, createdAt)
+                       VALUES (%s, %s, NOW())
+                       """,
+    "get_centroid": "SELECT centroid, sample_count FROM face_centroid WHERE employeeID = %s",
+    "upsert_centroid": """
+                       INSERT INTO face_centroid (employeeID, centroid, sample_count, updatedAt)
+                       VALUES (%s, %s, %s, NOW())
+                       ON DUPLICATE KEY UPDATE centroid = VALUES(centroid), sample_count = VALUES(sample_count), updatedAt = NOW()
+                       """,
+}
+
+# Statements whose MySQL syntax SQLite does not understand
+SQLITE_STATEMENTS = {
+    "upsert_centroid": """
+                       INSERT INTO face_centroid (employeeID, centroid, sample_count, updatedAt)
+                       VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                       ON CONFLICT (employeeID) DO UPDATE SET centroid = excluded.centroid, sample_count = excluded.sample_count, updatedAt = CURRENT_TIMESTAMP
+                       """,
+}
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS employee (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT, email TEXT, password TEXT
+);
+CREATE TABLE IF NOT EXISTS face_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    employeeID INTEGER NOT NULL REFERENCES employee (id),
+    face_encoding BLOB NOT NULL,
+    createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS face_data_employee_created ON face_data (employeeID, createdAt);
+CREATE TABLE IF NOT EXISTS face_data_archive (
+    id INTEGER PRIMARY KEY,
+    employeeID INTEGER NOT NULL,
+    face_encoding BLOB NOT NULL,
+    createdAt TIMESTAMP,
+    archivedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS face_centroid (
+    employeeID INTEGER PRIMARY KEY REFERENCES employee (id),
+    centroid BLOB NOT NULL,
+    sample_count INTEGER NOT NULL DEFAULT 0,
+    updatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+def to_sqlite(sql):
+    return sql.replace("%s", "?").replace("NOW()", "CURRENT_TIMESTAMP")
+
+class SQLiteCursor:
+    """The subset of the mysql.connector cursor API the face scripts use"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(to_sqlite(sql), tuple(params))
+
+    def executemany(self, sql, rows):
+        self._cursor.executemany(to_sqlite(sql), [tuple(row) for row in rows])
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+class SQLiteConnection:
+    """Stand-in for a pooled MySQL connection backed by one shared SQLite database"""
+
+    connection_id = 0
+
+    def __init__(self, path=SQLITE_PATH):
+        self._db = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        self._db.executescript(SQLITE_SCHEMA)
+
+    def cursor(self, prepared=False, **kwargs):
+        return SQLiteCursor(self._db.cursor())
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def is_connected(self):
+        return True
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        pass
+
+    def close(self):
+        # Shared like a pool; closing a checkout must not drop the database
+        pass
+
+_pool = None
+_use_pool = False
+_sqlite_connection = None
+_pool_lock = threading.Lock()  # also guards _prepared_cursors
+_last_used = {}  # physical connection -> monotonic time of last use
+_prepared_cursors = {}  # (physical connection, session id, statement) -> cursor
+
+def connection_settings():
+    return {
+        "host": os.getenv("DB_HOST"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASS"),
+        "database": os.getenv("DB_DATABASE"),
+        "autocommit": False
+    }
+
+def use_connection_pool():
+    """Serve get_db_connection() from a pool; for long-lived processes, before their first connection"""
+    global _use_pool
+    _use_pool = True
+
+def get_pool():
+    """Process-wide MySQL connection pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from mysql.connector import pooling
+            log_with_time(f"Creating database pool ({POOL_SIZE} connections)")
+            # Sessions are not reset on release so prepared statements survive;
+            # callers always commit or roll back before closing
+            _pool = pooling.MySQLConnectionPool(
+                pool_name=POOL_NAME,
+                pool_size=POOL_SIZE,
+                pool_reset_session=False,
+                **connection_settings()
+            )
+        return _pool
+
+def get_db_connection():
+    """A pooled connection (close() returns it) after use_connection_pool(), else a plain one"""
+    global _sqlite_connection
+    if DB_ENGINE == "sqlite":
+        with _pool_lock:
+            if _sqlite_connection is None:
+                _sqlite_connection = SQLiteConnection()
+        return _sqlite_connection
+    if _use_pool:
+        # The pool itself reconnects connections that fail is_connected()
+        conn = get_pool().get_connection()
+    else:
+        # One handshake for a one-shot script instead of a whole pool's worth
+        import mysql.connector
+        conn = mysql.connector.connect(**connection_settings())
+    _last_used[_physical_connection_key(conn)[0]] = time.monotonic()
+    return conn
+
+def _physical(conn):
+    # Pooled connections wrap the real one; statements belong to the latter
+    return getattr(conn, "_cnx", conn)
+
+def _physical_connection_key(conn):
+    physical = _physical(conn)
+    return id(physical), getattr(physical, "connection_id", None)
+
+def health_check(conn):
+    """Ping (and reconnect) a long-held connection if it has been idle too long"""
+    key = _physical_connection_key(conn)[0]
+    now = time.monotonic()
+    if now - _last_used.get(key, 0) > HEALTH_CHECK_INTERVAL:
+        conn.ping(reconnect=True, attempts=3, delay=1)
+    _last_used[key] = now
+    return conn
+
+def database_errors():
+    """Exception types the configured driver raises; mysql.connector is only imported here when needed"""
+    if DB_ENGINE == "sqlite":
+        return (sqlite3.Error,)
+    import mysql.connector
+    return (mysql.connector.Error,)
+
+def is_transient_error(error):
+    """True for errors worth retrying: lock contention or a dropped connection"""
+    if DB_ENGINE == "sqlite":
+        # "database is locked" and friends
+        return isinstance(error, sqlite3.OperationalError)
+    return getattr(error, "errno", None) in TRANSIENT_MYSQL_ERRORS
+
+def statement_sql(name):
+    if DB_ENGINE == "sqlite":
+        return SQLITE_STATEMENTS.get(name) or to_sqlite(STATEMENTS[name])
+    return STATEMENTS[name]
+
+def prepared_cursor(conn, name):
+    """Cursor holding the prepared statement `name` on this physical connection.
+
+    A reconnect gets a new connection_id, so statements prepared on the old
+    session are never reused.
+    """
+    key = _physical_connection_key(conn) + (name,)
+    with _pool_lock:
+        cursor = _prepared_cursors.get(key)
+        if cursor is None:
+            # Drop cursors left over from an earlier session of this connection
+            for stale in [k for k in _prepared_cursors if k[0] == key[0] and k[1] != key[1]]:
+                del _prepared_cursors[stale]
+            # Preparing happens on the first execute, outside the lock
+            cursor = conn.cursor(prepared=True)
+            _prepared_cursors[key] = cursor
+    return cursor
+
+def query(conn, name, params):
+    """Run a prepared SELECT and return all rows"""
+    cursor = prepared_cursor(conn, name)
+    cursor.execute(statement_sql(name), params)
+    return cursor.fetchall()
+
+def execute(conn, name, params):
+    """Run a prepared INSERT/UPDATE; returns the last inserted id"""
+    cursor = prepared_cursor(conn, name)
+    cursor.execute(statement_sql(name), params)
+    return cursor.lastrowid
+
+def employee_exists(conn, employee_id):
+    return bool(query(conn, "employee_exists", (employee_id,)))
+
+def fetch_recent_encodings(conn, employee_id, limit):
+    return query(conn, "recent_encodings", (employee_id, limit))
+
+def fetch_employee_face_ids(conn, employee_id):
+    return [row[0] for row in query(conn, "employee_face_ids", (employee_id,))]
+
+def insert_face_encoding(conn, employee_id, face_encoding_blob):
+    return execute(conn, "insert_encoding", (employee_id, face_encoding_blob))
+
+def fetch_centroid(conn, employee_id):
+    rows = query(conn, "get_centroid", (employee_id,))
+    return rows[0] if rows else None
+
+def upsert_centroid(conn, employee_id, centroid_blob, sample_count):
+    execute(conn, "upsert_centroid", (employee_id, centroid_blob, sample_count))
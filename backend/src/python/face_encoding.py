@@ -0,0 +1,94 @@
+# COMPACT VERSIONED STORAGE FORMAT FOR face_data.face_encoding
+#
+# Layout (little endian):
+#   magic    2s   b'FE'
+#   version  B    FORMAT_VERSION
+#   flags    B    FLAG_NORMALIZED when the vector is L2-normalized
+#   model    16s  model name, ASCII, NUL padded
+#   dim      H    number of float32 components
+#   vector   dim * float32
+#
+# A Facenet row is 534 bytes instead of ~1.2 KB of pickle and decodes with a
+# single np.frombuffer. Rows written before this format (pickle, comma
+# separated or JSON) are still readable until migrate_face_encodings.py has
+# rewritten them.
+import io
+import json
+import pickle
+import struct
+import numpy as np
+from face_common import MODEL_NAME
+
+MAGIC = b'FE'
+FORMAT_VERSION = 1
+FLAG_NORMALIZED = 0x01
+HEADER = struct.Struct('<2sBB16sH')
+VECTOR_DTYPE = np.dtype('<f4')
+
+# Globals a pickled float ndarray references; nothing else may be loaded
+_PICKLE_ALLOWED = {
+    ("numpy.core.multiarray", "_reconstruct"),
+    ("numpy._core.multiarray", "_reconstruct"),
+    ("numpy.core.multiarray", "scalar"),
+    ("numpy._core.multiarray", "scalar"),
+    ("numpy", "ndarray"),
+    ("numpy", "dtype"),
+}
+
+class _NumpyOnlyUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) not in _PICKLE_ALLOWED:
+            raise pickle.UnpicklingError(f"Refusing to unpickle {module}.{name}")
+        return super().find_class(module, name)
+
+def encode_face_encoding(embedding, model_name=MODEL_NAME, normalized=False):
+    """Serialize an embedding to the versioned binary format"""
+    vector = np.ascontiguousarray(embedding, dtype=VECTOR_DTYPE).ravel()
+    flags = FLAG_NORMALIZED if normalized else 0
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, flags, model_name.encode('ascii'), vector.size)
+    return header + vector.tobytes()
+
+def is_current_format(blob):
+    return isinstance(blob, (bytes, bytearray)) and len(blob) >= HEADER.size and blob[:2] == MAGIC
+
+def read_header(blob):
+    """Returns (version, model_name, normalized, dimension) of a current-format blob"""
+    magic, version, flags, model, dimension = HEADER.unpack_from(blob)
+    return version, model.rstrip(b'\0').decode('ascii'), bool(flags & FLAG_NORMALIZED), dimension
+
+def legacy_format(blob):
+    """Name of the legacy encoding a row uses: pickle, csv or json"""
+    if isinstance(blob, (bytes, bytearray)) and blob[:1] == b'\x80':
+        return "pickle"
+    text = blob.decode('utf-8') if isinstance(blob, (bytes, bytearray)) else blob
+    return "json" if text.lstrip().startswith('[') else "csv"
+
+def decode_legacy_face_encoding(blob):
+    fmt = legacy_format(blob)
+    if fmt == "pickle":
+        return np.asarray(_NumpyOnlyUnpickler(io.BytesIO(bytes(blob))).load(), dtype=np.float32)
+    text = blob.decode('utf-8') if isinstance(blob, (bytes, bytearray)) else blob
+    if fmt == "json":
+        return np.asarray(json.loads(text), dtype=np.float32)
+    return np.asarray([float(x) for x in text.split(',')], dtype=np.float32)
+
+def decode_stored_encoding(blob, expected_model=MODEL_NAME):
+    """Decode a stored face_encoding value of any supported format.
+
+    Returns (float32 vector, normalized); legacy rows are never flagged normalized.
+    """
+    if not is_current_format(blob):
+        return decode_legacy_face_encoding(blob), False
+
+    version, model_name, normalized, dimension = read_header(blob)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported face encoding version: {version}")
+    if expected_model and model_name != expected_model:
+        raise ValueError(f"Face encoding was produced by {model_name}, expected {expected_model}")
+    if len(blob) != HEADER.size + dimension * VECTOR_DTYPE.itemsize:
+        raise ValueError("Truncated face encoding")
+    return np.frombuffer(blob, dtype=VECTOR_DTYPE, count=dimension, offset=HEADER.size), normalized
+
+def decode_face_encoding(blob, expected_model=MODEL_NAME):
+    """Decode a stored face_encoding value of any supported format to float32"""
+    return decode_stored_encoding(blob, expected_model)[0]
@@ -0,0 +1,113 @@
+# VECTORIZED GALLERY COMPARISON
+# Stored embeddings are L2-normalized when written, so a gallery is one
+# contiguous float32 matrix and every cosine distance for a probe comes out of
+# a single matrix-vector product.
+import numpy as np
+from face_common import log_with_time, EMBEDDING_DIMENSION
+from face_encoding import decode_stored_encoding
+
+def normalize_embedding(embedding):
+    """float32 unit vector; raises ValueError for a zero vector"""
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        raise ValueError("Invalid face encoding detected")
+    return vector / norm
+
+class FaceGallery:
+    """Normalized embeddings of one or more employees, one row per face_data record"""
+
+    def __init__(self, matrix, row_ids, employee_ids, created_at):
+        self.matrix = matrix
+        self.row_ids = row_ids
+        self.employee_ids = employee_ids
+        self.created_at = created_at
+
+    def __len__(self):
+        return len(self.employee_ids)
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes
+
+    @classmethod
+    def from_records(cls, face_records):
+        """Build from (id, employeeID, face_encoding, createdAt) rows; undecodable or zero rows are skipped"""
+        matrix = np.empty((len(face_records), EMBEDDING_DIMENSION), dtype=np.float32)
+        needs_norm = np.zeros(len(face_records), dtype=bool)
+        row_ids = []
+        employee_ids = []
+        created_at = []
+
+        for row_id, employee_id, face_encoding_blob, created in face_records:
+            try:
+                vector, normalized = decode_stored_encoding(face_encoding_blob)
+                if vector.shape != (EMBEDDING_DIMENSION,):
+                    raise ValueError(f"unexpected dimension {vector.shape}")
+            except Exception as e:
+                log_with_time(f"Skipping unreadable face encoding: {str(e)}")
+                continue
+            row = len(employee_ids)
+            matrix[row] = vector
+            needs_norm[row] = not normalized
+            row_ids.append(row_id)
+            employee_ids.append(employee_id)
+            created_at.append(created)
+
+        matrix = matrix[:len(employee_ids)]
+        needs_norm = needs_norm[:len(employee_ids)]
+
+        # Legacy rows were stored raw; normalize them all at once
+        if needs_norm.any():
+            norms = np.linalg.norm(matrix[needs_norm], axis=1, keepdims=True)
+            matrix[needs_norm] = np.divide(matrix[needs_norm], norms, out=np.zeros_like(matrix[needs_norm]), where=norms > 0)
+
+        gallery = cls(matrix, row_ids, employee_ids, created_at)
+
+        # Skip zero vectors
+        valid = np.flatnonzero(np.any(matrix != 0, axis=1))
+        if len(valid) != len(employee_ids):
+            gallery = gallery.subset(valid)
+
+        gallery.matrix = np.ascontiguousarray(gallery.matrix)
+        return gallery
+
+    def subset(self, rows):
+        return FaceGallery(
+            self.matrix[rows],
+            [self.row_ids[i] for i in rows],
+            [self.employee_ids[i] for i in rows],
+            [self.created_at[i] for i in rows]
+        )
+
+    def with_new_row(self, row_id, employee_id, embedding, created_at, limit):
+        """Gallery with a freshly stored row first (newest-first, like the DB fetch), capped at limit rows"""
+        matrix = np.vstack([embedding[np.newaxis, :].astype(np.float32), self.matrix[:limit - 1]])
+        return FaceGallery(
+            matrix,
+            [row_id] + self.row_ids[:limit - 1],
+            [employee_id] + self.employee_ids[:limit - 1],
+            [created_at] + self.created_at[:limit - 1]
+        )
+
+    def distances(self, probe):
+        """Cosine distances from a normalized probe to every gallery row"""
+        return 1.0 - self.matrix @ probe
+
+    def compare(self, probe, threshold):
+        """Returns (matches, best_match) in the match_face.py response shape"""
+        distances = self.distances(probe)
+        matched_rows = np.flatnonzero(distances < threshold)
+        matches = [
+            {
+                "user_id": self.employee_ids[i],
+                "distance": float(distances[i]),
+                "similarity": float(1.0 - distances[i]),
+                "created_at": str(self.created_at[i])
+            }
+            for i in matched_rows
+        ]
+        best_match = None
+        if len(matched_rows):
+            best_match = matches[int(np.argmin(distances[matched_rows]))]
+        return matches, best_match
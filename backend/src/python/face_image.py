@@ -0,0 +1,262 @@
+# IN-MEMORY IMAGE INGEST
+# Decode the upload once into a BGR array, shrink it once, and hand that same
+# array to every later stage. No temp files, no lossy JPEG re-encode.
+#
+# JPEGs are not fully decoded: the marker segments are read first for the
+# frame size and EXIF orientation, and libjpeg's DCT scaling
+# (IMREAD_REDUCED_COLOR_2/4/8) decodes straight to the smallest power-of-two
+# reduction that still covers TARGET_SIZE. The orientation is then applied to
+# that small array with a flip/transpose, so rotated phone selfies come out
+# upright without a second decode.
+import os
+import sys
+import base64
+import struct
+import tempfile
+import numpy as np
+from face_common import log_with_time
+
+TARGET_SIZE = (640, 640)
+MAX_BURST_FRAMES = int(os.getenv("FACE_MAX_BURST_FRAMES", 10))
+VIDEO_FRAME_STRIDE = int(os.getenv("FACE_VIDEO_FRAME_STRIDE", 5))  # use every Nth frame of a clip
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+REDUCED_DECODE = os.getenv("FACE_REDUCED_DECODE", "1") == "1"
+JPEG_REDUCTIONS = (8, 4, 2)
+EXIF_ORIENTATION_TAG = 0x0112
+
+# Leading bytes of the formats OpenCV decodes for us
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"BM", "bmp"),
+    (b"GIF8", "gif"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+def read_image_source(image_path):
+    """CLI helper: '-' reads the encoded image bytes from stdin, anything else is a path"""
+    if image_path == "-":
+        return sys.stdin.buffer.read()
+    return image_path
+
+def sniff_image_type(source):
+    """Image format from the first bytes of a path, encoded bytes or base64 text.
+
+    Returns None when the file is missing or does not look like an image; no
+    decoding happens, so this is cheap enough to run before loading any model.
+    """
+    if isinstance(source, np.ndarray):
+        return "array"
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        head = bytes(source[:16])
+    elif isinstance(source, str) and source.startswith("data:image"):
+        head = base64.b64decode(source.split(",", 1)[1][:24])
+    elif isinstance(source, str) and os.path.isfile(source):
+        with open(source, "rb") as f:
+            head = f.read(16)
+    else:
+        return None
+
+    for signature, image_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def sniff_video(source):
+    """True if a path or encoded bytes look like an MP4/MOV, WebM or AVI clip"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        head = bytes(source[:16])
+    elif isinstance(source, str) and os.path.isfile(source):
+        with open(source, "rb") as f:
+            head = f.read(16)
+    else:
+        return False
+    return head[4:8] == b"ftyp" or head[:4] == b"\x1a\x45\xdf\xa3" or (head[:4] == b"RIFF" and head[8:12] == b"AVI ")
+
+def is_burst_source(source):
+    """A list of frames, a directory of frames or a video clip, rather than one still"""
+    if isinstance(source, (list, tuple)):
+        return True
+    if isinstance(source, str) and os.path.isdir(source):
+        return True
+    return sniff_video(source)
+
+def iter_video_frames(source, max_frames, stride):
+    import cv2
+    temp_path = None
+    if not isinstance(source, str):
+        # OpenCV can only open clips from a file
+        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as f:
+            f.write(bytes(source))
+            temp_path = f.name
+    capture = cv2.VideoCapture(temp_path or source)
+    try:
+        yielded = 0
+        position = 0
+        while yielded < max_frames:
+            # grab() skips frames without converting them
+            if not capture.grab():
+                break
+            if position % stride == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                yield resize_to_fit(frame)
+                yielded += 1
+            position += 1
+    finally:
+        capture.release()
+        if temp_path:
+            os.remove(temp_path)
+
+def iter_frames(source, max_frames=MAX_BURST_FRAMES, stride=VIDEO_FRAME_STRIDE):
+    """Lazily yield the frames of a burst or clip, at most max_frames.
+
+    Stills (paths, bytes, base64) are yielded undecoded so a bad frame is
+    rejected by the pipeline like a bad single upload; video frames come out
+    decoded and downscaled. Nothing past the frame being processed is decoded.
+    """
+    if isinstance(source, str) and os.path.isdir(source):
+        source = [os.path.join(source, name) for name in sorted(os.listdir(source))
+                  if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+    if isinstance(source, (list, tuple)):
+        for frame in source[:max_frames]:
+            yield frame
+        return
+    yield from iter_video_frames(source, max_frames, stride)
+
+def exif_orientation(tiff):
+    """Orientation tag (1-8) from the TIFF structure of an EXIF block; 1 when absent or unreadable"""
+    try:
+        endian = {b"II": "<", b"MM": ">"}[tiff[:2]]
+        ifd = struct.unpack(endian + "I", tiff[4:8])[0]
+        (count,) = struct.unpack(endian + "H", tiff[ifd:ifd + 2])
+        for entry in range(ifd + 2, ifd + 2 + 12 * count, 12):
+            if struct.unpack(endian + "H", tiff[entry:entry + 2])[0] == EXIF_ORIENTATION_TAG:
+                value = struct.unpack(endian + "H", tiff[entry + 8:entry + 10])[0]
+                return value if 1 <= value <= 8 else 1
+    except (KeyError, struct.error):
+        pass
+    return 1
+
+def jpeg_header(data):
+    """(width, height, EXIF orientation) from a JPEG's marker segments, or None if it isn't a JPEG.
+
+    Walks the segments up to the start-of-frame marker; no pixel data is touched.
+    """
+    data = memoryview(data)
+    if bytes(data[:3]) != b"\xff\xd8\xff":
+        return None
+    orientation = 1
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        length = (data[i + 2] << 8) | data[i + 3]
+        if marker == 0xE1 and bytes(data[i + 4:i + 10]) == b"Exif\x00\x00":
+            orientation = exif_orientation(bytes(data[i + 10:i + 2 + length]))
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height, orientation
+        elif marker == 0xDA:  # scan data before any frame header
+            return None
+        i += 2 + length
+    return None
+
+def reduction_factor(width, height, target_size=TARGET_SIZE):
+    """Largest DCT reduction whose output is still at least what resize_to_fit produces"""
+    scale = min(target_size[0] / height, target_size[1] / width)
+    for factor in JPEG_REDUCTIONS:
+        if factor * scale <= 1:
+            return factor
+    return 1
+
+def apply_orientation(img, orientation):
+    """Rotate/flip a decoded array so EXIF orientation 1 is upright"""
+    import cv2
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(img), -1)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+def decode_image(source, target_size=None):
+    """Decode a path, encoded bytes, base64 text or an ndarray into an upright BGR array.
+
+    With a target_size, JPEGs are decoded at a reduced scale that still covers it.
+    """
+    if isinstance(source, np.ndarray):
+        return source
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        buffer = np.frombuffer(source, dtype=np.uint8)
+    elif isinstance(source, str) and source.startswith("data:image"):
+        buffer = np.frombuffer(base64.b64decode(source.split(",", 1)[1]), dtype=np.uint8)
+    else:
+        # np.fromfile + imdecode also copes with non-ASCII paths on Windows
+        buffer = np.fromfile(source, dtype=np.uint8)
+
+    import cv2
+    header = jpeg_header(buffer)
+    if header is None:
+        img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    else:
+        width, height, orientation = header
+        if orientation >= 5:
+            # Rotated a quarter turn: the upright image is height x width
+            width, height = height, width
+        factor = reduction_factor(width, height, target_size) if target_size and REDUCED_DECODE else 1
+        flags = {
+            1: cv2.IMREAD_COLOR,
+            2: cv2.IMREAD_REDUCED_COLOR_2,
+            4: cv2.IMREAD_REDUCED_COLOR_4,
+            8: cv2.IMREAD_REDUCED_COLOR_8
+        }[factor]
+        # Orientation is applied below, on the already reduced array
+        img = cv2.imdecode(buffer, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+        if img is not None:
+            if factor > 1:
+                log_with_time(f"Decoded {width}x{height} JPEG at 1/{factor} scale")
+            img = apply_orientation(img, orientation)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img
+
+def resize_to_fit(img, target_size=TARGET_SIZE):
+    """Resize image to reduce processing time while maintaining quality"""
+    height, width = img.shape[:2]
+    if height <= target_size[0] and width <= target_size[1]:
+        return img
+
+    log_with_time(f"Resizing image from {width}x{height} to optimize processing")
+    # Calculate scaling factor to maintain aspect ratio
+    scale = min(target_size[0]/height, target_size[1]/width)
+    new_width = int(width * scale)
+    new_height = int(height * scale)
+    import cv2
+    return cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+def load_image(source, target_size=TARGET_SIZE):
+    """Decode and downscale once; the result is what every pipeline stage consumes"""
+    log_with_time("start image decode")
+    img = resize_to_fit(decode_image(source, target_size), target_size)
+    log_with_time("end image decode")
+    return img
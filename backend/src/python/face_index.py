@@ -0,0 +1,318 @@
+# APPROXIMATE NEAREST-NEIGHBOUR INDEX FOR 1:N IDENTIFICATION
+# Pure NumPy IVF (inverted file) index over normalized embeddings: a spherical
+# k-means coarse quantizer splits the gallery into nlist cells, and a query
+# only scans the nprobe cells whose centroids are closest to it. Rows can be
+# added and removed incrementally as templates change.
+#
+# Writes from other processes (pool workers, register_face.py and
+# bulk_register_faces.py runs, compact_face_data.py archiving) are picked up
+# by refresh_index(): at most every FACE_INDEX_REFRESH_SECONDS, identify
+# compares COUNT(*) / MAX(id) of face_data with what the index last saw, adds
+# rows past the last id and, if rows disappeared, drops them.
+import os
+import time
+import threading
+import numpy as np
+from face_common import log_with_time, EMBEDDING_DIMENSION
+from face_gallery import FaceGallery
+
+# 64 matched brute force on the top employee for every probe at 200k rows
+# (benchmark_face_index.py); 32 disagreed on about 1 in 400
+INDEX_NPROBE = int(os.getenv("FACE_INDEX_NPROBE", 64))
+IDENTIFY_CANDIDATES = 10  # nearest rows whose employees are re-ranked when identifying
+INDEX_BUILD_CHUNK = 5000
+INDEX_REFRESH_INTERVAL = float(os.getenv("FACE_INDEX_REFRESH_SECONDS", 5))  # 0 = before every identify
+MIN_ROWS_PER_LIST = 64  # below this many rows per cell a flat scan is as fast
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+
+def train_coarse_quantizer(matrix, nlist, seed=0):
+    """Spherical k-means on a sample of normalized rows; returns (nlist, d) unit centroids"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(matrix), nlist * KMEANS_SAMPLE_PER_LIST)
+    sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Empty cells keep their previous centroid
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+    return centroids.astype(np.float32)
+
+class _InvertedList:
+    """Growable contiguous storage for one IVF cell"""
+
+    def __init__(self, dim):
+        self.vectors = np.empty((16, dim), dtype=np.float32)
+        self.labels = np.empty(16, dtype=np.int64)
+        self.row_ids = np.empty(16, dtype=np.int64)
+        self.size = 0
+
+    def extend(self, vectors, labels, row_ids):
+        """Append rows; returns the position of the first one"""
+        start = self.size
+        needed = start + len(vectors)
+        if needed > len(self.labels):
+            capacity = max(needed, 2 * len(self.labels))
+            self.vectors = np.resize(self.vectors, (capacity, self.vectors.shape[1]))
+            self.labels = np.resize(self.labels, capacity)
+            self.row_ids = np.resize(self.row_ids, capacity)
+        self.vectors[start:needed] = vectors
+        self.labels[start:needed] = labels
+        self.row_ids[start:needed] = row_ids
+        self.size = needed
+        return start
+
+    def swap_remove(self, position):
+        """Remove by moving the last row into position; returns the row id that moved (or None)"""
+        last = self.size - 1
+        moved = None
+        if position != last:
+            self.vectors[position] = self.vectors[last]
+            self.labels[position] = self.labels[last]
+            self.row_ids[position] = self.row_ids[last]
+            moved = int(self.row_ids[position])
+        self.size = last
+        return moved
+
+class FaceIndex:
+    """IVF index mapping face_data rows to employee ids"""
+
+    def __init__(self, centroids, nprobe=INDEX_NPROBE):
+        self.centroids = centroids
+        self.nprobe = nprobe
+        self.lists = [_InvertedList(centroids.shape[1]) for _ in range(len(centroids))]
+        self.locations = {}  # row id -> (list number, position)
+        self.employee_rows = {}  # employee id -> set of row ids
+        self.trained_on = 0
+        self.max_row_id = 0
+        self.fingerprint = None  # (COUNT(*), MAX(id)) of face_data when last in sync
+        self.checked_at = 0.0
+        self.lock = threading.RLock()
+
+    @classmethod
+    def train(cls, matrix, nlist=None, nprobe=INDEX_NPROBE):
+        if nlist is None:
+            nlist = int(4 * np.sqrt(len(matrix)))
+        nlist = max(1, min(nlist, len(matrix) // MIN_ROWS_PER_LIST))
+        if nlist == 1:
+            centroids = np.zeros((1, matrix.shape[1] if len(matrix) else EMBEDDING_DIMENSION), dtype=np.float32)
+        else:
+            centroids = train_coarse_quantizer(matrix, nlist)
+        index = cls(centroids, nprobe)
+        index.trained_on = len(matrix)
+        return index
+
+    def __len__(self):
+        return len(self.locations)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def add(self, matrix, labels, row_ids):
+        if not len(matrix):
+            return
+        labels = np.asarray(labels, dtype=np.int64)
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        with self.lock:
+            self.remove(row_ids.tolist())
+            self.max_row_id = max(self.max_row_id, int(row_ids.max()))
+            cells = np.argmax(matrix @ self.centroids.T, axis=1)
+            # Bulk-append per cell, then record where each row landed
+            order = np.argsort(cells, kind="stable")
+            unique_cells, starts = np.unique(cells[order], return_index=True)
+            for cell, members in zip(unique_cells, np.split(order, starts[1:])):
+                start = self.lists[cell].extend(matrix[members], labels[members], row_ids[members])
+                for offset, member in enumerate(members.tolist()):
+                    row_id = int(row_ids[member])
+                    self.locations[row_id] = (int(cell), start + offset)
+                    self.employee_rows.setdefault(int(labels[member]), set()).add(row_id)
+
+    def _remove(self, row_id):
+        cell, position = self.locations.pop(row_id)
+        label = int(self.lists[cell].labels[position])
+        self.employee_rows[label].discard(row_id)
+        if not self.employee_rows[label]:
+            del self.employee_rows[label]
+        moved = self.lists[cell].swap_remove(position)
+        if moved is not None:
+            self.locations[moved] = (cell, position)
+
+    def remove(self, row_ids):
+        with self.lock:
+            for row_id in row_ids:
+                if row_id in self.locations:
+                    self._remove(row_id)
+
+    def replace_employee(self, employee_id, gallery):
+        """Swap an employee's rows for the templates in gallery (after a match or re-registration)"""
+        with self.lock:
+            self.remove(list(self.employee_rows.get(int(employee_id), ())))
+            self.add(gallery.matrix, gallery.employee_ids, gallery.row_ids)
+
+    def search(self, probe, k=5, nprobe=None):
+        """Returns up to k (employee_id, distance, row_id) nearest rows, closest first"""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        with self.lock:
+            cells = np.argsort(-(self.centroids @ probe))[:nprobe]
+            candidates = [self.lists[cell] for cell in cells if self.lists[cell].size]
+            if not candidates:
+                return []
+            vectors = np.concatenate([c.vectors[:c.size] for c in candidates])
+            labels = np.concatenate([c.labels[:c.size] for c in candidates])
+            row_ids = np.concatenate([c.row_ids[:c.size] for c in candidates])
+
+        distances = 1.0 - vectors @ probe
+        k = min(k, len(distances))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [(int(labels[i]), float(distances[i]), int(row_ids[i])) for i in top]
+
+    def identify(self, probe, k=IDENTIFY_CANDIDATES, nprobe=None):
+        """Candidate employees from the k nearest rows, re-ranked exactly.
+
+        Each candidate's distance is its closest template over all of its rows,
+        not only those in the probed cells. Returns (employee_id, distance,
+        row_id) per candidate, closest first.
+        """
+        nearest = self.search(probe, k, nprobe)
+        ranked = []
+        with self.lock:
+            for employee_id in dict.fromkeys(label for label, _, _ in nearest):
+                row_ids = list(self.employee_rows.get(employee_id, ()))
+                if not row_ids:
+                    continue
+                vectors = np.stack([self.lists[cell].vectors[position]
+                                    for cell, position in (self.locations[row_id] for row_id in row_ids)])
+                distances = 1.0 - vectors @ probe
+                best = int(np.argmin(distances))
+                ranked.append((employee_id, float(distances[best]), row_ids[best]))
+        return sorted(ranked, key=lambda candidate: candidate[1])
+
+    def needs_retrain(self):
+        """Cells drift once the gallery grows well past what k-means saw"""
+        return len(self) > 4 * max(self.trained_on, MIN_ROWS_PER_LIST)
+
+    def vectors(self):
+        with self.lock:
+            parts = [(c.vectors[:c.size], c.labels[:c.size], c.row_ids[:c.size]) for c in self.lists if c.size]
+        if not parts:
+            return np.empty((0, self.centroids.shape[1]), dtype=np.float32), [], []
+        return (np.concatenate([p[0] for p in parts]),
+                np.concatenate([p[1] for p in parts]).tolist(),
+                np.concatenate([p[2] for p in parts]).tolist())
+
+    def retrained(self):
+        matrix, labels, row_ids = self.vectors()
+        index = FaceIndex.train(matrix, nprobe=self.nprobe)
+        index.add(matrix, labels, row_ids)
+        index.max_row_id = max(index.max_row_id, self.max_row_id)
+        index.fingerprint, index.checked_at = self.fingerprint, self.checked_at
+        return index
+
+def iter_face_rows(cursor, after_id=0, chunk_size=INDEX_BUILD_CHUNK):
+    """FaceGallery per id-ordered chunk of face_data rows with id > after_id"""
+    last_id = after_id
+    while True:
+        cursor.execute("""
+                       SELECT id, employeeID, face_encoding, createdAt
+                       FROM face_data
+                       WHERE id > %s
+                       ORDER BY id
+                           LIMIT %s
+                       """, (last_id, chunk_size))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield FaceGallery.from_records(rows)
+
+def face_data_fingerprint(cursor):
+    """(row count, highest id) of face_data: changes whenever another process writes"""
+    cursor.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM face_data")
+    count, max_id = cursor.fetchall()[0]
+    return int(count), int(max_id)
+
+def build_index_from_db(cursor, chunk_size=INDEX_BUILD_CHUNK, nlist=None):
+    """Load every face_data row in id-ordered chunks and build a trained index"""
+    log_with_time("start building face index")
+    fingerprint = face_data_fingerprint(cursor)
+    galleries = list(iter_face_rows(cursor, 0, chunk_size))
+
+    matrix = np.concatenate([g.matrix for g in galleries]) if galleries else np.empty((0, EMBEDDING_DIMENSION), dtype=np.float32)
+    labels = [label for g in galleries for label in g.employee_ids]
+    row_ids = [row_id for g in galleries for row_id in g.row_ids]
+
+    index = FaceIndex.train(matrix, nlist)
+    index.add(matrix, labels, row_ids)
+    index.fingerprint, index.checked_at = fingerprint, time.monotonic()
+    log_with_time(f"end building face index - {len(index)} rows in {index.nlist} cells")
+    return index
+
+def refresh_index(index, cursor):
+    """Bring the index in line with rows other processes added or archived; returns True if it changed"""
+    index.checked_at = time.monotonic()
+    fingerprint = face_data_fingerprint(cursor)
+    if fingerprint == index.fingerprint:
+        return False
+
+    added = 0
+    # Rows committed by others since the last check (re-adding our own is a no-op)
+    for gallery in iter_face_rows(cursor, index.max_row_id):
+        index.add(gallery.matrix, gallery.employee_ids, gallery.row_ids)
+        added += len(gallery)
+
+    removed = 0
+    if fingerprint[0] != len(index):
+        # Something was deleted or archived, or rows landed below max(id): reconcile ids
+        cursor.execute("SELECT id FROM face_data")
+        stored = {row[0] for row in cursor.fetchall()}
+        with index.lock:
+            stale = [row_id for row_id in index.locations if row_id not in stored]
+            missing = [row_id for row_id in stored if row_id not in index.locations]
+        index.remove(stale)
+        removed = len(stale)
+        for start in range(0, len(missing), INDEX_BUILD_CHUNK):
+            chunk = missing[start:start + INDEX_BUILD_CHUNK]
+            cursor.execute(f"""
+                           SELECT id, employeeID, face_encoding, createdAt
+                           FROM face_data
+                           WHERE id IN ({", ".join(["%s"] * len(chunk))})
+                           """, tuple(chunk))
+            gallery = FaceGallery.from_records(cursor.fetchall())
+            index.add(gallery.matrix, gallery.employee_ids, gallery.row_ids)
+            added += len(gallery)
+
+    index.fingerprint = fingerprint
+    if added or removed:
+        log_with_time(f"Face index refreshed: {added} rows added, {removed} removed")
+    return bool(added or removed)
+
+_face_index = None
+_face_index_lock = threading.Lock()
+
+def get_face_index(conn):
+    """Process-wide index, built from the DB on first use and kept up to date incrementally"""
+    global _face_index
+    with _face_index_lock:
+        if _face_index is None or time.monotonic() - _face_index.checked_at >= INDEX_REFRESH_INTERVAL:
+            cursor = conn.cursor()
+            try:
+                if _face_index is None:
+                    _face_index = build_index_from_db(cursor)
+                else:
+                    refresh_index(_face_index, cursor)
+            finally:
+                cursor.close()
+        if _face_index.needs_retrain():
+            log_with_time("Retraining face index")
+            _face_index = _face_index.retrained()
+        return _face_index
+
+def loaded_face_index():
+    """The index if it has been built in this process, else None (nothing to keep in sync)"""
+    return _face_index
@@ -0,0 +1,106 @@
+# LOW-MEMORY MODE AND RSS ACCOUNTING
+# FACE_LOW_MEMORY=1 trades a little latency for a smaller, flatter RSS:
+#
+#   - glibc keeps at most FACE_MALLOC_ARENAS malloc arenas instead of one per
+#     thread, and freed heap is handed back to the OS after every request
+#   - TensorFlow gets one inter-op thread and grows GPU memory on demand
+#     instead of reserving it (CPU-only boxes only see the thread cap)
+#   - Fasnet is loaded on the first liveness check, not preloaded, and the
+#     gallery / result caches default to a fraction of their normal size
+#
+# FACE_MEMORY_BUDGET_MB sets the RSS a worker should stay under (either mode):
+# past it the worker drops its caches and trims the heap, and a pre-fork pool
+# worker that is still over budget is recycled.
+#
+# FACE_TRACK_MEMORY=1 makes every span record the peak RSS reached while it
+# ran (see face_metrics.py); benchmark_face_memory.py reports it per stage.
+# The high-water mark is per process, so the worker and the service then run
+# requests on a single thread (request_threads()).
+import os
+import gc
+import ctypes
+import ctypes.util
+from face_common import log_with_time, current_rss_mb
+
+LOW_MEMORY = os.getenv("FACE_LOW_MEMORY", "0") == "1"
+MEMORY_BUDGET_MB = float(os.getenv("FACE_MEMORY_BUDGET_MB", 0))  # 0 = no budget
+MALLOC_ARENAS = int(os.getenv("FACE_MALLOC_ARENAS", 2))
+TRACK_MEMORY = os.getenv("FACE_TRACK_MEMORY", "0") == "1"
+
+M_ARENA_MAX = -8  # mallopt parameter from glibc's malloc.h
+
+_libc = None
+
+def libc():
+    """glibc, or None on platforms without it"""
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+            _libc.malloc_trim
+        except (OSError, AttributeError):
+            _libc = False
+    return _libc or None
+
+def peak_rss_mb():
+    """Peak RSS since start-up or the last reset_peak_rss(), in MB"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return current_rss_mb()
+
+def reset_peak_rss():
+    """Restart the VmHWM high-water mark at the current RSS (Linux 4.0+)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def release_memory():
+    """Collect garbage and return freed heap pages to the OS"""
+    gc.collect()
+    lib = libc()
+    if lib is not None:
+        lib.malloc_trim(0)
+
+def configure_low_memory():
+    """Apply the process-wide low-memory settings; call before TensorFlow runs anything"""
+    if not LOW_MEMORY:
+        return
+    lib = libc()
+    if lib is not None:
+        lib.mallopt(M_ARENA_MAX, MALLOC_ARENAS)
+    import tensorflow as tf
+    for gpu in tf.config.list_physical_devices("GPU"):
+        tf.config.experimental.set_memory_growth(gpu, True)
+    log_with_time(f"Low-memory mode: {MALLOC_ARENAS} malloc arenas, budget {MEMORY_BUDGET_MB or 'unset'} MB")
+
+def request_threads(threads, setting):
+    """Request threads to run: 1 with FACE_TRACK_MEMORY=1, where spans reset a process-wide peak"""
+    if TRACK_MEMORY and threads > 1:
+        log_with_time(f"FACE_TRACK_MEMORY=1: running requests on 1 thread instead of {setting}={threads}")
+        return 1
+    return threads
+
+def enforce_budget(*caches):
+    """After a request: trim the heap in low-memory mode and drop caches once over budget.
+
+    Returns the RSS in MB afterwards.
+    """
+    if LOW_MEMORY:
+        release_memory()
+    rss = current_rss_mb()
+    if MEMORY_BUDGET_MB and rss > MEMORY_BUDGET_MB:
+        for cache in caches:
+            cache.clear()
+        release_memory()
+        trimmed = current_rss_mb()
+        log_with_time(f"RSS {rss:.0f} MB over the {MEMORY_BUDGET_MB:.0f} MB budget; caches dropped, now {trimmed:.0f} MB")
+        rss = trimmed
+    return rss
@@ -0,0 +1,222 @@
+# STRUCTURED TIMING AND METRICS FOR THE FACE PIPELINE
+# Stages run inside span("name"). Each span adds its duration to the current
+# request's trace (returned to the caller as the "timings" object) and to a
+# per-stage histogram. Every request also lands in a per-op, per-outcome
+# histogram. Counters track discrete pipeline events such as detector cascade
+# short-circuits and quality-gate rejections; gauges and histograms cover the
+# micro-batching and write-behind queues.
+# render_prometheus() dumps all of it in Prometheus text format.
+#
+# A span costs two perf_counter calls and a few dict updates, so it is safe
+# on the hot path. With FACE_TRACK_MEMORY=1 it also resets and reads the
+# process's peak RSS, and responses carry a "memory" object next to "timings".
+# That peak is process-wide: a span started on another thread resets it for
+# every span still running. So the worker and the service drop to one request
+# thread while tracking (face_memory.request_threads). The micro-batch
+# threads still reset it while a request's "liveness" / "embed" span waits on
+# them, which only trims the part of that span before the batch started.
+# Per-stage peak_rss_mb is a profiling aid for one request at a time, not a
+# production metric.
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from face_common import current_rss_mb
+from face_memory import TRACK_MEMORY, peak_rss_mb, reset_peak_rss
+
+# Seconds: from a cached-gallery compare up to a cold model load
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """Cumulative Prometheus-style histogram keyed by label values"""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}  # label values -> [bucket counts..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    def snapshot(self):
+        """{label values: {"count", "sum", "buckets": {le: cumulative count}}}"""
+        with self.lock:
+            return {
+                labels: {
+                    "count": series[-2],
+                    "sum": series[-1],
+                    "buckets": dict(zip(self.buckets, series[:len(self.buckets)]))
+                }
+                for labels, series in self.series.items()
+            }
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, data in sorted(self.snapshot().items()):
+            label_text = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            for bound, count in data["buckets"].items():
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {data["count"]}')
+            lines.append(f"{self.name}_count{{{label_text}}} {data['count']}")
+            lines.append(f"{self.name}_sum{{{label_text}}} {data['sum']:.6f}")
+        return lines
+
+class Counter:
+    """Monotonic Prometheus-style counter keyed by label values"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values):
+        self.add(1, *label_values)
+
+    def add(self, amount, *label_values):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.series)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, count in sorted(self.snapshot().items()):
+            label_text = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            lines.append(f"{self.name}{{{label_text}}} {count}")
+        return lines
+
+class Gauge:
+    """Current value keyed by label values, e.g. a queue depth"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.series[label_values] = value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.series)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.snapshot().items()):
+            label_text = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            lines.append(f"{self.name}{{{label_text}}} {value}")
+        return lines
+
+STAGE_DURATION = Histogram("face_stage_duration_seconds", "Duration of one face pipeline stage", ("stage",))
+REQUEST_DURATION = Histogram("face_request_duration_seconds", "End-to-end face request duration", ("op", "outcome"))
+CASCADE_EVENTS = Counter("face_cascade_events_total", "How the detector cascade resolved each frame", ("result",))
+QUALITY_REJECTIONS = Counter("face_quality_rejections_total", "Frames rejected by the pre-inference quality gate", ("reason",))
+QUALITY_SAVED = Counter("face_quality_saved_seconds_total", "Estimated inference time skipped by quality rejections", ("reason",))
+STAGE_PEAK_RSS = Gauge("face_stage_peak_rss_megabytes", "Peak RSS during the last run of a stage (FACE_TRACK_MEMORY=1)", ("stage",))
+BATCH_QUEUE_DEPTH = Gauge("face_batch_queue_depth", "Items waiting for the next micro-batch", ("stage",))
+BATCH_SIZE = Histogram("face_batch_size", "Items per micro-batched forward pass", ("stage",),
+                       buckets=(1, 2, 4, 8, 16, 32, 64))
+BATCH_WAIT = Histogram("face_batch_wait_seconds", "Time an item waited in the queue before its batch ran", ("stage",),
+                       buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+WRITEBACK_PENDING = Gauge("face_writeback_pending", "Matched samples waiting for the write-behind queue to store them", ("queue",))
+WRITEBACK_LAG = Gauge("face_writeback_lag_seconds", "Age of the oldest sample not yet committed", ("queue",))
+WRITEBACK_DELAY = Histogram("face_writeback_delay_seconds", "Time from a match to its sample being committed", ("queue",),
+                            buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+class Trace:
+    """Spans of one request, in the order they finished"""
+
+    def __init__(self, op):
+        self.op = op
+        self.started = time.perf_counter()
+        self.spans = []
+        self.outcome = None
+        self.peak_rss = {}  # stage -> highest peak RSS in MB, when memory is tracked
+
+    def timings(self):
+        """Milliseconds per stage (repeated stages summed) plus the request total"""
+        timings = {}
+        for name, seconds in self.spans:
+            timings[name] = timings.get(name, 0.0) + seconds * 1000
+        timings["total"] = (time.perf_counter() - self.started) * 1000
+        return {name: round(ms, 3) for name, ms in timings.items()}
+
+    def finish(self, response, exit_code):
+        """Attach timings to the response and record the request outcome"""
+        if isinstance(response, dict):
+            response["timings"] = self.timings()
+            if self.peak_rss:
+                response["memory"] = {
+                    "peak_rss_mb": {name: round(mb, 1) for name, mb in self.peak_rss.items()},
+                    "rss_mb": round(current_rss_mb(), 1)
+                }
+        REQUEST_DURATION.observe(time.perf_counter() - self.started, self.op, outcome_of(self, response, exit_code))
+        return response
+
+_current_trace = ContextVar("face_trace", default=None)
+
+def outcome_of(trace, response, exit_code):
+    if trace.outcome:
+        return trace.outcome
+    if not isinstance(response, dict) or response.get("error"):
+        return "error"
+    if trace.op == "register":
+        return "registered" if exit_code == 0 else "error"
+    return "matched" if response.get("matched") else "no_match"
+
+@contextmanager
+def traced_request(op):
+    trace = Trace(op)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+@contextmanager
+def span(name):
+    # Stages don't nest, so one high-water mark per span is enough
+    track_memory = TRACK_MEMORY and reset_peak_rss()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((name, elapsed))
+        if track_memory:
+            peak = peak_rss_mb()
+            STAGE_PEAK_RSS.set(round(peak, 1), name)
+            if trace is not None:
+                trace.peak_rss[name] = max(peak, trace.peak_rss.get(name, 0.0))
+
+def record_outcome(outcome):
+    """Label the current request, e.g. with a FaceRejected reason"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.outcome = outcome
+
+def render_prometheus():
+    metrics = (STAGE_DURATION, REQUEST_DURATION, CASCADE_EVENTS, QUALITY_REJECTIONS, QUALITY_SAVED, STAGE_PEAK_RSS,
+               BATCH_QUEUE_DEPTH, BATCH_SIZE, BATCH_WAIT, WRITEBACK_PENDING, WRITEBACK_LAG, WRITEBACK_DELAY)
+    return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
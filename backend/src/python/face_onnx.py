@@ -0,0 +1,120 @@
+# ONNX RUNTIME BACKEND FOR FACENET AND FASNET
+# Drop-in replacements for the two DeepFace models that dominate CPU time,
+# selected with FACE_INFERENCE_BACKEND=onnx. The .onnx files are produced by
+# export_onnx_models.py; FACE_ONNX_QUANTIZED=1 loads the int8 variants.
+# Detection (MTCNN) still runs through DeepFace.
+#
+# Both classes reproduce DeepFace's preprocessing exactly so embeddings and
+# liveness scores stay comparable with rows stored by the TensorFlow backend;
+# verify_onnx_backend.py measures the remaining drift.
+import os
+import threading
+import numpy as np
+from face_common import log_with_time, MODEL_NAME
+
+ONNX_DIR = os.getenv("FACE_ONNX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_models"))
+ONNX_QUANTIZED = os.getenv("FACE_ONNX_QUANTIZED", "0") == "1"
+ONNX_THREADS = int(os.getenv("FACE_ONNX_THREADS", 0))  # 0 lets ONNX Runtime decide
+
+FACENET_FILE = "facenet"
+FASNET_FILES = ("fasnet_v2", "fasnet_v1se")
+# Context scale of each Fasnet model's crop around the face box, as in DeepFace
+FASNET_SCALES = (2.7, 4.0)
+FASNET_INPUT_SIZE = 80
+
+def model_path(name, quantized=ONNX_QUANTIZED, directory=ONNX_DIR):
+    return os.path.join(directory, f"{name}.int8.onnx" if quantized else f"{name}.onnx")
+
+def create_session(path):
+    import onnxruntime as ort
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"ONNX model not found: {path} (run export_onnx_models.py)")
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if ONNX_THREADS:
+        options.intra_op_num_threads = ONNX_THREADS
+    log_with_time(f"Loading ONNX model {os.path.basename(path)}")
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+def letterbox(img, target_size):
+    """deepface.modules.preprocessing.resize_image without the Keras dependency"""
+    import cv2
+    factor = min(target_size[0] / img.shape[0], target_size[1] / img.shape[1])
+    img = cv2.resize(img, (int(img.shape[1] * factor), int(img.shape[0] * factor)))
+    diff_0 = target_size[0] - img.shape[0]
+    diff_1 = target_size[1] - img.shape[1]
+    img = np.pad(img, ((diff_0 // 2, diff_0 - diff_0 // 2), (diff_1 // 2, diff_1 - diff_1 // 2), (0, 0)), "constant")
+    if img.shape[0:2] != target_size:
+        img = cv2.resize(img, target_size)
+    img = img.astype(np.float32)
+    if img.max() > 1:
+        img = img / 255.0
+    return img[np.newaxis]
+
+class OnnxFacenet:
+    """Facenet embeddings from an exported NHWC float32 graph"""
+
+    def __init__(self, quantized=ONNX_QUANTIZED, directory=ONNX_DIR):
+        self.session = create_session(model_path(FACENET_FILE, quantized, directory))
+        self.input_name = self.session.get_inputs()[0].name
+        height, width = self.session.get_inputs()[0].shape[1:3]
+        # Same (width, height) convention as DeepFace's model.input_shape
+        self.input_shape = (width, height)
+
+    def preprocess(self, face_crops):
+        """RGB [0, 1] crops from detect_faces -> the BGR batch DeepFace.represent feeds Facenet"""
+        target_size = (self.input_shape[1], self.input_shape[0])
+        return np.concatenate([letterbox(crop[:, :, ::-1], target_size) for crop in face_crops])
+
+    def embed(self, face_crops):
+        return self.session.run(None, {self.input_name: self.preprocess(face_crops)})[0]
+
+def fasnet_batch(items, scale):
+    """NCHW float32 batch of the scale-x context crops for [(img, (x, y, w, h)), ...].
+
+    Same crop as DeepFace's Fasnet, left unscaled like its to_tensor.
+    """
+    from deepface.models.spoofing.FasNet import crop
+    return np.stack([
+        crop(img, box, scale, FASNET_INPUT_SIZE, FASNET_INPUT_SIZE).transpose(2, 0, 1) for img, box in items
+    ]).astype(np.float32)
+
+def softmax(logits):
+    exp = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+def fasnet_verdicts(prediction):
+    """(is_real, score) per row of the summed two-model softmax, as Fasnet.analyze returns"""
+    labels = np.argmax(prediction, axis=1)
+    return [(label == 1, row[label] / 2) for label, row in zip(labels, prediction)]
+
+class OnnxFasnet:
+    """MiniFASNetV2 + MiniFASNetV1SE ensemble with the DeepFace Fasnet.analyze interface"""
+
+    def __init__(self, quantized=ONNX_QUANTIZED, directory=ONNX_DIR):
+        self.sessions = [create_session(model_path(name, quantized, directory)) for name in FASNET_FILES]
+
+    def analyze_batch(self, items):
+        prediction = np.zeros((len(items), 3))
+        for session, scale in zip(self.sessions, FASNET_SCALES):
+            batch = fasnet_batch(items, scale)
+            prediction += softmax(session.run(None, {session.get_inputs()[0].name: batch})[0])
+        return fasnet_verdicts(prediction)
+
+    def analyze(self, img, facial_area):
+        return self.analyze_batch([(img, facial_area)])[0]
+
+_models = {}
+_models_lock = threading.Lock()
+
+def get_onnx_model(name):
+    """Process-wide ONNX model ("Facenet" or "Fasnet"), loaded on first use"""
+    with _models_lock:
+        if name not in _models:
+            if name == MODEL_NAME:
+                _models[name] = OnnxFacenet()
+            elif name == "Fasnet":
+                _models[name] = OnnxFasnet()
+            else:
+                raise ValueError(f"No ONNX backend for {name}")
+        return _models[name]
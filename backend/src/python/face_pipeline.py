@@ -0,0 +1,286 @@
+# SINGLE-PASS DETECT -> ALIGN -> LIVENESS -> EMBED PIPELINE
+# MTCNN runs exactly once per image. The aligned crop it returns is fed straight
+# to Facenet and its box to the anti-spoofing model, instead of letting
+# extract_faces(anti_spoofing=True) and represent(detector_backend='mtcnn')
+# each detect the face again.
+#
+# DeepFace (and with it TensorFlow) is imported on first use, so requests
+# rejected by the cheap checks never pay for it.
+#
+# Detector cascade: a cheap first-stage detector (FACE_CASCADE_DETECTOR, any
+# DeepFace detector backend; empty disables it) finds the face box. Frames
+# where it sees several faces (or none, unless FACE_CASCADE_ON_EMPTY=full_frame)
+# are rejected right there, and MTCNN only runs on a padded region of interest
+# around the single box instead of the whole frame. Fasnet already reads only
+# its own 2.7x / 4x context crops around the box, so it gets the full frame
+# and the box translated back into frame coordinates.
+#
+# FACE_INFERENCE_BACKEND=onnx runs Facenet and Fasnet through ONNX Runtime
+# (face_onnx.py) instead of TensorFlow / PyTorch; detection is unchanged.
+#
+# Quality gate (face_quality.py): brightness and contrast are checked right
+# after decoding, face size and sharpness on the first face box, so poor
+# frames are rejected in milliseconds with their own reason instead of after
+# MTCNN, Fasnet and Facenet.
+#
+# In the face worker, start_micro_batching() routes liveness and embedding
+# through face_batching.MicroBatcher so concurrent requests share one batched
+# forward pass per stage.
+import os
+import numpy as np
+from face_batching import MicroBatcher, BATCH_MAX_SIZE, BATCH_MAX_WAIT
+from face_common import log_with_time, DETECTOR_BACKEND, MODEL_NAME
+from face_image import load_image, sniff_image_type
+from face_metrics import span, CASCADE_EVENTS
+from face_quality import frame_scores, face_scores, frame_failure, face_failure, rejection, QUALITY_GATE
+
+CASCADE_DETECTOR = os.getenv("FACE_CASCADE_DETECTOR", "opencv")
+CASCADE_PADDING = float(os.getenv("FACE_CASCADE_PADDING", 0.5))  # fraction of the box added on each side
+CASCADE_ON_EMPTY = os.getenv("FACE_CASCADE_ON_EMPTY", "reject")  # or "full_frame"
+INFERENCE_BACKEND = os.getenv("FACE_INFERENCE_BACKEND", "deepface")  # or "onnx"
+
+class FaceRejected(Exception):
+    """Image was rejected; reason is one of poor_quality, no_face, multiple_faces, spoof
+    or a quality gate reason (too_dark, overexposed, low_contrast, blurry, face_too_small).
+
+    details are extra response fields, e.g. the quality scores.
+    """
+    def __init__(self, reason, message, details=None):
+        super().__init__(message)
+        self.reason = reason
+        self.details = details or {}
+
+def precheck_image(img):
+    """Reject missing or non-image sources before any decoding or model loading"""
+    if sniff_image_type(img) is None:
+        log_with_time("Image source is missing or not a supported image type")
+        raise FaceRejected("poor_quality", "Poor image quality or no face detected. Please try again.")
+
+def load_bgr_image(img):
+    """Decode once; every later stage works on the same BGR array"""
+    if isinstance(img, np.ndarray):
+        return img
+    try:
+        with span("decode"):
+            return load_image(img)
+    except (ValueError, OSError) as e:
+        log_with_time(f"Error decoding image: {str(e)}")
+        raise FaceRejected("poor_quality", "Poor image quality or no face detected. Please try again.")
+
+def detect_faces_full_frame(img):
+    """Detect and align faces with MTCNN (no anti-spoofing, no embedding)"""
+    from deepface import DeepFace
+    try:
+        with span("detect"):
+            faces = DeepFace.extract_faces(
+                img_path=img,
+                detector_backend=DETECTOR_BACKEND,
+                enforce_detection=True,
+                align=True,
+                anti_spoofing=False
+            )
+    except Exception as e:
+        log_with_time(f"Face detection failed: {str(e)}")
+        raise FaceRejected("poor_quality", "Poor image quality or no face detected. Please try again.")
+    return faces
+
+def find_face_boxes(img, detector):
+    """First cascade stage: (x, y, w, h) boxes from the cheap detector"""
+    from deepface import DeepFace
+    with span("cascade"):
+        regions = DeepFace.build_model(detector, task="face_detector").detect_faces(img)
+    return [(region.x, region.y, region.w, region.h) for region in regions]
+
+def padded_roi(img, box, padding=CASCADE_PADDING):
+    """(x0, y0, x1, y1) of the box grown by padding on every side, clipped to the frame"""
+    x, y, w, h = box
+    height, width = img.shape[:2]
+    pad_x, pad_y = int(w * padding), int(h * padding)
+    return max(0, x - pad_x), max(0, y - pad_y), min(width, x + w + pad_x), min(height, y + h + pad_y)
+
+def offset_facial_area(facial_area, dx, dy):
+    """Translate a facial_area detected in the ROI back to full-frame coordinates"""
+    moved = {}
+    for key, value in facial_area.items():
+        if key == "x":
+            moved[key] = value + dx
+        elif key == "y":
+            moved[key] = value + dy
+        elif isinstance(value, (tuple, list)) and len(value) == 2:
+            moved[key] = (value[0] + dx, value[1] + dy)
+        else:
+            moved[key] = value
+    return moved
+
+def check_quality(scores, reason, skipped_stages):
+    if reason:
+        log_with_time(f"Quality gate: {reason} {scores}")
+        raise FaceRejected(reason, *rejection(reason, scores, skipped_stages))
+
+def check_frame_quality(img, skipped_stages):
+    """Brightness and contrast of the whole frame, before any detector runs"""
+    if not QUALITY_GATE:
+        return
+    with span("quality"):
+        scores = frame_scores(img)
+        reason = frame_failure(scores)
+    check_quality(scores, reason, skipped_stages)
+
+def check_face_quality(img, box, skipped_stages):
+    """Size and sharpness of the single face box"""
+    if not QUALITY_GATE:
+        return
+    with span("quality"):
+        scores = face_scores(img, box)
+        reason = face_failure(scores)
+    check_quality(scores, reason, skipped_stages)
+
+def detect_faces(img, cascade=CASCADE_DETECTOR):
+    """Detect and align faces, through the detector cascade when one is configured"""
+    if not cascade:
+        CASCADE_EVENTS.inc("disabled")
+        check_frame_quality(img, ("detect", "liveness", "embed"))
+        faces = detect_faces_full_frame(img)
+        if len(faces) == 1:
+            area = faces[0]["facial_area"]
+            check_face_quality(img, (area["x"], area["y"], area["w"], area["h"]), ("liveness", "embed"))
+        return faces
+
+    check_frame_quality(img, ("cascade", "detect", "liveness", "embed"))
+    boxes = find_face_boxes(img, cascade)
+    if len(boxes) > 1:
+        CASCADE_EVENTS.inc("rejected_multiple_faces")
+        raise FaceRejected("multiple_faces", "Multiple faces detected. Please ensure only one face is visible.")
+    if not boxes:
+        if CASCADE_ON_EMPTY != "full_frame":
+            CASCADE_EVENTS.inc("rejected_no_face")
+            raise FaceRejected("no_face", "Poor image quality or no face detected. Please try again.")
+        CASCADE_EVENTS.inc("empty_full_frame")
+        return detect_faces_full_frame(img)
+
+    check_face_quality(img, boxes[0], ("detect", "liveness", "embed"))
+    x0, y0, x1, y1 = padded_roi(img, boxes[0])
+    try:
+        faces = detect_faces_full_frame(img[y0:y1, x0:x1])
+    except FaceRejected:
+        # The cheap box was off; give MTCNN the whole frame rather than reject
+        CASCADE_EVENTS.inc("roi_miss_full_frame")
+        return detect_faces_full_frame(img)
+
+    CASCADE_EVENTS.inc("roi")
+    for face in faces:
+        face["facial_area"] = offset_facial_area(face["facial_area"], x0, y0)
+    return faces
+
+# stage -> MicroBatcher, filled by start_micro_batching()
+BATCHERS = {}
+
+def liveness_batch(items):
+    """Fasnet verdicts for [(img, (x, y, w, h)), ...] in one pass per model"""
+    if INFERENCE_BACKEND == "onnx":
+        from face_onnx import get_onnx_model
+        return get_onnx_model("Fasnet").analyze_batch(items)
+
+    import torch
+    from deepface import DeepFace
+    from face_onnx import fasnet_batch, fasnet_verdicts, FASNET_SCALES
+    model = DeepFace.build_model("Fasnet", task="spoofing")
+    prediction = np.zeros((len(items), 3))
+    with torch.no_grad():
+        for network, scale in zip((model.first_model, model.second_model), FASNET_SCALES):
+            batch = torch.from_numpy(fasnet_batch(items, scale)).to(model.device)
+            prediction += torch.softmax(network(batch), dim=1).cpu().numpy()
+    return fasnet_verdicts(prediction)
+
+def check_liveness(img, facial_area):
+    """Run Fasnet on the detected box of the already decoded image"""
+    box = (facial_area["x"], facial_area["y"], facial_area["w"], facial_area["h"])
+    with span("liveness"):
+        batcher = BATCHERS.get("liveness")
+        if batcher is not None:
+            is_real, score = batcher.submit((img, box)).result()
+        elif INFERENCE_BACKEND == "onnx":
+            from face_onnx import get_onnx_model
+            is_real, score = get_onnx_model("Fasnet").analyze(img=img, facial_area=box)
+        else:
+            from deepface import DeepFace
+            model = DeepFace.build_model("Fasnet", task="spoofing")
+            is_real, score = model.analyze(img=img, facial_area=box)
+    return bool(is_real), float(score)
+
+def embed_batch(face_crops):
+    """Facenet forward pass over aligned crops from detect_faces.
+
+    Equivalent to DeepFace.represent(detector_backend='skip') on each crop:
+    crops come back RGB in [0, 1] and represent feeds the model BGR.
+    """
+    if INFERENCE_BACKEND == "onnx":
+        from face_onnx import get_onnx_model
+        return get_onnx_model(MODEL_NAME).embed(face_crops)
+
+    from deepface import DeepFace
+    from deepface.modules import preprocessing
+    model = DeepFace.build_model(MODEL_NAME)
+    target_size = model.input_shape
+    batch = np.concatenate([
+        preprocessing.resize_image(img=crop[:, :, ::-1], target_size=(target_size[1], target_size[0]))
+        for crop in face_crops
+    ])
+    return model.model(batch, training=False).numpy()
+
+def embed_faces(face_crops):
+    """Embeddings for the crops, one row each, shared with other requests' crops when batching"""
+    with span("embed"):
+        batcher = BATCHERS.get("embed")
+        if batcher is None:
+            return embed_batch(face_crops)
+        futures = [batcher.submit(crop) for crop in face_crops]
+        return np.vstack([future.result() for future in futures])
+
+def start_micro_batching(max_batch_size=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT):
+    """Start the liveness and embed schedulers; later calls are no-ops"""
+    if BATCHERS or max_batch_size <= 1:
+        return
+    log_with_time(f"Micro-batching up to {max_batch_size} items, waiting at most {max_wait * 1000:.1f} ms")
+    BATCHERS["liveness"] = MicroBatcher("liveness", liveness_batch, max_batch_size, max_wait)
+    BATCHERS["embed"] = MicroBatcher("embed", embed_batch, max_batch_size, max_wait)
+
+def extract_face_embedding(img, cascade=CASCADE_DETECTOR):
+    """Detect once, check liveness and embed the single face in the image.
+
+    img may be a path, encoded bytes or an already decoded BGR array.
+
+    Returns a dict with embedding, facial_area and antispoof_score;
+    raises FaceRejected when the image can't be used.
+    """
+    img = load_bgr_image(img)
+
+    faces = detect_faces(img, cascade)
+
+    # Check if faces were detected
+    if not faces or len(faces) == 0:
+        raise FaceRejected("no_face", "No face detected in the image")
+
+    # Reject image if more than one face is detected
+    if len(faces) > 1:
+        raise FaceRejected("multiple_faces", "Multiple faces detected. Please ensure only one face is visible.")
+
+    # Keep only the float32 crop; DeepFace hands back float64
+    facial_area = faces[0]["facial_area"]
+    crop = faces[0]["face"].astype(np.float32)
+    del faces
+
+    # Check if the face is real (not spoofed)
+    is_real, antispoof_score = check_liveness(img, facial_area)
+    if not is_real:
+        raise FaceRejected("spoof", "Please use a real face, not a photo or video")
+
+    # The full frame isn't needed past liveness; free it before Facenet runs
+    del img
+    embedding = embed_faces([crop])[0].astype(np.float32, copy=False)
+
+    return {
+        "embedding": embedding,
+        "facial_area": facial_area,
+        "antispoof_score": antispoof_score
+    }
@@ -0,0 +1,121 @@
+# CHEAP PRE-INFERENCE QUALITY GATE
+# Blurry, dark, overexposed or tiny-face photos used to run through MTCNN,
+# Fasnet and Facenet before failing with the generic "Poor image quality or
+# no face detected". These checks are a few NumPy / OpenCV passes over small
+# grayscale thumbnails and run before any deep model:
+#
+#   frame  (right after decoding)    mean brightness and contrast (std of
+#                                    the gray levels)
+#   face   (on the cheap cascade     shorter side of the face box, sharpness
+#           box, or on MTCNN's box   (variance of the Laplacian) of the face
+#           without a cascade)       resized to FACE_SIZE
+#
+# Sharpness is only scored on the face, so a blurred background (portrait
+# mode, a wall out of focus) does not reject a sharp face.
+#
+# A frame below a threshold is rejected with its own reason and message.
+# The rejection also says how much inference it skipped: the mean duration
+# of the skipped stages as timed in this process (a CPU ballpark until a
+# stage has run), summed in face_quality_saved_seconds_total.
+#
+# FACE_QUALITY_GATE=0 turns the gate off; each threshold has its own variable.
+import os
+from face_metrics import STAGE_DURATION, QUALITY_REJECTIONS, QUALITY_SAVED
+
+QUALITY_GATE = os.getenv("FACE_QUALITY_GATE", "1") == "1"
+ANALYSIS_SIZE = int(os.getenv("FACE_QUALITY_ANALYSIS_SIZE", 256))  # long side of the frame thumbnail
+FACE_SIZE = 112  # the face is scored at a fixed size so sharpness compares across distances
+MIN_BRIGHTNESS = float(os.getenv("FACE_QUALITY_MIN_BRIGHTNESS", 40))
+MAX_BRIGHTNESS = float(os.getenv("FACE_QUALITY_MAX_BRIGHTNESS", 220))
+MIN_CONTRAST = float(os.getenv("FACE_QUALITY_MIN_CONTRAST", 15))
+MIN_SHARPNESS = float(os.getenv("FACE_QUALITY_MIN_SHARPNESS", 30))  # Laplacian variance
+MIN_FACE_PIXELS = int(os.getenv("FACE_QUALITY_MIN_FACE_PX", 48))  # in the decoded (resized) frame
+
+MESSAGES = {
+    "too_dark": "Image is too dark. Please move to a brighter place and try again.",
+    "overexposed": "Image is overexposed. Please avoid direct light on the camera and try again.",
+    "low_contrast": "Image is washed out. Please improve the lighting and try again.",
+    "blurry": "Image is blurry. Please hold the camera still and try again.",
+    "face_too_small": "Face is too small. Please move closer to the camera and try again."
+}
+
+# Used for a stage this process has not timed yet
+DEFAULT_STAGE_MS = {"cascade": 15.0, "detect": 120.0, "liveness": 40.0, "embed": 60.0}
+
+def gray_thumbnail(img, size):
+    """Grayscale copy with its long side at most size pixels"""
+    import cv2
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    scale = size / max(gray.shape[:2])
+    if scale < 1:
+        gray = cv2.resize(gray, (max(1, round(gray.shape[1] * scale)), max(1, round(gray.shape[0] * scale))),
+                          interpolation=cv2.INTER_AREA)
+    return gray
+
+def sharpness(gray):
+    """Variance of the Laplacian: low when edges are smeared"""
+    import cv2
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+def frame_scores(img):
+    gray = gray_thumbnail(img, ANALYSIS_SIZE)
+    return {"brightness": float(gray.mean()), "contrast": float(gray.std())}
+
+def face_scores(img, box):
+    """Size and sharpness of the (x, y, w, h) face box"""
+    import cv2
+    x, y, w, h = (int(v) for v in box)
+    height, width = img.shape[:2]
+    x0, y0, x1, y1 = max(0, x), max(0, y), min(width, x + w), min(height, y + h)
+    scores = {"face_pixels": min(w, h)}
+    if x1 > x0 and y1 > y0:
+        face = gray_thumbnail(img[y0:y1, x0:x1], FACE_SIZE)
+        scores["sharpness"] = sharpness(cv2.resize(face, (FACE_SIZE, FACE_SIZE), interpolation=cv2.INTER_AREA))
+    return scores
+
+def frame_failure(scores):
+    """Reason the frame fails the gate, or None"""
+    if scores["brightness"] < MIN_BRIGHTNESS:
+        return "too_dark"
+    if scores["brightness"] > MAX_BRIGHTNESS:
+        return "overexposed"
+    if scores["contrast"] < MIN_CONTRAST:
+        return "low_contrast"
+    return None
+
+def face_failure(scores):
+    if scores["face_pixels"] < MIN_FACE_PIXELS:
+        return "face_too_small"
+    if scores.get("sharpness", MIN_SHARPNESS) < MIN_SHARPNESS:
+        return "blurry"
+    return None
+
+def expected_ms(stages):
+    """Mean milliseconds this process spends in the given stages"""
+    durations = STAGE_DURATION.snapshot()
+    total = 0.0
+    for stage in stages:
+        data = durations.get((stage,))
+        total += data["sum"] / data["count"] * 1000 if data and data["count"] else DEFAULT_STAGE_MS[stage]
+    return total
+
+def rejection(reason, scores, skipped_stages):
+    """(message, details) for a gate failure; records it in the quality metrics"""
+    saved_ms = expected_ms(skipped_stages)
+    QUALITY_REJECTIONS.inc(reason)
+    QUALITY_SAVED.add(saved_ms / 1000, reason)
+    details = {
+        "reason": reason,
+        "quality": {name: round(value, 2) for name, value in scores.items()},
+        "inference_ms_saved": round(saved_ms, 1)
+    }
+    return MESSAGES[reason], details
+
+def stats():
+    rejections = QUALITY_REJECTIONS.snapshot()
+    saved = QUALITY_SAVED.snapshot()
+    return {
+        "enabled": QUALITY_GATE,
+        "rejections": {labels[0]: count for labels, count in rejections.items()},
+        "inference_seconds_saved": round(sum(saved.values()), 3)
+    }
@@ -0,0 +1,373 @@
+# ASYNCIO FACE SERVICE
+# HTTP front end for the same requests face_worker.py serves over stdin, for
+# callers that should queue instead of spawning their own Python processes.
+# Listens on a Unix socket (FACE_SERVICE_SOCKET) or on FACE_SERVICE_HOST:PORT.
+#
+#   POST /match | /register | /identify   JSON body as in face_worker.py
+#        -> 200 {"exit_code": 0, "result": {...}}
+#        -> 503 + Retry-After when FACE_SERVICE_QUEUE_SIZE requests are already waiting
+#        -> 504 when the request is not done within FACE_SERVICE_TIMEOUT seconds
+#   GET  /health, /stats                  as the worker's ping / stats ops
+#   GET  /metrics                         Prometheus text
+#
+# Inference runs on a thread pool of FACE_SERVICE_THREADS (each thread with
+# its own pooled DB connection), where micro-batching merges concurrent
+# requests. The event loop itself only parses HTTP and queues work.
+#
+# Pre-fork pool (FACE_SERVICE_WORKERS=N): the parent imports DeepFace,
+# TensorFlow and the rest of the Python code, binds the socket and forks N
+# workers. They share those pages copy-on-write and accept connections from
+# the same socket, so the kernel spreads requests across them. The models
+# themselves are built in each worker after the fork: building a Keras model
+# or an ONNX Runtime session starts thread pools, and neither runtime
+# supports use from a child forked after that. FACE_SERVICE_PIN_CPUS=1 pins each
+# worker to its own share of the cores. A worker that has served
+# FACE_SERVICE_MAX_REQUESTS requests or grown past FACE_SERVICE_MAX_RSS_MB stops
+# accepting, drains its queue and exits; the parent forks a fresh one.
+# Workers flush their pending template writes (face_writeback.py) on the way
+# out, on SIGTERM as well.
+# benchmark_worker_pool.py measures the pool's memory against N separate workers.
+from dotenv import load_dotenv
+import os
+import sys
+import json
+import math
+import time
+import signal
+import socket
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from face_common import log_with_time, current_rss_mb
+from face_db import use_connection_pool
+from face_memory import configure_low_memory, request_threads, MEMORY_BUDGET_MB
+from face_metrics import render_prometheus
+from face_worker import (FaceWorker, configure_inference_threads, preload_models, warm_up, run_request,
+                         WORKER_THREADS, CPU_CORES, TF_INTER_OP_THREADS)
+from face_pipeline import start_micro_batching
+from face_writeback import start_write_behind, stop_write_behind
+
+SERVICE_SOCKET = os.getenv("FACE_SERVICE_SOCKET", "")
+SERVICE_HOST = os.getenv("FACE_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("FACE_SERVICE_PORT", 8765))
+SERVICE_THREADS = int(os.getenv("FACE_SERVICE_THREADS", WORKER_THREADS))
+QUEUE_SIZE = int(os.getenv("FACE_SERVICE_QUEUE_SIZE", 64))  # requests waiting for a thread
+REQUEST_TIMEOUT = float(os.getenv("FACE_SERVICE_TIMEOUT", 30))  # seconds, queueing included
+MAX_BODY_BYTES = int(os.getenv("FACE_SERVICE_MAX_BODY_BYTES", 20 * 1024 * 1024))
+SOCKET_BACKLOG = 128
+# Pre-fork pool: 0 serves from this process
+POOL_WORKERS = int(os.getenv("FACE_SERVICE_WORKERS", 0))
+POOL_PIN_CPUS = os.getenv("FACE_SERVICE_PIN_CPUS", "0") == "1"
+POOL_MAX_REQUESTS = int(os.getenv("FACE_SERVICE_MAX_REQUESTS", 0))  # recycle a worker after this many requests
+POOL_MAX_RSS_MB = float(os.getenv("FACE_SERVICE_MAX_RSS_MB", MEMORY_BUDGET_MB))  # ... or once its RSS grows past this
+
+POST_OPS = {"/match": "match", "/register": "register", "/identify": "identify"}
+GET_OPS = {"/health": "ping", "/stats": "stats"}
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class FaceService:
+    """Bounded queue in front of a thread pool running FaceWorker.handle"""
+
+    def __init__(self, threads=SERVICE_THREADS, queue_size=QUEUE_SIZE, timeout=REQUEST_TIMEOUT,
+                 max_requests=0, max_rss_mb=0):
+        self.worker = FaceWorker()
+        self.threads = threads = request_threads(threads, "FACE_SERVICE_THREADS")
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="face-service")
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.average_seconds = 1.0  # moving average of request run time, for Retry-After
+        self.consumers = []
+        self.next_id = 1
+        # Recycling limits of a pool worker (0 = none) and the event set when one is hit
+        self.max_requests = max_requests
+        self.max_rss_mb = max_rss_mb
+        self.served = 0
+        self.retiring = asyncio.Event()
+
+    def start(self):
+        self.consumers = [asyncio.ensure_future(self.consume()) for _ in range(self.threads)]
+
+    async def consume(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            request, future = await self.queue.get()
+            try:
+                if future.done():
+                    # Caller already timed out while this was queued
+                    continue
+                started = time.perf_counter()
+                try:
+                    result = await loop.run_in_executor(self.executor, run_request, self.worker, request)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                self.average_seconds = 0.9 * self.average_seconds + 0.1 * (time.perf_counter() - started)
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.queue.task_done()
+                self.served += 1
+                self.check_limits()
+
+    def check_limits(self):
+        if self.retiring.is_set():
+            return
+        if self.max_requests and self.served >= self.max_requests:
+            log_with_time(f"Worker {os.getpid()} served {self.served} requests; recycling")
+            self.retiring.set()
+        elif self.max_rss_mb and current_rss_mb() > self.max_rss_mb:
+            log_with_time(f"Worker {os.getpid()} RSS {current_rss_mb():.0f} MB over {self.max_rss_mb} MB; recycling")
+            self.retiring.set()
+
+    def retry_after(self):
+        """Seconds until the current backlog has likely drained"""
+        return max(1, math.ceil(self.queue.qsize() * self.average_seconds / self.threads))
+
+    async def submit(self, request):
+        """(result, exit_code), or HttpError 503 / 504"""
+        request.setdefault("id", str(self.next_id))
+        self.next_id += 1
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self.queue.put_nowait((request, future))
+        except asyncio.QueueFull:
+            raise HttpError(503, "Face service is busy")
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            # A request already running finishes in its thread; its result is dropped
+            log_with_time(f"{request.get('op')} request {request['id']} timed out after {self.timeout}s")
+            raise HttpError(504, f"Face request timed out after {self.timeout}s")
+
+    async def route(self, method, path, body):
+        """(status, payload) for one HTTP request"""
+        if path == "/metrics":
+            return 200, render_prometheus()
+        if path in GET_OPS:
+            result, exit_code = self.worker.handle({"op": GET_OPS[path]})
+            return 200, {"exit_code": exit_code, "result": result}
+        if path not in POST_OPS:
+            raise HttpError(404, f"Unknown path: {path}")
+        if method != "POST":
+            raise HttpError(405, f"{path} only accepts POST")
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(400, "Request body must be JSON")
+        if not isinstance(request, dict):
+            raise HttpError(400, "Request body must be a JSON object")
+        request["op"] = POST_OPS[path]
+        result, exit_code = await self.submit(request)
+        return 200, {"exit_code": exit_code, "result": result}
+
+    async def handle_connection(self, reader, writer):
+        headers = {}
+        try:
+            method, path, body = await read_request(reader)
+            status, payload = await self.route(method, path, body)
+        except HttpError as e:
+            status, payload = e.status, {"success": False, "error": str(e)}
+            if e.status == 503:
+                headers["Retry-After"] = str(self.retry_after())
+                payload["retry_after"] = int(headers["Retry-After"])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        try:
+            writer.write(encode_response(status, payload, headers))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def read_request(reader):
+    """(method, path, body) of one HTTP/1.1 request; connections are not kept alive"""
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    parts = request_line.split()
+    if len(parts) != 3:
+        raise HttpError(400, "Malformed request line")
+    method, path = parts[0].upper(), parts[1].split("?", 1)[0]
+
+    length = 0
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-length":
+            try:
+                length = int(value.strip())
+            except ValueError:
+                raise HttpError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f"Request body exceeds {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, body
+
+def encode_response(status, payload, headers):
+    if isinstance(payload, str):
+        body, content_type = payload.encode(), "text/plain; version=0.0.4"
+    else:
+        body, content_type = json.dumps(payload).encode(), "application/json"
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+             f"Content-Type: {content_type}",
+             f"Content-Length: {len(body)}",
+             "Connection: close"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+def listen_socket():
+    """Bound, listening socket; created before forking so every pool worker accepts on it"""
+    if SERVICE_SOCKET:
+        if os.path.exists(SERVICE_SOCKET):
+            os.unlink(SERVICE_SOCKET)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(SERVICE_SOCKET)
+        log_with_time(f"Face service listening on {SERVICE_SOCKET}")
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((SERVICE_HOST, SERVICE_PORT))
+        log_with_time(f"Face service listening on {SERVICE_HOST}:{SERVICE_PORT}")
+    sock.listen(SOCKET_BACKLOG)
+    return sock
+
+async def serve(sock, max_requests=0, max_rss_mb=0):
+    """Serve on sock until a recycling limit is hit (never, when both are 0)"""
+    service = FaceService(max_requests=max_requests, max_rss_mb=max_rss_mb)
+    service.start()
+    if sock.family == getattr(socket, "AF_UNIX", None):
+        server = await asyncio.start_unix_server(service.handle_connection, sock=sock)
+    else:
+        server = await asyncio.start_server(service.handle_connection, sock=sock)
+    log_with_time(f"{service.threads} inference threads, queue of {service.queue.maxsize}, timeout {service.timeout}s")
+    try:
+        await service.retiring.wait()
+        # Stop accepting (the other pool workers pick up new connections), then drain
+        server.close()
+        await server.wait_closed()
+        await service.queue.join()
+    finally:
+        service.executor.shutdown(wait=True)
+        stop_write_behind()
+        service.worker.close_all()
+
+def cpu_slice(slot, workers):
+    """Cores pool worker slot is pinned to: an equal, disjoint share where possible"""
+    cores = sorted(os.sched_getaffinity(0))
+    per_worker = max(1, len(cores) // workers)
+    start = (slot * per_worker) % len(cores)
+    return set(cores[start:start + per_worker])
+
+def run_worker(sock, slot, workers):
+    """Body of one forked pool worker; never returns"""
+    code = 0
+    try:
+        if POOL_PIN_CPUS:
+            cores = cpu_slice(slot, workers)
+            os.sched_setaffinity(0, cores)
+            log_with_time(f"Worker {os.getpid()} (slot {slot}) pinned to cores {sorted(cores)}")
+        # Threads don't survive fork: models (and with them the TF / ONNX Runtime
+        # thread pools), the batchers and the write-behind queue all start here.
+        # Each worker sizes its TF pools for its share of the cores.
+        configure_low_memory()
+        configure_inference_threads(
+            int(os.getenv("FACE_TF_INTRA_OP_THREADS", max(1, CPU_CORES // workers))),
+            TF_INTER_OP_THREADS
+        )
+        preload_models()
+        warm_up()
+        start_micro_batching()
+        start_write_behind()
+        asyncio.run(serve(sock, POOL_MAX_REQUESTS, POOL_MAX_RSS_MB))
+    except KeyboardInterrupt:
+        pass
+    except BaseException as e:
+        log_with_time(f"Worker {os.getpid()} failed: {str(e)}")
+        code = 1
+    finally:
+        stop_write_behind()
+        sys.stderr.flush()
+        os._exit(code)
+
+def run_pool(sock, workers):
+    """Fork workers that share the parent's imported code copy-on-write; replace any that exit"""
+    children = {}  # pid -> slot
+    stopping = False
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            # SIGTERM unwinds like Ctrl-C so pending template writes get flushed
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            run_worker(sock, slot, workers)
+        children[pid] = slot
+        log_with_time(f"Started worker {pid} in slot {slot}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(workers):
+        spawn(slot)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        slot = children.pop(pid, None)
+        if slot is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status >> 8
+        log_with_time(f"Worker {pid} in slot {slot} exited with code {code}; replacing it")
+        if code != 0:
+            # Don't fork in a tight loop if workers crash on start-up
+            time.sleep(1)
+        spawn(slot)
+
+if __name__ == "__main__":
+    log_with_time("Face service started")
+    load_dotenv()
+
+    # Libraries print progress to stdout; keep the logs together on stderr
+    sys.stdout = sys.stderr
+
+    # The pool is created on the first connection, so each forked worker opens its own
+    use_connection_pool()
+    if POOL_WORKERS > 0:
+        # Nothing touches TensorFlow, CUDA or ONNX Runtime before the fork; each
+        # worker configures and loads its own models (run_worker)
+        sock = listen_socket()
+        log_with_time(f"Forking {POOL_WORKERS} workers")
+        run_pool(sock, POOL_WORKERS)
+    else:
+        configure_low_memory()
+        configure_inference_threads()
+        preload_models()
+        warm_up()
+        start_micro_batching()
+        start_write_behind()
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            asyncio.run(serve(listen_socket()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop_write_behind()
+    log_with_time("Face service stopped")
@@ -0,0 +1,163 @@
+# PER-EMPLOYEE TEMPLATE MANAGEMENT
+# Instead of inserting one face_data row per punch forever, each employee keeps
+# at most MAX_TEMPLATES_PER_EMPLOYEE diverse exemplars plus a running centroid
+# (face_centroid). Near-duplicates of an existing template are not stored, and
+# templates pushed out of the set are moved to face_data_archive in bulk.
+#
+# add_template stores one sample as the request runs; add_templates writes a
+# whole batch from the face worker's write-behind queue (face_writeback.py).
+import os
+import numpy as np
+from face_common import log_with_time, EMBEDDING_DIMENSION
+from face_db import fetch_centroid, upsert_centroid, fetch_recent_encodings, statement_sql
+from face_encoding import encode_face_encoding, decode_face_encoding
+from face_gallery import FaceGallery
+
+MAX_TEMPLATES_PER_EMPLOYEE = int(os.getenv("FACE_MAX_TEMPLATES", 10))
+DUPLICATE_DISTANCE = float(os.getenv("FACE_DUPLICATE_DISTANCE", 0.05))
+
+def select_diverse_templates(matrix, max_templates, pinned=()):
+    """Greedy farthest-point selection over normalized rows.
+
+    Starts from the pinned rows (enrollment anchor, newest sample) and keeps
+    adding the row farthest from everything already kept. Returns sorted row indices.
+    """
+    count = len(matrix)
+    if count <= max_templates:
+        return list(range(count))
+
+    selected = list(dict.fromkeys(pinned))[:max_templates] or [0]
+    # Cosine distance of every row to its nearest selected row
+    nearest = np.min(1.0 - matrix @ matrix[selected].T, axis=1)
+    nearest[selected] = -np.inf
+    while len(selected) < max_templates:
+        row = int(np.argmax(nearest))
+        selected.append(row)
+        nearest = np.minimum(nearest, 1.0 - matrix @ matrix[row])
+        nearest[selected] = -np.inf
+    return sorted(selected)
+
+def archive_face_rows(row_ids, cursor, archive=True):
+    """Move rows to face_data_archive (or just delete them) in two set-based statements"""
+    if not row_ids:
+        return 0
+    placeholders = ", ".join(["%s"] * len(row_ids))
+    if archive:
+        cursor.execute(f"""
+                       INSERT INTO face_data_archive (id, employeeID, face_encoding, createdAt, archivedAt)
+                       SELECT id, employeeID, face_encoding, createdAt, NOW()
+                       FROM face_data
+                       WHERE id IN ({placeholders})
+                       """, tuple(row_ids))
+    cursor.execute(f"DELETE FROM face_data WHERE id IN ({placeholders})", tuple(row_ids))
+    return len(row_ids)
+
+def get_centroid(employee_id, conn):
+    """Returns (centroid, sample_count) or (None, 0)"""
+    row = fetch_centroid(conn, employee_id)
+    if not row:
+        return None, 0
+    return decode_face_encoding(bytes(row[0])), row[1]
+
+def save_centroid(employee_id, centroid, sample_count, conn):
+    upsert_centroid(conn, employee_id, encode_face_encoding(centroid), sample_count)
+
+def fold_into_centroid(employee_id, embeddings, conn):
+    """(centroid, sample_count) after folding matched samples into the stored mean embedding"""
+    centroid, sample_count = get_centroid(employee_id, conn)
+    if centroid is None or centroid.shape != (EMBEDDING_DIMENSION,):
+        centroid, sample_count = np.zeros(EMBEDDING_DIMENSION, dtype=np.float32), 0
+    for embedding in embeddings:
+        sample_count += 1
+        centroid = centroid + (embedding - centroid) / sample_count
+    return centroid, sample_count
+
+def update_running_centroid(employee_id, embedding, conn):
+    """Fold one more matched sample into the employee's mean embedding"""
+    centroid, sample_count = fold_into_centroid(employee_id, [embedding], conn)
+    save_centroid(employee_id, centroid, sample_count, conn)
+
+def is_near_duplicate(gallery, embedding):
+    return bool(len(gallery)) and np.min(gallery.distances(embedding)) < DUPLICATE_DISTANCE
+
+def prune_gallery(gallery):
+    """(gallery capped at MAX_TEMPLATES_PER_EMPLOYEE, row ids pushed out).
+
+    gallery is newest first: the newest sample and the enrollment anchor (oldest
+    row) always stay, then the most diverse of the rest.
+    """
+    keep = select_diverse_templates(gallery.matrix, MAX_TEMPLATES_PER_EMPLOYEE, pinned=(0, len(gallery) - 1))
+    kept = set(keep)
+    return gallery.subset(keep), [gallery.row_ids[i] for i in range(len(gallery)) if i not in kept]
+
+def add_template(employee_id, embedding, created_at, gallery, conn, insert_row):
+    """Add a matched sample to the employee's templates (caller commits).
+
+    gallery is the employee's current, non-empty template set, newest first;
+    insert_row stores the embedding and returns the new face_data id. Returns
+    (gallery after the update, {"action": "added" | "duplicate", "pruned": n}).
+    """
+    update_running_centroid(employee_id, embedding, conn)
+
+    if is_near_duplicate(gallery, embedding):
+        log_with_time("Near-duplicate of a stored template - not storing")
+        return gallery, {"action": "duplicate", "pruned": 0}
+
+    row_id = insert_row()
+    # Reuse the DB-typed employee id already in the gallery
+    gallery = gallery.with_new_row(row_id, gallery.employee_ids[0], embedding, created_at, len(gallery) + 1)
+
+    gallery, pruned = prune_gallery(gallery)
+    if pruned:
+        cursor = conn.cursor()
+        try:
+            archive_face_rows(pruned, cursor)
+        finally:
+            cursor.close()
+        log_with_time(f"Archived {len(pruned)} redundant templates")
+    return gallery, {"action": "added", "pruned": len(pruned)}
+
+def add_templates(samples, conn, gallery_limit):
+    """Store a batch of matched samples with set-based statements (caller commits).
+
+    samples are (employee_id, embedding, store) in arrival order;
+    every sample is folded into its employee's centroid, the ones with store
+    set also get a face_data row. Returns ({employee_id: gallery after the
+    update} for employees that got rows, number of rows archived).
+    """
+    by_employee = {}
+    for employee_id, embedding, store in samples:
+        by_employee.setdefault(employee_id, []).append((embedding, store))
+
+    centroid_rows = []
+    face_rows = []
+    for employee_id, items in by_employee.items():
+        centroid, sample_count = fold_into_centroid(employee_id, [embedding for embedding, _ in items], conn)
+        centroid_rows.append((employee_id, encode_face_encoding(centroid), sample_count))
+        # Each request only checked against the stored templates, not the rest of this batch
+        stored = []
+        for embedding, store in items:
+            if store and all(1.0 - float(embedding @ other) >= DUPLICATE_DISTANCE for other in stored):
+                stored.append(embedding)
+                face_rows.append((employee_id, encode_face_encoding(embedding, normalized=True)))
+
+    galleries = {}
+    pruned = []
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(statement_sql("upsert_centroid"), centroid_rows)
+        if face_rows:
+            cursor.executemany(statement_sql("insert_encoding"), face_rows)
+        # Re-read for the new row ids, then prune each set as add_template would
+        for employee_id in dict.fromkeys(row[0] for row in face_rows):
+            gallery = FaceGallery.from_records(fetch_recent_encodings(conn, employee_id, gallery_limit))
+            if not len(gallery):
+                continue
+            galleries[employee_id], stale = prune_gallery(gallery)
+            pruned.extend(stale)
+        archive_face_rows(pruned, cursor)
+    finally:
+        cursor.close()
+    if pruned:
+        log_with_time(f"Archived {len(pruned)} redundant templates")
+    return galleries, len(pruned)
@@ -0,0 +1,231 @@
+# LONG-LIVED FACE WORKER
+# Loads DeepFace models once and serves match/register requests as JSON lines.
+#
+# Protocol (one JSON object per line):
+#   stdin:  {"id": "1", "op": "match", "image_path": "...", "employee_id": "7"}
+#           {"id": "2", "op": "register", "image_b64": "<base64 jpeg>", "employee_id": "7"}
+#           {"id": "3", "op": "identify", "image_path": "..."}
+#           {"id": "7", "op": "match", "image_paths": ["f1.jpg", "f2.jpg"], "employee_id": "7"}
+#           {"id": "4", "op": "ping"} / {"id": "5", "op": "stats"} / {"id": "6", "op": "metrics"}
+#   stdout: {"event": "ready"} once models are loaded and warmed up, then
+#           {"id": "1", "exit_code": 0, "result": {...}} per request
+#
+# exit_code/result are what match_face.py / register_face.py would have
+# exited with and printed for the same arguments.
+#
+# Requests run concurrently on FACE_WORKER_THREADS threads, each with its own
+# pooled DB connection, so responses can come back out of order (match them
+# by id). Their liveness and embedding passes are micro-batched together
+# (face_batching.py), and templates from successful matches are stored by a
+# write-behind queue (face_writeback.py) that is flushed when stdin closes.
+from dotenv import load_dotenv
+import os
+import sys
+import json
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from deepface import DeepFace
+from face_common import log_with_time, DETECTOR_BACKEND, MODEL_NAME
+from face_cache import gallery_cache, result_cache
+from face_db import get_db_connection, health_check, use_connection_pool, POOL_SIZE
+from face_index import loaded_face_index
+from face_memory import configure_low_memory, enforce_budget, request_threads, LOW_MEMORY, MEMORY_BUDGET_MB
+from face_metrics import render_prometheus, CASCADE_EVENTS
+from face_pipeline import check_liveness, embed_faces, start_micro_batching, CASCADE_DETECTOR, INFERENCE_BACKEND
+from face_quality import stats as quality_stats
+from face_writeback import start_write_behind, stop_write_behind, write_behind_queue, WRITE_BEHIND
+from match_face import run_match
+from register_face import run_register
+
+# One pooled DB connection per thread, so don't exceed FACE_DB_POOL_SIZE
+# (less the write-behind queue's connection)
+WORKER_THREADS = int(os.getenv("FACE_WORKER_THREADS", max(1, POOL_SIZE - (1 if WRITE_BEHIND else 0))))
+# One intra-op thread per core available to this process; a batched forward
+# pass already keeps them busy, so inter-op parallelism stays small
+CPU_CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+TF_INTRA_OP_THREADS = int(os.getenv("FACE_TF_INTRA_OP_THREADS", CPU_CORES))
+TF_INTER_OP_THREADS = int(os.getenv("FACE_TF_INTER_OP_THREADS", 1 if LOW_MEMORY else 2))
+
+def configure_inference_threads(intra_op=TF_INTRA_OP_THREADS, inter_op=TF_INTER_OP_THREADS):
+    """Size TensorFlow's thread pools; only effective before the first TF op runs"""
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    log_with_time(f"TensorFlow threads: intra-op {intra_op}, inter-op {inter_op}")
+
+def preload_models():
+    # In low-memory mode Fasnet waits for the first face that reaches liveness
+    preload_fasnet = not LOW_MEMORY
+    log_with_time(f"start preloading {MODEL_NAME}, {DETECTOR_BACKEND}{' and Fasnet' if preload_fasnet else ''} ({INFERENCE_BACKEND} backend)")
+    if INFERENCE_BACKEND == "onnx":
+        from face_onnx import get_onnx_model
+        get_onnx_model(MODEL_NAME)
+        if preload_fasnet:
+            get_onnx_model("Fasnet")
+    else:
+        DeepFace.build_model(MODEL_NAME)
+        if preload_fasnet:
+            DeepFace.build_model("Fasnet", task="spoofing")
+    DeepFace.build_model(DETECTOR_BACKEND, task="face_detector")
+    if CASCADE_DETECTOR:
+        DeepFace.build_model(CASCADE_DETECTOR, task="face_detector")
+    log_with_time("end preloading models")
+
+def warm_up():
+    """Run one inference per model so the first real request doesn't pay for graph tracing"""
+    log_with_time("start warm-up inference")
+    blank = np.zeros((160, 160, 3), dtype=np.uint8)
+    DeepFace.extract_faces(
+        img_path=blank,
+        detector_backend=DETECTOR_BACKEND,
+        enforce_detection=False,
+        align=True,
+        anti_spoofing=False
+    )
+    if not LOW_MEMORY:
+        check_liveness(blank, {"x": 0, "y": 0, "w": 159, "h": 159})
+    embed_faces([np.zeros((160, 160, 3), dtype=np.float32)])
+    log_with_time("end warm-up inference")
+
+class FaceWorker:
+    def __init__(self):
+        # Each request thread keeps its own connection
+        self.local = threading.local()
+        self.connections = set()
+        self.lock = threading.Lock()
+
+    def connection(self):
+        # Reconnect transparently if MySQL dropped the idle connection
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = get_db_connection()
+            with self.lock:
+                self.connections.add(conn)
+        else:
+            health_check(conn)
+        return conn
+
+    def handle(self, request):
+        op = request.get("op")
+        if op == "ping":
+            return {"status": "ok", "pid": os.getpid()}, 0
+        if op == "metrics":
+            # Stage and request histograms in Prometheus text format
+            return {"prometheus": render_prometheus()}, 0
+        if op == "stats":
+            face_index = loaded_face_index()
+            write_behind = write_behind_queue()
+            return {
+                "gallery_cache": gallery_cache.stats(),
+                "result_cache": result_cache.stats(),
+                "cascade": {labels[0]: count for labels, count in CASCADE_EVENTS.snapshot().items()},
+                "quality": quality_stats(),
+                "face_index": {"rows": len(face_index), "nlist": face_index.nlist} if face_index is not None else None,
+                "write_behind": write_behind.stats() if write_behind is not None else None
+            }, 0
+
+        # Either a path on the shared disk or the encoded image inline
+        image = request.get("image_path")
+        if request.get("image_b64"):
+            image = base64.b64decode(request["image_b64"])
+        # A burst of stills for match: paths or base64, decoded lazily frame by frame
+        if request.get("image_paths"):
+            image = list(request["image_paths"])
+        if request.get("images_b64"):
+            image = [base64.b64decode(frame) for frame in request["images_b64"]]
+        employee_id = request.get("employee_id")
+        if image and op == "identify":
+            return run_match(image, None, self.connection())
+        if not image or employee_id is None:
+            return {"success": False, "error": "image_path or image_b64 and employee_id are required"}, 1
+
+        if op == "match":
+            return run_match(image, str(employee_id), self.connection())
+        if op == "register":
+            return run_register(image, employee_id, self.connection())
+        return {"success": False, "error": f"Unknown op: {op}"}, 1
+
+    def close(self):
+        """Return the calling thread's connection to the pool"""
+        conn = getattr(self.local, "conn", None)
+        if conn:
+            with self.lock:
+                self.connections.discard(conn)
+            conn.close()
+            self.local.conn = None
+
+    def close_all(self):
+        with self.lock:
+            connections, self.connections = self.connections, set()
+        for conn in connections:
+            conn.close()
+
+def run_request(worker, request):
+    """(result, exit_code) for one request; never raises"""
+    log_with_time(f"start {request.get('op')} request {request.get('id')}")
+    try:
+        result, exit_code = worker.handle(request)
+    except Exception as e:
+        # Keep serving; the DB connection is rebuilt on the next request
+        log_with_time(f"Request failed: {str(e)}")
+        worker.close()
+        result, exit_code = {"success": False, "error": str(e)}, 1
+    if LOW_MEMORY or MEMORY_BUDGET_MB:
+        enforce_budget(gallery_cache, result_cache)
+    log_with_time(f"end {request.get('op')} request {request.get('id')}")
+    return result, exit_code
+
+def handle_line(worker, request, respond):
+    result, exit_code = run_request(worker, request)
+    respond({"id": request.get("id"), "exit_code": exit_code, "result": result})
+
+def serve(protocol_out, threads=WORKER_THREADS):
+    worker = FaceWorker()
+    write_lock = threading.Lock()
+
+    def respond(message):
+        with write_lock:
+            protocol_out.write(json.dumps(message) + "\n")
+            protocol_out.flush()
+
+    executor = ThreadPoolExecutor(max_workers=request_threads(threads, "FACE_WORKER_THREADS"),
+                                  thread_name_prefix="face-request")
+    try:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                log_with_time(f"Ignoring malformed request: {str(e)}")
+                continue
+            executor.submit(handle_line, worker, request, respond)
+    finally:
+        executor.shutdown(wait=True)
+        stop_write_behind()
+        worker.close_all()
+
+if __name__ == "__main__":
+    log_with_time("Face worker started")
+    load_dotenv()
+
+    # Libraries print progress to stdout; keep stdout exclusively for the protocol
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    configure_low_memory()
+    use_connection_pool()
+    configure_inference_threads()
+    preload_models()
+    warm_up()
+    start_micro_batching()
+    start_write_behind()
+    protocol_out.write(json.dumps({"event": "ready"}) + "\n")
+    protocol_out.flush()
+    log_with_time("Face worker ready")
+
+    serve(protocol_out)
+    log_with_time("Face worker stopped")
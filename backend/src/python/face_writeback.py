@@ -0,0 +1,294 @@
+# WRITE-BEHIND QUEUE FOR POST-MATCH TEMPLATE INSERTS
+# In the face worker and face service a successful match no longer waits for
+# its template INSERT, centroid upsert, pruning and COMMIT. The request thread
+# only makes the near-duplicate decision against the gallery it already has,
+# hands the sample to this queue and answers with template action "queued".
+#
+# One writer thread with its own pooled connection flushes every
+# FACE_WRITEBACK_INTERVAL_MS, or as soon as FACE_WRITEBACK_BATCH samples are
+# waiting, in a single transaction (face_templates.add_templates: executemany
+# for the centroids and the rows, one archive for everything pruned). Then
+# it writes the new galleries through to the gallery cache and the index.
+#
+#   - transient errors (lock waits, deadlocks, dropped connections) are
+#     retried with backoff; a batch that still fails goes back to the front of
+#     the queue for the next flush
+#   - any other error is retried one employee at a time, so a bad row only
+#     costs that employee's samples
+#   - at most FACE_WRITEBACK_MAX_PENDING samples wait; past that the oldest
+#     are dropped (they are extra templates, the punch itself was answered)
+#   - close() flushes what is left; face_worker.py and face_service.py call it
+#     on shutdown
+#   - re-registration calls discard(): samples matched against the old face
+#     are dropped, and a batch already taken off the queue skips them and does
+#     not write its gallery through
+#
+# Lag (age of the oldest uncommitted sample) is in the worker's stats and in
+# the face_writeback_* Prometheus metrics. Until a flush commits, other
+# requests match against the templates as they were, which is at most one
+# sample per punch behind.
+import os
+import time
+import threading
+from collections import deque
+from face_common import log_with_time, MAX_FACE_RECORDS_PER_USER
+from face_cache import gallery_cache
+from face_db import get_db_connection, health_check, database_errors, is_transient_error, DB_ENGINE
+from face_index import loaded_face_index
+from face_metrics import BATCH_SIZE, WRITEBACK_PENDING, WRITEBACK_LAG, WRITEBACK_DELAY
+from face_templates import add_templates
+
+WRITE_BEHIND = os.getenv("FACE_WRITE_BEHIND", "1") == "1"  # long-lived processes only
+WRITEBACK_INTERVAL = float(os.getenv("FACE_WRITEBACK_INTERVAL_MS", 200)) / 1000
+WRITEBACK_BATCH = int(os.getenv("FACE_WRITEBACK_BATCH", 64))
+WRITEBACK_MAX_PENDING = int(os.getenv("FACE_WRITEBACK_MAX_PENDING", 10000))
+WRITEBACK_RETRIES = int(os.getenv("FACE_WRITEBACK_RETRIES", 5))
+WRITEBACK_RETRY_DELAY = float(os.getenv("FACE_WRITEBACK_RETRY_DELAY_MS", 100)) / 1000
+
+QUEUE_LABEL = "face_data"
+
+class WriteBehindQueue:
+    """Batches matched samples into periodic add_templates transactions on a writer thread"""
+
+    def __init__(self, interval=WRITEBACK_INTERVAL, batch_size=WRITEBACK_BATCH, max_pending=WRITEBACK_MAX_PENDING,
+                 retries=WRITEBACK_RETRIES, retry_delay=WRITEBACK_RETRY_DELAY):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.pending = deque()  # (employee_id, embedding, store, queued_at, generation)
+        self.generations = {}  # str(employee_id) -> registrations seen, bumped by discard()
+        self.condition = threading.Condition()
+        self.closing = False
+        self.conn = None
+        self.flushes = 0
+        self.written = 0
+        self.archived = 0
+        self.retried = 0
+        self.requeued = 0
+        self.failed = 0
+        self.dropped = 0
+        self.discarded = 0
+        self.last_delay = 0.0
+        self.thread = threading.Thread(target=self.loop, name="face-writeback", daemon=True)
+        self.thread.start()
+
+    def submit(self, employee_id, embedding, store):
+        """Queue one matched sample; store=False only updates the centroid (near-duplicate)"""
+        with self.condition:
+            if self.closing:
+                raise RuntimeError("Write-behind queue is closed")
+            if len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                self.dropped += 1
+                log_with_time(f"Write-behind queue full ({self.max_pending}); dropped the oldest sample")
+            generation = self.generations.get(str(employee_id), 0)
+            self.pending.append((employee_id, embedding, store, time.monotonic(), generation))
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+            self.report_lag()
+
+    def discard(self, employee_id):
+        """Drop the employee's samples after a re-registration; returns how many were pending"""
+        key = str(employee_id)
+        with self.condition:
+            self.generations[key] = self.generations.get(key, 0) + 1
+            kept = deque(item for item in self.pending if str(item[0]) != key)
+            discarded = len(self.pending) - len(kept)
+            self.pending = kept
+            self.discarded += discarded
+            self.report_lag()
+        if discarded:
+            log_with_time(f"Discarded {discarded} pending samples for re-registered employee {employee_id}")
+        return discarded
+
+    def is_current(self, item):
+        """False once the sample's employee has re-registered; caller holds the condition"""
+        return item[4] == self.generations.get(str(item[0]), 0)
+
+    def current(self, batch):
+        """The samples of batch that no re-registration has superseded"""
+        with self.condition:
+            fresh = [item for item in batch if self.is_current(item)]
+            self.discarded += len(batch) - len(fresh)
+        return fresh
+
+    def lag(self):
+        """Seconds the oldest pending sample has waited (0 when empty); caller holds the condition"""
+        return time.monotonic() - self.pending[0][3] if self.pending else 0.0
+
+    def report_lag(self):
+        WRITEBACK_PENDING.set(len(self.pending), QUEUE_LABEL)
+        WRITEBACK_LAG.set(round(self.lag(), 3), QUEUE_LABEL)
+
+    def loop(self):
+        while True:
+            with self.condition:
+                if not self.closing and len(self.pending) < self.batch_size:
+                    self.condition.wait(self.interval)
+                batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+                closing = self.closing
+                self.report_lag()
+            batch = self.current(batch)
+            if batch:
+                self.flush_batch(batch)
+            elif closing:
+                return
+
+    def connection(self):
+        if self.conn is None:
+            self.conn = get_db_connection()
+        else:
+            health_check(self.conn)
+        return self.conn
+
+    def reset_connection(self):
+        """Hand back a connection that failed; the next write checks out a fresh one"""
+        if self.conn is not None and DB_ENGINE != "sqlite":
+            try:
+                self.conn.close()
+            except database_errors():
+                pass
+        self.conn = None
+
+    def write(self, batch):
+        """One transaction for the batch; returns the galleries written"""
+        conn = self.connection()
+        try:
+            galleries, archived = add_templates(
+                [item[:3] for item in batch], conn, MAX_FACE_RECORDS_PER_USER
+            )
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except database_errors():
+                pass  # connection already gone; reset_connection replaces it
+            raise
+        self.archived += archived
+        return galleries
+
+    def flush_batch(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                galleries = self.write(batch)
+                break
+            except database_errors() as db_error:
+                if not is_transient_error(db_error):
+                    log_with_time(f"Write-behind batch of {len(batch)} failed: {str(db_error)}")
+                    self.flush_per_employee(batch)
+                    return
+                log_with_time(f"Write-behind batch of {len(batch)} hit a transient error (attempt {attempt + 1}): {str(db_error)}")
+                self.reset_connection()
+                if attempt < self.retries:
+                    self.retried += 1
+                    time.sleep(self.retry_delay * 2 ** attempt)
+            except Exception as e:
+                log_with_time(f"Write-behind batch of {len(batch)} failed: {str(e)}")
+                self.flush_per_employee(batch)
+                return
+        else:
+            self.requeue(batch)
+            return
+        self.committed(batch, galleries)
+
+    def flush_per_employee(self, batch):
+        """After a non-transient error: one transaction per employee, dropping only the ones that fail"""
+        by_employee = {}
+        for item in batch:
+            by_employee.setdefault(item[0], []).append(item)
+        if len(by_employee) == 1:
+            log_with_time(f"Dropping {len(batch)} samples for employee {batch[0][0]}")
+            self.failed += len(batch)
+            return
+        for items in by_employee.values():
+            try:
+                self.committed(items, self.write(items))
+            except Exception as e:
+                log_with_time(f"Dropping {len(items)} samples for employee {items[0][0]}: {str(e)}")
+                self.failed += len(items)
+                if isinstance(e, database_errors()) and is_transient_error(e):
+                    self.reset_connection()
+
+    def requeue(self, batch):
+        """Retries exhausted: back to the front of the queue, unless shutting down"""
+        with self.condition:
+            if self.closing:
+                self.failed += len(batch)
+                log_with_time(f"Dropping {len(batch)} samples: database unavailable at shutdown")
+                return
+            self.pending.extendleft(reversed(batch))
+            self.requeued += len(batch)
+            self.report_lag()
+
+    def committed(self, batch, galleries):
+        now = time.monotonic()
+        self.flushes += 1
+        self.written += len(batch)
+        BATCH_SIZE.observe(len(batch), "writeback")
+        for item in batch:
+            WRITEBACK_DELAY.observe(now - item[3], QUEUE_LABEL)
+        self.last_delay = now - batch[0][3]
+        # Write-through so the next punch sees the stored templates without a fetch,
+        # unless the employee re-registered while this batch was being written
+        with self.condition:
+            superseded = {str(item[0]) for item in batch if not self.is_current(item)}
+        face_index = loaded_face_index()
+        for employee_id, gallery in galleries.items():
+            if str(employee_id) in superseded:
+                gallery_cache.invalidate(employee_id)
+                continue
+            gallery_cache.put(employee_id, gallery)
+            if face_index is not None:
+                face_index.replace_employee(gallery.employee_ids[0], gallery)
+
+    def close(self, timeout=None):
+        """Flush everything still pending and stop the writer thread"""
+        with self.condition:
+            self.closing = True
+            pending = len(self.pending)
+            self.condition.notify()
+        if pending:
+            log_with_time(f"Flushing {pending} pending template writes")
+        self.thread.join(timeout)
+        self.reset_connection()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "pending": len(self.pending),
+                "lag_seconds": self.lag(),
+                "last_commit_delay_seconds": self.last_delay,
+                "flushes": self.flushes,
+                "written": self.written,
+                "archived": self.archived,
+                "retried": self.retried,
+                "requeued": self.requeued,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "discarded": self.discarded,
+                "interval_seconds": self.interval,
+                "batch_size": self.batch_size
+            }
+
+_write_behind = None
+
+def start_write_behind():
+    """Start the process's write-behind queue (if enabled); later calls are no-ops"""
+    global _write_behind
+    if _write_behind is None and WRITE_BEHIND:
+        log_with_time(f"Write-behind template inserts every {WRITEBACK_INTERVAL * 1000:.0f} ms or {WRITEBACK_BATCH} samples")
+        _write_behind = WriteBehindQueue()
+    return _write_behind
+
+def write_behind_queue():
+    """The running queue, or None when matches store their template synchronously"""
+    return _write_behind
+
+def stop_write_behind():
+    """Flush and stop the queue; matches after this store synchronously again"""
+    global _write_behind
+    queue, _write_behind = _write_behind, None
+    if queue is not None:
+        queue.close()
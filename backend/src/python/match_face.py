@@ -2,317 +2,392 @@
 from dotenv import load_dotenv
 import sys
 import json
-import mysql.connector
-import os
 import numpy as np
-from deepface import DeepFace
-import pickle
 from datetime import datetime
-import cv2
-import tempfile
-
-def log_with_time(message):
-    timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
-    print(f"[{timestamp}] {message}", file=sys.stderr, flush=True)
-
-# Load environment variables from .env
-log_with_time("Match face Script started")
-dotenv_loaded = load_dotenv()
-if not dotenv_loaded:
-    sys.exit(1)
-
-# Get command line arguments
-image_path = sys.argv[1]
-employee_id = sys.argv[2]
-
-# Configuration
-MATCH_THRESHOLD = 0.25
-MAX_FACE_RECORDS_PER_USER = 20  # Limit face records per user for performance
-
-# Optimization 1: Image preprocessing function
-def preprocess_image(image_path, target_size=(640, 640)):
-    """Resize image to reduce processing time while maintaining quality"""
-    try:
-        img = cv2.imread(image_path)
-        if img is None:
-            return image_path  # Return original if can't load
-
-        # Resize if image is too large
-        height, width = img.shape[:2]
-        if height > target_size[0] or width > target_size[1]:
-            log_with_time(f"Resizing image from {width}x{height} to optimize processing")
-            # Calculate scaling factor to maintain aspect ratio
-            scale = min(target_size[0]/height, target_size[1]/width)
-            new_width = int(width * scale)
-            new_height = int(height * scale)
-            img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
-
-            # Save resized image to temporary file
-            temp_fd, temp_path = tempfile.mkstemp(suffix='.jpg')
-            os.close(temp_fd)  # Close file descriptor
-            cv2.imwrite(temp_path, img)
-            log_with_time(f"Image resized and saved to temporary file")
-            return temp_path
-
-        return image_path
-    except Exception as e:
-        log_with_time(f"Error preprocessing image: {str(e)}")
-        return image_path
-
-# Optimization 2: Quick face detection check
-def quick_face_check(image_path):
-    """Quick face detection using opencv to pre-filter images"""
-    try:
-        faces = DeepFace.extract_faces(
-            img_path=image_path,
-            detector_backend='opencv',  # Fastest detector
-            enforce_detection=False,
-            align=False,
-            anti_spoofing=False
-        )
-        face_count = len(faces) if faces else 0
-        log_with_time(f"Quick face check detected {face_count} faces")
-        return face_count == 1  # Return True if exactly one face
-    except Exception as e:
-        log_with_time(f"Quick face check failed: {str(e)}")
-        return False  # Proceed with full processing if quick check fails
-
-def store_face_encoding_to_db(employee_id, face_encoding, cursor, conn):
+from face_common import (
+    log_with_time,
+    FaceProcessingError, MATCH_THRESHOLD, MAX_FACE_RECORDS_PER_USER, EMBEDDING_DIMENSION
+)
+from face_cache import gallery_cache, result_cache, content_key
+from face_db import get_db_connection, fetch_recent_encodings, insert_face_encoding, database_errors
+from face_encoding import encode_face_encoding
+from face_gallery import FaceGallery, normalize_embedding
+from face_image import read_image_source, is_burst_source, iter_frames
+from face_index import get_face_index, loaded_face_index, IDENTIFY_CANDIDATES
+from face_metrics import span, traced_request, record_outcome
+from face_templates import add_template, is_near_duplicate
+from face_writeback import write_behind_queue
+from face_pipeline import extract_face_embedding, precheck_image, FaceRejected
+
+def store_face_encoding_to_db(employee_id, face_encoding, conn):
+    """Insert one encoding row; returns the new face_data id (caller commits)"""
+    # Convert face encoding to the compact binary format for LONGBLOB storage,
+    # L2-normalized so readers can skip the norm
+    face_encoding_blob = encode_face_encoding(normalize_embedding(face_encoding), normalized=True)
+
+    return insert_face_encoding(conn, employee_id, face_encoding_blob)
+
+def queue_matched_template(queue, employee_id, face_encoding, gallery):
+    """Decide duplicate vs new now and leave the writes to the write-behind queue"""
+    with span("store"):
+        duplicate = is_near_duplicate(gallery, face_encoding)
+        queue.submit(employee_id, face_encoding, store=not duplicate)
+    if duplicate:
+        log_with_time("Near-duplicate of a stored template - not storing")
+        return {"action": "duplicate", "pruned": 0}
+    return {"action": "queued", "pruned": 0}
+
+def store_matched_template(employee_id, face_encoding, gallery, conn):
+    """Add a matched encoding to the employee's bounded template set.
+
+    In the face worker the write is queued (face_writeback.py) and this returns
+    right away. Returns the template update ({"action", "pruned"}) or None if
+    storage failed.
+    """
+    queue = write_behind_queue()
+    if queue is not None:
+        try:
+            return queue_matched_template(queue, employee_id, face_encoding, gallery)
+        except RuntimeError as e:
+            # Shutting down: fall back to storing in this request
+            log_with_time(f"Write-behind unavailable: {str(e)}")
     try:
-        # Convert face encoding to binary format for LONGBLOB storage
-        face_encoding_blob = pickle.dumps(face_encoding)
-
-        # Insert new row with face encoding (keep all data, don't delete)
-        cursor.execute("""
-                       INSERT INTO face_data (employeeID, face_encoding, createdAt)
-                       VALUES (%s, %s, NOW())
-                       """, (employee_id, face_encoding_blob))
-
-        conn.commit()
-        return True
-    except mysql.connector.Error as db_error:
+        created_at = datetime.now().replace(microsecond=0)
+        with span("store"):
+            updated_gallery, template = add_template(
+                employee_id, face_encoding, created_at, gallery, conn,
+                lambda: store_face_encoding_to_db(employee_id, face_encoding, conn)
+            )
+            conn.commit()
+        # Write-through so the next punch sees the current templates without a fetch
+        gallery_cache.put(employee_id, updated_gallery)
+        face_index = loaded_face_index()
+        if face_index is not None and template["action"] == "added":
+            face_index.replace_employee(updated_gallery.employee_ids[0], updated_gallery)
+        return template
+    except database_errors() as db_error:
         conn.rollback()
-        print(json.dumps({"matched": False, "error": f"Database storage error: {str(db_error)}"}))
-        return False
+        log_with_time(f"Database storage error: {str(db_error)}")
+        return None
     except Exception as e:
         conn.rollback()
-        print(json.dumps({"matched": False, "error": f"Storage error: {str(e)}"}))
-        return False
-
-def get_recent_face_encodings(employee_id, cursor, limit=MAX_FACE_RECORDS_PER_USER):
-    cursor.execute("""
-                   SELECT employeeID, face_encoding, createdAt
-                   FROM face_data
-                   WHERE employeeID = %s
-                   ORDER BY createdAt DESC
-                       LIMIT %s
-                   """, (employee_id, limit))
-    results = cursor.fetchall()
-    return results
-
-# Database connection
-log_with_time("start database connection")
-conn = mysql.connector.connect(
-    host=os.getenv("DB_HOST"),
-    user=os.getenv("DB_USER"),
-    password=os.getenv("DB_PASS"),
-    database=os.getenv("DB_DATABASE"),
-    autocommit=False
-)
-cursor = conn.cursor()
-log_with_time("end database connection")
-
-# Track temporary file for cleanup
-temp_image_path = None
-
-try:
-    # Optimization 3: Preprocess image first
-    log_with_time("start image preprocessing")
-    processed_image_path = preprocess_image(image_path)
-    if processed_image_path != image_path:
-        temp_image_path = processed_image_path  # Track for cleanup
-    log_with_time("end image preprocessing")
-
-    # Optimization 4: Quick face detection check
-    log_with_time("start quick face detection check")
-    if not quick_face_check(processed_image_path):
-        log_with_time("Quick face check failed - proceeding with full processing")
-        # Don't exit here, let the full processing handle the error properly
-    else:
-        log_with_time("Quick face check passed - single face detected")
-    log_with_time("end quick face detection check")
-
-    # Optimization 5: Use MTCNN for better speed/accuracy balance
-    detector_backend = 'mtcnn'  # Change from 'retinaface' to 'mtcnn' for better performance
+        log_with_time(f"Storage error: {str(e)}")
+        return None
 
-    try:
-        log_with_time(f"start deepface.extract_faces({detector_backend}, antispoofing=true)")
-        faces = DeepFace.extract_faces(
-            img_path=processed_image_path,
-            detector_backend=detector_backend,
-            enforce_detection=True,
-            align=True,
-            anti_spoofing=True
-        )
-        log_with_time(f"end deepface.extract_faces({detector_backend}, antispoofing=true)")
-
-        # Check if faces were detected
-        if not faces or len(faces) == 0:
-            print(json.dumps({"matched": False, "error": "No face detected in the image"}))
-            sys.exit(1)
-
-        # Reject image if more than one face is detected
-        if len(faces) > 1:
-            print(json.dumps({
-                "matched": False,
-                "stored": False,
-                "error": f"Multiple faces detected. Please ensure only one face is visible."
-            }))
-            sys.exit(1)
-
-        # Check if the face is real (not spoofed)
-        if not faces[0].get("is_real", False):
-            print(json.dumps({
-                "matched": False,
-                "stored": False,
-                "error": "Please use a real face, not a photo or video"
-            }))
-            sys.exit(1)
-
-    except Exception as spoof_error:
-        print(json.dumps({
-            "matched": False,
-            "stored": False,
-            "error": f"Poor image quality or no face detected. Please try again."
-        }))
-        sys.exit(1)
+def get_recent_face_encodings(employee_id, conn, limit=MAX_FACE_RECORDS_PER_USER):
+    # Prepared once per pooled connection
+    return fetch_recent_encodings(conn, employee_id, limit)
 
-    # Optimization 6: Use same detector backend for consistency and speed
-    log_with_time(f"Start face encoding generation using Facenet, {detector_backend}")
-    face_encodings = DeepFace.represent(
-        img_path=processed_image_path,
-        model_name='Facenet',  # Changed to Facenet (128D) for consistency
-        detector_backend=detector_backend,  # Use same detector as above
-        enforce_detection=True
-    )
-    log_with_time(f"end face encoding generation using Facenet, {detector_backend}")
-
-    if not face_encodings or len(face_encodings) == 0:
-        print(json.dumps({"matched": False, "error": "No face detected in the image"}))
-        sys.exit(1)
+def precheck_capture(image, error_payload):
+    """Cheap image checks that run before any DB lookup or model load"""
+    try:
+        precheck_image(image)
+    except FaceRejected as rejected:
+        record_outcome(rejected.reason)
+        raise FaceProcessingError({**error_payload, "stored": False, "error": str(rejected)}, rejected.reason)
+
+def capture_normalized_encoding(image, error_payload, capture=None):
+    """Detect, check liveness and embed; returns the L2-normalized float32 encoding.
+
+    capture, when given, receives the embedding and liveness verdict for the result cache.
+    """
+    # Optimization 3: Decode and resize once in memory, then detect and align once
+    # and reuse the crop for liveness and Facenet
+    try:
+        face = extract_face_embedding(image)
+    except FaceRejected as rejected:
+        record_outcome(rejected.reason)
+        if capture is not None:
+            capture["liveness"] = rejected.reason
+        raise FaceProcessingError({**error_payload, "stored": False, "error": str(rejected), **rejected.details},
+                                  rejected.reason)
 
-    captured_encoding = np.array(face_encodings[0]["embedding"])
+    captured_encoding = np.asarray(face["embedding"], dtype=np.float32)
 
     # Validate encoding dimension
-    if len(captured_encoding) != 128:
-        print(json.dumps({"matched": False, "error": f"Unexpected encoding dimension: {len(captured_encoding)}. Expected 128"}))
-        sys.exit(1)
-
-    # FIRST MATCH WITH THE DATABASE - Get most recent 20 face encodings for this employee
-    face_records = get_recent_face_encodings(employee_id, cursor)
+    if len(captured_encoding) != EMBEDDING_DIMENSION:
+        raise FaceProcessingError({**error_payload, "error": f"Unexpected encoding dimension: {len(captured_encoding)}. Expected {EMBEDDING_DIMENSION}"})
 
-    if not face_records:
-        print(json.dumps({
+    # Pre-normalize captured encoding for efficiency
+    try:
+        normalized = normalize_embedding(captured_encoding)
+    except ValueError as e:
+        raise FaceProcessingError({**error_payload, "error": str(e)})
+    if capture is not None:
+        capture.update(liveness="real", antispoof_score=face["antispoof_score"], embedding=normalized)
+    return normalized
+
+def load_employee_gallery(employee_id, conn):
+    """Most recent encodings for this employee, from the gallery cache or the DB (None if none)"""
+    gallery = gallery_cache.get(employee_id)
+    if gallery is not None:
+        log_with_time(f"Gallery cache hit for employee {employee_id}")
+        return gallery
+
+    with span("db_fetch"):
+        face_records = get_recent_face_encodings(employee_id, conn)
+        if not face_records:
+            return None
+        gallery = FaceGallery.from_records(face_records)
+    gallery_cache.put(employee_id, gallery)
+    return gallery
+
+def template_stored(template):
+    return template is not None and template["action"] in ("added", "queued")
+
+def template_message(template):
+    if template is None:
+        return "Face matched but storage failed"
+    if template["action"] == "duplicate":
+        return "Face matched; encoding is a near-duplicate of a stored template and was not stored"
+    if template["action"] == "queued":
+        return "Face matched; encoding queued for storage"
+    return "Face matched and encoding stored successfully"
+
+def match_face(image, employee_id, conn, capture=None):
+    """Match the captured face against the employee's stored encodings.
+
+    image may be a path, encoded bytes or a decoded BGR array.
+    Returns the response dict; rejected images raise FaceProcessingError.
+    """
+    precheck_capture(image, {"matched": False})
+
+    # FIRST MATCH WITH THE DATABASE - Get most recent 20 face encodings for this employee,
+    # unless the decoded gallery is still cached from an earlier punch. Done before
+    # inference so an unregistered employee is rejected without loading any model.
+    gallery = load_employee_gallery(employee_id, conn)
+    if gallery is None:
+        record_outcome("no_gallery")
+        raise FaceProcessingError({
             "matched": False,
             "stored": False,
             "error": "No face data found for this employee. Please register first."
-        }))
-        sys.exit(1)
+        })
 
-    # Optimization 7: Vectorized distance calculation for better performance
-    log_with_time(f"Starting optimized face comparison with {len(face_records)} stored encodings")
-    matches_found = []
-    best_match = None
-    best_distance = float('inf')
-
-    # Pre-normalize captured encoding for efficiency
-    norm_captured = np.linalg.norm(captured_encoding)
-    if norm_captured == 0:
-        print(json.dumps({"matched": False, "error": "Invalid face encoding detected"}))
-        sys.exit(1)
+    normalized_captured = capture_normalized_encoding(image, {"matched": False}, capture)
 
-    normalized_captured = captured_encoding / norm_captured
+    # Optimization 7: Vectorized distance calculation for better performance
+    log_with_time(f"Starting optimized face comparison with {len(gallery)} stored encodings")
 
-    for i, (employeeID, face_encoding_blob, created_at) in enumerate(face_records):
-        try:
-            # Deserialize the stored encoding (should be pickled binary data)
-            if isinstance(face_encoding_blob, bytes):
-                stored_encoding = pickle.loads(face_encoding_blob)
-            else:
-                # Fallback for string format (if migrating from old system)
-                try:
-                    stored_encoding = np.array([float(x) for x in face_encoding_blob.split(',')])
-                except:
-                    stored_encoding = np.array(json.loads(face_encoding_blob))
-
-            stored_encoding = np.array(stored_encoding)
-
-            # Calculate cosine similarity/distance (optimized)
-            norm_stored = np.linalg.norm(stored_encoding)
-            if norm_stored == 0:
-                continue  # Skip if stored encoding is zero vector
-
-            normalized_stored = stored_encoding / norm_stored
-            cosine_similarity = np.dot(normalized_captured, normalized_stored)
-            cosine_distance = 1 - cosine_similarity
-
-            if cosine_distance < MATCH_THRESHOLD:
-                match_info = {
-                    "user_id": employeeID,
-                    "distance": float(cosine_distance),
-                    "similarity": float(cosine_similarity),
-                    "created_at": str(created_at)
-                }
-                matches_found.append(match_info)
-
-                # Track best match
-                if cosine_distance < best_distance:
-                    best_distance = cosine_distance
-                    best_match = match_info
-
-        except Exception as e:
-            continue
+    # One matrix-vector product over the whole gallery
+    with span("compare"):
+        matches_found, best_match = gallery.compare(normalized_captured, MATCH_THRESHOLD)
 
     log_with_time(f"Face matching completed - Found {len(matches_found)} matches")
 
     # ONLY STORE IF FACE MATCHES
     if matches_found:
-        # Store the captured face encoding since it's a successful match
-        storage_success = store_face_encoding_to_db(employee_id, captured_encoding, cursor, conn)
-
-        response = {
+        # Keep the captured face encoding as a template since it's a successful match
+        template = store_matched_template(employee_id, normalized_captured, gallery, conn)
+        return {
             "matched": True,
-            "stored": storage_success,
+            "stored": template_stored(template),
+            "template": template,
             "best_match": best_match,
             "all_matches": matches_found,
             "total_matches": len(matches_found),
-            "records_checked": len(face_records),
-            "message": "Face matched and encoding stored successfully" if storage_success else "Face matched but storage failed"
+            "records_checked": len(gallery),
+            "message": template_message(template)
         }
-        print(json.dumps(response))
-    else:
-        # DO NOT STORE if no match found
-        response = {
+
+    # DO NOT STORE if no match found
+    return {
+        "matched": False,
+        "stored": False,
+        "records_checked": len(gallery),
+        "message": "Face does not match any stored encodings. Not storing unmatched face."
+    }
+
+def match_face_burst(frames, employee_id, conn):
+    """Match a burst of stills or a short clip, stopping at the first frame that matches.
+
+    frames is any iterable (see face_image.iter_frames); each frame goes through
+    decode, detect, liveness, embed and compare before the next one is touched.
+    A spoofed frame ends the burst, so extra frames never buy extra liveness tries.
+    """
+    gallery = load_employee_gallery(employee_id, conn)
+    if gallery is None:
+        record_outcome("no_gallery")
+        raise FaceProcessingError({
             "matched": False,
             "stored": False,
-            "records_checked": len(face_records),
-            "message": "Face does not match any stored encodings. Not storing unmatched face."
+            "error": "No face data found for this employee. Please register first."
+        })
+
+    frame_outcomes = []
+    last_rejection = None
+    embedded = 0
+    for index, frame in enumerate(frames):
+        try:
+            normalized_captured = capture_normalized_encoding(frame, {"matched": False})
+        except FaceProcessingError as rejected:
+            frame_outcomes.append({"frame": index, "outcome": rejected.reason or "error"})
+            last_rejection = rejected
+            if rejected.reason == "spoof":
+                break
+            continue
+
+        embedded += 1
+        with span("compare"):
+            matches_found, best_match = gallery.compare(normalized_captured, MATCH_THRESHOLD)
+        if matches_found:
+            log_with_time(f"Burst matched on frame {index}")
+            record_outcome(None)
+            template = store_matched_template(employee_id, normalized_captured, gallery, conn)
+            frame_outcomes.append({"frame": index, "outcome": "matched", "distance": best_match["distance"]})
+            return {
+                "matched": True,
+                "stored": template_stored(template),
+                "template": template,
+                "best_match": best_match,
+                "all_matches": matches_found,
+                "total_matches": len(matches_found),
+                "records_checked": len(gallery),
+                "decided_by_frame": index,
+                "frames_processed": index + 1,
+                "frame_outcomes": frame_outcomes,
+                "message": template_message(template)
+            }
+        frame_outcomes.append({"frame": index, "outcome": "no_match",
+                               "distance": float(np.min(gallery.distances(normalized_captured)))})
+
+    # No usable face in any frame: report it like a rejected single still
+    if not embedded:
+        payload = last_rejection.payload if last_rejection else {
+            "matched": False, "stored": False, "error": "No frames received"
         }
-        print(json.dumps(response))
+        raise FaceProcessingError({**payload, "frames_processed": len(frame_outcomes), "frame_outcomes": frame_outcomes},
+                                  last_rejection.reason if last_rejection else None)
+
+    record_outcome(None)
+    return {
+        "matched": False,
+        "stored": False,
+        "records_checked": len(gallery),
+        "decided_by_frame": None,
+        "frames_processed": len(frame_outcomes),
+        "frame_outcomes": frame_outcomes,
+        "message": "Face does not match any stored encodings. Not storing unmatched face."
+    }
+
+def identify_face(image, conn, capture=None):
+    """1:N identification: find the employee whose templates best match the face.
+
+    Uses the process-wide IVF index (built from face_data on first use) instead
+    of a per-employee gallery. Returns the response dict; rejected images raise
+    FaceProcessingError.
+    """
+    precheck_capture(image, {"matched": False})
+
+    with span("index_load"):
+        face_index = get_face_index(conn)
+    if not len(face_index):
+        record_outcome("no_gallery")
+        raise FaceProcessingError({
+            "matched": False,
+            "stored": False,
+            "error": "No face data registered."
+        })
 
-except Exception as e:
-    conn.rollback()
-    print(json.dumps({"matched": False, "stored": False, "error": str(e)}))
+    normalized_captured = capture_normalized_encoding(image, {"matched": False}, capture)
 
-finally:
-    # Cleanup temporary file if created
-    if temp_image_path and os.path.exists(temp_image_path):
-        try:
-            os.remove(temp_image_path)
-            log_with_time("Temporary image file cleaned up")
-        except Exception as e:
-            log_with_time(f"Error cleaning up temporary file: {str(e)}")
-
-    cursor.close()
-    conn.close()
-    log_with_time("Script execution completed")
\ No newline at end of file
+    # Employees of the nearest rows, re-ranked exactly over all their templates
+    with span("index_search"):
+        nearest = face_index.identify(normalized_captured, k=IDENTIFY_CANDIDATES)
+    ranked = [{"user_id": candidate_id, "distance": distance, "similarity": 1.0 - distance}
+              for candidate_id, distance, _ in nearest]
+    log_with_time(f"Face identification completed - best distance {ranked[0]['distance'] if ranked else None}")
+
+    if not ranked or ranked[0]["distance"] >= MATCH_THRESHOLD:
+        return {
+            "matched": False,
+            "stored": False,
+            "candidates": ranked,
+            "records_checked": len(face_index),
+            "message": "Face does not match any registered employee."
+        }
+
+    best_match = ranked[0]
+    employee_id = best_match["user_id"]
+    gallery = load_employee_gallery(employee_id, conn)
+    template = None
+    if gallery is not None and len(gallery):
+        template = store_matched_template(employee_id, normalized_captured, gallery, conn)
+
+    return {
+        "matched": True,
+        "employee_id": employee_id,
+        "stored": template_stored(template),
+        "template": template,
+        "best_match": best_match,
+        "candidates": ranked,
+        "records_checked": len(face_index),
+        "message": template_message(template)
+    }
+
+def run_match(image, employee_id, conn):
+    """Returns (response, exit_code) exactly as the CLI reports them, plus per-stage timings"""
+    with traced_request("identify" if employee_id is None else "match") as trace:
+        key = None
+        if result_cache.max_entries and not is_burst_source(image):
+            with span("result_cache"):
+                key = content_key(image, employee_id)
+                cached = result_cache.get(key)
+            if cached is not None:
+                return trace.finish(cached_response(cached), cached["exit_code"]), cached["exit_code"]
+
+        capture = {}
+        response, exit_code = dispatch_match(image, employee_id, conn, capture)
+        # Only outcomes of the upload itself: a face that was embedded or rejected
+        # by the pipeline, not DB errors or a missing registration
+        if key is not None and "liveness" in capture and (exit_code == 1 or not response.get("error")):
+            result_cache.put(key, {**capture, "response": response, "exit_code": exit_code})
+        return trace.finish(response, exit_code), exit_code
+
+def cached_response(cached):
+    """The earlier response to the same upload; nothing is stored again"""
+    log_with_time("Result cache hit: same image resubmitted for this employee")
+    return {**cached["response"], "stored": False, "cached": True}
+
+def dispatch_match(image, employee_id, conn, capture=None):
+    """No employee_id means identify"""
+    try:
+        if employee_id is None:
+            return identify_face(image, conn, capture), 0
+        if is_burst_source(image):
+            return match_face_burst(iter_frames(image), employee_id, conn), 0
+        return match_face(image, employee_id, conn, capture), 0
+    except FaceProcessingError as rejected:
+        return rejected.payload, 1
+    except Exception as e:
+        conn.rollback()
+        return {"matched": False, "stored": False, "error": str(e)}, 0
+
+if __name__ == "__main__":
+    # Load environment variables from .env
+    log_with_time("Match face Script started")
+    dotenv_loaded = load_dotenv()
+    if not dotenv_loaded:
+        sys.exit(1)
+
+    # Get command line arguments ('-' reads the image bytes from stdin; a directory
+    # of frames or a video clip is matched as a burst); without an employee id
+    # the script identifies the face across all employees
+    if len(sys.argv) < 2:
+        print("Usage: python match_face.py <image_path|frames_dir|video|-> [employee_id]", file=sys.stderr)
+        sys.exit(1)
+    image_path = sys.argv[1]
+    employee_id = sys.argv[2] if len(sys.argv) > 2 else None
+
+    # Database connection
+    log_with_time("start database connection")
+    conn = get_db_connection()
+    log_with_time("end database connection")
+
+    try:
+        response, exit_code = run_match(read_image_source(image_path), employee_id, conn)
+        print(json.dumps(response))
+    finally:
+        conn.close()
+        log_with_time("Script execution completed")
+    sys.exit(exit_code)
@@ -0,0 +1,88 @@
+# MIGRATE face_data.face_encoding TO THE COMPACT BINARY FORMAT
+# Rewrites legacy pickle / comma-separated / JSON rows (and binary rows that
+# predate L2-normalization) in id order, one chunk
+# per transaction, so it can run (and be re-run) while the app is serving.
+#
+# Usage: python migrate_face_encodings.py [--chunk-size 500] [--dry-run]
+from dotenv import load_dotenv
+import sys
+import json
+import argparse
+from face_common import log_with_time, EMBEDDING_DIMENSION
+from face_db import get_db_connection
+from face_encoding import is_current_format, read_header, legacy_format, decode_face_encoding, encode_face_encoding
+from face_gallery import normalize_embedding
+
+def migrate_chunk(rows, stats):
+    """Convert one chunk of (id, face_encoding) rows; returns [(blob, id), ...] to write"""
+    updates = []
+    for row_id, blob in rows:
+        current = is_current_format(blob)
+        if current and read_header(blob)[2]:
+            stats["already_current"] += 1
+            continue
+        try:
+            fmt = "unnormalized" if current else legacy_format(blob)
+            vector = decode_face_encoding(blob)
+            if vector.shape != (EMBEDDING_DIMENSION,):
+                raise ValueError(f"unexpected dimension {vector.shape}")
+            # Stored L2-normalized, see face_gallery.py
+            normalized = normalize_embedding(vector)
+        except Exception as e:
+            log_with_time(f"Skipping face_data row {row_id}: {str(e)}")
+            stats["failed"] += 1
+            continue
+        stats[fmt] += 1
+        updates.append((encode_face_encoding(normalized, normalized=True), row_id))
+    return updates
+
+def migrate(conn, chunk_size=500, dry_run=False):
+    stats = {
+        "scanned": 0, "already_current": 0, "unnormalized": 0,
+        "pickle": 0, "csv": 0, "json": 0, "failed": 0, "rewritten": 0
+    }
+    cursor = conn.cursor()
+    last_id = 0
+    try:
+        while True:
+            # Keyset pagination keeps every chunk an index range scan
+            cursor.execute("""
+                           SELECT id, face_encoding
+                           FROM face_data
+                           WHERE id > %s
+                           ORDER BY id
+                               LIMIT %s
+                           """, (last_id, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            stats["scanned"] += len(rows)
+
+            updates = migrate_chunk(rows, stats)
+            if updates and not dry_run:
+                cursor.executemany("UPDATE face_data SET face_encoding = %s WHERE id = %s", updates)
+                conn.commit()
+                stats["rewritten"] += len(updates)
+            log_with_time(f"Migrated up to face_data.id {last_id} ({stats['rewritten']} rows rewritten)")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rewrite legacy face_data encodings in the compact binary format")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be rewritten")
+    args = parser.parse_args()
+
+    load_dotenv()
+    conn = get_db_connection()
+    try:
+        stats = migrate(conn, args.chunk_size, args.dry_run)
+    finally:
+        conn.close()
+    print(json.dumps(stats))
+    sys.exit(1 if stats["failed"] else 0)
@@ -2,93 +2,27 @@
 from dotenv import load_dotenv
 import os
 import sys
-import mysql.connector
 import json
 import numpy as np
-from deepface import DeepFace
-import pickle
-from PIL import Image
-import cv2
-import tempfile
 from datetime import datetime
-
-def log_with_time(message):
-    timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
-    print(f"[{timestamp}] {message}", file=sys.stderr, flush=True)
-
-# Load environment variables from .env
-log_with_time("Register face Script started")
-dotenv_loaded = load_dotenv()
-# if not dotenv_loaded:
-#     print("Error: .env file not found or could not be loaded", file=sys.stderr)
-#     sys.exit(1)
-
-# Get arguments
-# if len(sys.argv) < 3:
-#     print("Usage: python register_face.py <image_path> <user_id>", file=sys.stderr)
-#     sys.exit(1)
-
-image_path = sys.argv[1]
-user_id = sys.argv[2]
-
-# Validate user_id is numeric
-try:
-    user_id_int = int(user_id)
-except ValueError:
-    print("Error: user_id must be a valid integer", file=sys.stderr)
-    sys.exit(1)
-
-# Optimization 1: Image preprocessing function
-def preprocess_image(image_path, target_size=(640, 640)):
-    """Resize image to reduce processing time while maintaining quality"""
-    try:
-        img = cv2.imread(image_path)
-        if img is None:
-            return image_path  # Return original if can't load
-
-        # Resize if image is too large
-        height, width = img.shape[:2]
-        if height > target_size[0] or width > target_size[1]:
-            log_with_time(f"Resizing image from {width}x{height} to optimize processing")
-            # Calculate scaling factor to maintain aspect ratio
-            scale = min(target_size[0]/height, target_size[1]/width)
-            new_width = int(width * scale)
-            new_height = int(height * scale)
-            img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
-
-            # Save resized image to temporary file
-            temp_fd, temp_path = tempfile.mkstemp(suffix='.jpg')
-            os.close(temp_fd)  # Close file descriptor
-            cv2.imwrite(temp_path, img)
-            log_with_time(f"Image resized and saved to temporary file")
-            return temp_path
-
-        return image_path
-    except Exception as e:
-        log_with_time(f"Error preprocessing image: {str(e)}")
-        return image_path
-
-# Optimization 2: Quick face detection check
-def quick_face_check(image_path):
-    """Quick face detection using opencv to pre-filter images"""
-    try:
-        faces = DeepFace.extract_faces(
-            img_path=image_path,
-            detector_backend='opencv',  # Fastest detector
-            enforce_detection=False,
-            align=False,
-            anti_spoofing=False
-        )
-        face_count = len(faces) if faces else 0
-        log_with_time(f"Quick face check detected {face_count} faces")
-        return face_count == 1  # Return True if exactly one face
-    except Exception as e:
-        log_with_time(f"Quick face check failed: {str(e)}")
-        return False  # Proceed with full processing if quick check fails
+from face_common import (
+    log_with_time, EMBEDDING_DIMENSION
+)
+from face_cache import gallery_cache, result_cache
+from face_db import get_db_connection, employee_exists, fetch_employee_face_ids, insert_face_encoding, database_errors
+from face_encoding import encode_face_encoding, decode_face_encoding
+from face_gallery import FaceGallery, normalize_embedding
+from face_image import read_image_source
+from face_index import loaded_face_index
+from face_metrics import span, traced_request, record_outcome
+from face_pipeline import extract_face_embedding, precheck_image, FaceRejected
+from face_templates import archive_face_rows, save_centroid
+from face_writeback import write_behind_queue
 
 def validate_image(image_path):
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"Image file not found: {image_path}")
+    from PIL import Image
     try:
         with Image.open(image_path) as img:
             img.verify()
@@ -96,151 +30,161 @@ def validate_image(image_path):
     except Exception as e:
         raise ValueError(f"Invalid image file: {e}")
 
-def extract_face_encoding(image_path):
-    temp_image_path = None
+def extract_face_encoding(image):
     try:
-        # Optimization 3: Preprocess image first
-        log_with_time("start image preprocessing")
-        processed_image_path = preprocess_image(image_path)
-        if processed_image_path != image_path:
-            temp_image_path = processed_image_path  # Track for cleanup
-        log_with_time("end image preprocessing")
-
-        # Optimization 4: Quick face detection check
-        log_with_time("start quick face detection check")
-        if not quick_face_check(processed_image_path):
-            log_with_time("Quick face check failed - proceeding with full processing")
-        else:
-            log_with_time("Quick face check passed - single face detected")
-        log_with_time("end quick face detection check")
-
-        # Use optimized detector backend (mtcnn for better speed/accuracy balance)
-        detector_backend = 'mtcnn'
-
-        # Anti-spoofing check
-        log_with_time(f"start deepface.extract_faces({detector_backend}, antispoofing=true)")
-        faces = DeepFace.extract_faces(
-            img_path=processed_image_path,
-            detector_backend=detector_backend,
-            enforce_detection=True,
-            align=True,
-            anti_spoofing=True
-        )
-        log_with_time(f"end deepface.extract_faces({detector_backend}, antispoofing=true)")
-
-        # Check if faces were detected
-        if not faces or len(faces) == 0:
-            raise ValueError("No face detected in the image")
-
-        # Reject image if more than one face is detected
-        if len(faces) > 1:
-            raise ValueError("Multiple faces detected. Please ensure only one face is visible.")
-
-        # Check if the face is real (not spoofed)
-        if not faces[0].get("is_real", False):
-            raise ValueError("Please use a real face, not a photo or video")
-
-        # Generate face encoding using same detector
-        log_with_time(f"Start face encoding generation using Facenet, {detector_backend}")
-        face_encodings = DeepFace.represent(
-            img_path=processed_image_path,
-            model_name='Facenet',
-            detector_backend=detector_backend,
-            enforce_detection=True
-        )
-        log_with_time(f"end face encoding generation using Facenet, {detector_backend}")
-
-        if not face_encodings or len(face_encodings) == 0:
-            raise ValueError("No face detected in the image.")
-
-        face_encoding = np.array(face_encodings[0]["embedding"])
-
-        if len(face_encoding) != 128:
+        # Optimization 3: Decode and resize once in memory, then detect and align once
+        # and reuse the crop for liveness and Facenet
+        try:
+            face = extract_face_embedding(image)
+        except FaceRejected as rejected:
+            record_outcome(rejected.reason)
+            raise ValueError(str(rejected))
+
+        face_encoding = np.asarray(face["embedding"], dtype=np.float32)
+
+        if len(face_encoding) != EMBEDDING_DIMENSION:
             raise ValueError(f"Unexpected encoding dimension: {len(face_encoding)}")
 
-        return face_encoding
+        # Stored L2-normalized so matching is a single matrix-vector product
+        return normalize_embedding(face_encoding)
 
     except Exception as e:
         if "Face could not be detected" in str(e):
             raise ValueError("No face detected in the image. Please ensure the image contains a clear face.")
         else:
             raise ValueError(f"Face encoding extraction failed: {str(e)}")
-    finally:
-        # Cleanup temporary file if created
-        if temp_image_path and os.path.exists(temp_image_path):
-            try:
-                os.remove(temp_image_path)
-                log_with_time("Temporary image file cleaned up")
-            except Exception as e:
-                log_with_time(f"Error cleaning up temporary file: {str(e)}")
-
-def store_face_data_binary(user_id_int, face_encoding_blob):
-    conn = None
+
+def store_face_data_binary(user_id_int, face_encoding_blob, conn=None):
+    # Reuse the caller's connection (face worker) or open a short-lived one (CLI)
+    owns_connection = conn is None
     cursor = None
 
     try:
-        log_with_time("start database connection")
-        conn = mysql.connector.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASS"),
-            database=os.getenv("DB_DATABASE"),
-            autocommit=False
-        )
+        if owns_connection:
+            log_with_time("start database connection")
+            conn = get_db_connection()
+            log_with_time("end database connection")
         cursor = conn.cursor()
-        log_with_time("end database connection")
 
         # Check if employee exists
-        cursor.execute("SELECT id FROM employee WHERE id = %s", (user_id_int,))
-        if not cursor.fetchone():
+        if not employee_exists(conn, user_id_int):
             raise ValueError(f"Employee with ID {user_id_int} not found in employee table")
 
-        # Check if face data already exists
-        cursor.execute("SELECT id FROM face_data WHERE employeeID = %s", (user_id_int,))
-        existing_record = cursor.fetchone()
-
-        if existing_record:
-            log_with_time("Updating existing face data")
-            cursor.execute("""
-                           UPDATE face_data
-                           SET face_encoding = %s, createdAt = NOW()
-                           WHERE employeeID = %s
-                           """, (face_encoding_blob, user_id_int))
-        else:
-            log_with_time("Inserting new face data")
-            cursor.execute("""
-                           INSERT INTO face_data (employeeID, face_encoding, createdAt)
-                           VALUES (%s, %s, NOW())
-                           """, (user_id_int, face_encoding_blob))
+        # Re-registration starts a fresh template set: archive the old templates
+        existing_ids = fetch_employee_face_ids(conn, user_id_int)
+
+        if existing_ids:
+            log_with_time(f"Archiving {len(existing_ids)} existing face templates")
+            archive_face_rows(existing_ids, cursor)
+
+        log_with_time("Inserting new face data")
+        row_id = insert_face_encoding(conn, user_id_int, face_encoding_blob)
+
+        # The enrollment image seeds the running centroid
+        save_centroid(user_id_int, decode_face_encoding(face_encoding_blob), 1, conn)
 
         conn.commit()
         log_with_time("Face data stored successfully")
+        return row_id
 
-    except mysql.connector.Error as db_error:
+    except database_errors() as db_error:
         if conn:
             conn.rollback()
         raise Exception(f"Database error: {str(db_error)}")
 
+    except Exception:
+        # Pooled connections keep their session, so never hand one back mid-transaction
+        if conn:
+            conn.rollback()
+        raise
+
     finally:
         if cursor:
             cursor.close()
-        if conn:
+        if conn and owns_connection:
             conn.close()
-        log_with_time("Database connection closed")
+            log_with_time("Database connection closed")
 
-# Main execution
-try:
-    # validate_image(image_path)
-    face_encoding = extract_face_encoding(image_path)
+def check_registration(image, user_id_int, conn=None):
+    """Image and employee checks that need no model, run before any inference"""
+    try:
+        precheck_image(image)
+    except FaceRejected as rejected:
+        record_outcome(rejected.reason)
+        raise ValueError(str(rejected))
+
+    owns_connection = conn is None
+    if owns_connection:
+        conn = get_db_connection()
+    try:
+        if not employee_exists(conn, user_id_int):
+            record_outcome("unknown_employee")
+            raise ValueError(f"Employee with ID {user_id_int} not found in employee table")
+    finally:
+        if owns_connection:
+            conn.close()
 
-    # Use binary storage method (LONGBLOB)
-    face_encoding_blob = pickle.dumps(face_encoding)
-    store_face_data_binary(user_id_int, face_encoding_blob)
+def register_face(image, user_id_int, conn=None):
+    # validate_image(image_path)
+    check_registration(image, user_id_int, conn)
+    face_encoding = extract_face_encoding(image)
+
+    # Use compact binary storage format (LONGBLOB)
+    face_encoding_blob = encode_face_encoding(face_encoding, normalized=True)
+    with span("store"):
+        row_id = store_face_data_binary(user_id_int, face_encoding_blob, conn)
+
+    # Re-registration replaces the employee's gallery; samples matched against
+    # the old face must not be written into the new one
+    queue = write_behind_queue()
+    if queue is not None:
+        queue.discard(user_id_int)
+    gallery_cache.invalidate(user_id_int)
+    result_cache.invalidate(user_id_int)
+    face_index = loaded_face_index()
+    if face_index is not None:
+        gallery = FaceGallery(face_encoding.reshape(1, -1), [row_id], [user_id_int], [datetime.now()])
+        face_index.replace_employee(user_id_int, gallery)
 
     log_with_time("Registration completed successfully")
-    print(json.dumps({"success": True, "message": "Face registered successfully"}))
+    return {"success": True, "message": "Face registered successfully"}
 
-except Exception as e:
-    log_with_time(f"Registration failed: {str(e)}")
-    print(json.dumps({"success": False, "error": str(e)}))
-    sys.exit(1)
\ No newline at end of file
+def run_register(image, user_id, conn=None):
+    """Returns (response, exit_code) exactly as the CLI reports them, plus per-stage timings"""
+    with traced_request("register") as trace:
+        response, exit_code = attempt_register(image, user_id, conn)
+        return trace.finish(response, exit_code), exit_code
+
+def attempt_register(image, user_id, conn=None):
+    # Validate user_id is numeric
+    try:
+        user_id_int = int(user_id)
+    except ValueError:
+        return {"success": False, "error": "user_id must be a valid integer"}, 1
+
+    try:
+        return register_face(image, user_id_int, conn), 0
+    except Exception as e:
+        log_with_time(f"Registration failed: {str(e)}")
+        return {"success": False, "error": str(e)}, 1
+
+if __name__ == "__main__":
+    # Load environment variables from .env
+    log_with_time("Register face Script started")
+    dotenv_loaded = load_dotenv()
+    # if not dotenv_loaded:
+    #     print("Error: .env file not found or could not be loaded", file=sys.stderr)
+    #     sys.exit(1)
+
+    # Get arguments
+    # if len(sys.argv) < 3:
+    #     print("Usage: python register_face.py <image_path> <user_id>", file=sys.stderr)
+    #     sys.exit(1)
+
+    # '-' reads the image bytes from stdin
+    image_path = sys.argv[1]
+    user_id = sys.argv[2]
+
+    response, exit_code = run_register(read_image_source(image_path), user_id)
+    print(json.dumps(response))
+    sys.exit(exit_code)
@@ -0,0 +1,194 @@
+# ACCURACY CHECK: ONNX BACKEND VS DEEPFACE
+# Detects the face in every image of a directory once (MTCNN, as in
+# production), then runs Facenet and Fasnet on the same crops through the
+# DeepFace backend (the reference) and through the ONNX models from
+# export_onnx_models.py, fp32 and/or int8. Reports per variant:
+#
+#   embedding_drift   cosine distance between reference and ONNX embeddings
+#   match_decisions   agreement of the MATCH_THRESHOLD decision over every
+#                     image pair, both ONNX-vs-ONNX and ONNX probes against
+#                     templates stored by the DeepFace backend
+#   liveness          agreement of the real/spoof verdict and score drift
+#   latency_ms        p50/p95 of one embed and one liveness call
+#   rss_mb            RSS of a fresh interpreter that loads only that backend
+#                     and runs one inference
+#
+# Usage: python verify_onnx_backend.py <image dir> [--variants fp32,int8]
+#                                      [--max-drift 0.02] [--output report.json]
+import os
+# The reference path must be DeepFace whatever the service is configured with
+os.environ["FACE_INFERENCE_BACKEND"] = "deepface"
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+from face_common import current_rss_mb, MATCH_THRESHOLD, MODEL_NAME
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+VARIANTS = {"fp32": False, "int8": True}
+
+def percentiles(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {"p50": float(np.percentile(ms, 50)), "p95": float(np.percentile(ms, 95))} if len(ms) else None
+
+def load_faces(images):
+    """(name, BGR frame, detected face) for every image with exactly one face"""
+    from face_pipeline import load_bgr_image, detect_faces, FaceRejected
+
+    faces = []
+    for image_path in images:
+        try:
+            img = load_bgr_image(image_path)
+            detected = detect_faces(img)
+        except FaceRejected:
+            continue
+        if len(detected) == 1:
+            faces.append((os.path.basename(image_path), img, detected[0]))
+    return faces
+
+def run_backend(faces, facenet, fasnet):
+    """Normalized embeddings, liveness results and per-call latencies for one backend"""
+    from face_gallery import normalize_embedding
+
+    embeddings, liveness = [], []
+    embed_times, liveness_times = [], []
+    for _, img, face in faces:
+        area = face["facial_area"]
+        started = time.perf_counter()
+        is_real, score = fasnet.analyze(img=img, facial_area=(area["x"], area["y"], area["w"], area["h"]))
+        liveness_times.append(time.perf_counter() - started)
+        liveness.append((bool(is_real), float(score)))
+
+        started = time.perf_counter()
+        embeddings.append(normalize_embedding(facenet.embed([face["face"]])[0]))
+        embed_times.append(time.perf_counter() - started)
+    return {
+        "embeddings": np.vstack(embeddings) if embeddings else np.empty((0, 0)),
+        "liveness": liveness,
+        "latency_ms": {"embed": percentiles(embed_times), "liveness": percentiles(liveness_times)}
+    }
+
+class DeepFaceFacenet:
+    """The reference embed path behind the same interface as OnnxFacenet"""
+
+    def embed(self, face_crops):
+        from face_pipeline import embed_faces
+        return embed_faces(face_crops)
+
+def decisions(probes, templates):
+    """Match decision for every probe/template pair except an image against itself"""
+    distances = 1.0 - probes @ templates.T
+    return (distances < MATCH_THRESHOLD)[~np.eye(len(probes), dtype=bool)]
+
+def compare(reference, candidate):
+    drift = 1.0 - np.sum(reference["embeddings"] * candidate["embeddings"], axis=1)
+    ref_decisions = decisions(reference["embeddings"], reference["embeddings"])
+    onnx_decisions = decisions(candidate["embeddings"], candidate["embeddings"])
+    cross_decisions = decisions(candidate["embeddings"], reference["embeddings"])
+    verdicts = [ref[0] == cand[0] for ref, cand in zip(reference["liveness"], candidate["liveness"])]
+    score_drift = [abs(ref[1] - cand[1]) for ref, cand in zip(reference["liveness"], candidate["liveness"])]
+    return {
+        "embedding_drift": {
+            "mean": float(np.mean(drift)),
+            "p95": float(np.percentile(drift, 95)),
+            "max": float(np.max(drift))
+        },
+        "match_decisions": {
+            "pairs": int(ref_decisions.size),
+            "reference_matches": int(ref_decisions.sum()),
+            "agreement": float(np.mean(ref_decisions == onnx_decisions)) if ref_decisions.size else None,
+            "cross_backend_agreement": float(np.mean(ref_decisions == cross_decisions)) if ref_decisions.size else None,
+            "self_match_rate": float(np.mean(drift < MATCH_THRESHOLD))
+        },
+        "liveness": {
+            "agreement": float(np.mean(verdicts)),
+            "score_drift_max": float(np.max(score_drift))
+        },
+        "latency_ms": candidate["latency_ms"]
+    }
+
+def rss_child(backend, quantized):
+    """Runs in a fresh interpreter: RSS after loading one backend and running one inference"""
+    blank = np.zeros((160, 160, 3), dtype=np.uint8)
+    before = current_rss_mb()
+    if backend == "onnx":
+        from face_onnx import OnnxFacenet, OnnxFasnet
+        facenet, fasnet = OnnxFacenet(quantized=quantized), OnnxFasnet(quantized=quantized)
+    else:
+        from deepface import DeepFace
+        facenet, fasnet = DeepFaceFacenet(), DeepFace.build_model("Fasnet", task="spoofing")
+    fasnet.analyze(img=blank, facial_area=(0, 0, 159, 159))
+    facenet.embed([blank / 255])
+    return {"baseline": before, "loaded": current_rss_mb(), "tensorflow_imported": "tensorflow" in sys.modules}
+
+def measure_rss(backend, quantized=False):
+    args = [sys.executable, os.path.abspath(__file__), "--rss-child", backend] + (["--quantized"] if quantized else [])
+    output = subprocess.run(args, check=True, stdout=subprocess.PIPE, env=dict(os.environ)).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+def verify(images, variants, max_drift):
+    from deepface import DeepFace
+    from face_onnx import OnnxFacenet, OnnxFasnet
+
+    faces = load_faces(images)
+    if len(faces) < 2:
+        raise ValueError("Need at least two images with exactly one detectable face")
+
+    reference_models = (DeepFaceFacenet(), DeepFace.build_model("Fasnet", task="spoofing"))
+    run_backend(faces[:1], *reference_models)  # warm-up, not timed
+    reference = run_backend(faces, *reference_models)
+    report = {
+        "images": len(images),
+        "faces": len(faces),
+        "model": MODEL_NAME,
+        "match_threshold": MATCH_THRESHOLD,
+        "max_drift": max_drift,
+        "deepface": {"latency_ms": reference["latency_ms"], "rss_mb": measure_rss("deepface")},
+        "variants": {}
+    }
+
+    for variant in variants:
+        quantized = VARIANTS[variant]
+        models = (OnnxFacenet(quantized=quantized), OnnxFasnet(quantized=quantized))
+        run_backend(faces[:1], *models)
+        result = compare(reference, run_backend(faces, *models))
+        result["rss_mb"] = measure_rss("onnx", quantized)
+        result["within_max_drift"] = result["embedding_drift"]["max"] <= max_drift
+        report["variants"][variant] = result
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the ONNX inference backend with DeepFace")
+    parser.add_argument("images", help="Directory of sample face images (one face each)")
+    parser.add_argument("--variants", default="fp32,int8", help="Comma-separated ONNX variants: fp32, int8")
+    parser.add_argument("--max-drift", type=float, default=0.02,
+                        help="Largest embedding cosine distance from DeepFace that is still acceptable")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--rss-child", choices=("deepface", "onnx"), help=argparse.SUPPRESS)
+    parser.add_argument("--quantized", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Libraries print progress to stdout; keep it for the report only
+    report_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    if args.rss_child:
+        report_out.write(json.dumps(rss_child(args.rss_child, args.quantized)) + "\n")
+        sys.exit(0)
+
+    variants = [v.strip() for v in args.variants.split(",") if v.strip()]
+    unknown = [v for v in variants if v not in VARIANTS]
+    if unknown:
+        sys.exit(f"Unknown variants: {', '.join(unknown)}")
+
+    images = [os.path.join(args.images, name) for name in sorted(os.listdir(args.images))
+              if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+    report = verify(images, variants, args.max_drift)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    report_out.write(json.dumps(report, indent=2) + "\n")
+    sys.exit(0)
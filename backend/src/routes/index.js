@@ -3,8 +3,10 @@ const path = require('path');
 const multer = require('multer');
 const {loginHandler} = require("../modules/auth");
 const {faceMatchHandler, faceRegistrationHandler, faceIsAvailable} = require("../modules/facial");
+const {runFaceTask} = require("../modules/facial/face.worker");
 const {punchHandler, getAttendanceHandler, getAttendanceHistoryHandler} = require("../modules/attendance");
 const {adaptRequest, sendResponse} = require('../util/http');
+const {authGuard} = require('./middleware');
 const router = express.Router();
 
 // // Change password
@@ -77,6 +79,17 @@ router.post("/face/match/:userId", upload.single('image'), async (req, res) => {
 
 });
 
+// Face pipeline latency histograms (Prometheus text format); internal
+// queue, timing and memory figures, so only for authenticated callers
+router.get("/face/metrics", authGuard, async (req, res) => {
+    try {
+        const {result} = await runFaceTask('metrics');
+        return res.type('text/plain').send(result.prometheus);
+    } catch (err) {
+        return res.status(503).type('text/plain').send(err.message);
+    }
+});
+
 // Check if face exists
 router.get("/face/isAvailable/:userId", async (req, res) => {
     const httpRequest = adaptRequest(req);